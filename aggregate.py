@@ -0,0 +1,157 @@
+import logging
+import os
+import sqlite3
+import sys
+import tempfile
+import weakref
+from constants import DEFAULT_AGGREGATE_MEMORY_LIMIT
+from utils import escape_sql_string
+
+# Approximate bytes of a dict entry, its key tuple and usage on top of the key strings
+ENTRY_OVERHEAD = 200
+
+
+def _remove_spill_file(path):
+    if os.path.exists(path):
+        os.remove(path)
+
+
+class UsageAggregate:
+    """
+    Sum the usage of chargeable rows per (partnerID, product, productPurchasedPlanID, plan).
+
+    Groups keep the order they were first seen in, so an aggregated run lists its rows in the
+    same order as the first row of each group in a normal run. Once the estimated size exceeds
+    memory_limit bytes, the groups move to a temporary SQLite file and are summed there.
+
+    Args:
+        memory_limit (int): Estimated bytes to hold in memory before spilling to disk.
+        spill_folder (str): Folder of the temporary SQLite file (default: the system temp folder).
+    """
+
+    def __init__(self, memory_limit=DEFAULT_AGGREGATE_MEMORY_LIMIT, spill_folder=None):
+        self.memory_limit = memory_limit
+        self.spill_folder = spill_folder
+        self.rows_added = 0
+
+        self._groups = {}  # (partnerID, product, productPurchasedPlanID, plan) -> usage, in first-seen order
+        self._memory = 0
+        self._connection = None
+        self._next_slot = 0
+
+    @property
+    def spilled(self):
+        return self._connection is not None
+
+    def add(self, rows, row_count=None):
+        """
+        Add chargeable rows to their groups.
+
+        Args:
+            rows (iterable): (partnerID, product, productPurchasedPlanID, plan, usage) tuples.
+            row_count (int): The number of chargeable rows the tuples sum up, when they are
+                partial sums (default: one per tuple).
+        """
+        added = self._add_spilled(iter(rows)) if self.spilled else self._add(iter(rows))
+        self.rows_added += added if row_count is None else row_count
+
+    def _add(self, rows):
+        groups = self._groups
+        added = 0
+        for partner_id, product, plan_id, plan, usage in rows:
+            added += 1
+            key = (partner_id, product, plan_id, plan)
+            total = groups.get(key)
+            if total is not None:
+                groups[key] = total + usage
+                continue
+            groups[key] = usage
+            self._memory += sys.getsizeof(plan_id) + sys.getsizeof(plan) + ENTRY_OVERHEAD
+            if self._memory > self.memory_limit:
+                self._spill()
+                return added + self._add_spilled(rows)
+        return added
+
+    def _spill(self):
+        """
+        Move the groups to a temporary SQLite file.
+        """
+        handle, path = tempfile.mkstemp(prefix="usage_translator_aggregate_", suffix=".db", dir=self.spill_folder)
+        os.close(handle)
+        self._finalizer = weakref.finalize(self, _remove_spill_file, path)
+        logging.info(f"Usage aggregate is over {self.memory_limit} bytes, moving it to {path}")
+
+        connection = sqlite3.connect(path)
+        connection.execute("PRAGMA journal_mode = OFF")
+        connection.execute("PRAGMA synchronous = OFF")
+        connection.execute(
+            "CREATE TABLE groups (partnerID INTEGER, product TEXT, productPurchasedPlanID TEXT, plan TEXT, usage INTEGER, slot INTEGER, "
+            "PRIMARY KEY (partnerID, product, productPurchasedPlanID, plan))"
+        )
+        connection.executemany(
+            "INSERT INTO groups VALUES (?, ?, ?, ?, ?, ?)",
+            ((*key, usage, slot) for slot, (key, usage) in enumerate(self._groups.items())),
+        )
+        self._connection = connection
+        self._next_slot = len(self._groups)
+        self._groups = {}
+        self._memory = 0
+
+    def _add_spilled(self, rows):
+        added = 0
+
+        def numbered(rows):
+            nonlocal added
+            for row in rows:
+                yield (*row, self._next_slot + added)
+                added += 1
+
+        self._connection.executemany(
+            "INSERT INTO groups VALUES (?, ?, ?, ?, ?, ?) "
+            "ON CONFLICT (partnerID, product, productPurchasedPlanID, plan) DO UPDATE SET usage = usage + excluded.usage",
+            numbered(rows),
+        )
+        self._next_slot += added
+        return added
+
+    def rows(self):
+        """
+        Iterate over (partnerID, product, productPurchasedPlanID, plan, usage) tuples, one per group.
+        """
+        if self.spilled:
+            yield from self._connection.execute(
+                "SELECT partnerID, product, productPurchasedPlanID, plan, usage FROM groups ORDER BY slot"
+            )
+            return
+        for (partner_id, product, plan_id, plan), usage in self._groups.items():
+            yield partner_id, product, plan_id, plan, usage
+
+    def __len__(self):
+        if self.spilled:
+            return self._connection.execute("SELECT count(*) FROM groups").fetchone()[0]
+        return len(self._groups)
+
+    def log_reduction(self):
+        """
+        Log how many chargeable rows were collapsed into how many groups.
+        """
+        groups = len(self)
+        if self.rows_added:
+            logging.info(f"Aggregated {self.rows_added} chargeable rows into {groups} ({1 - groups / self.rows_added:.1%} fewer rows)")
+
+    def close(self):
+        """
+        Remove the temporary SQLite file, if the groups were spilled.
+        """
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
+            self._finalizer()
+
+
+def render_rows(rows):
+    """
+    Render (partnerID, product, productPurchasedPlanID, plan, usage) tuples as VALUES tuples, like render_chargeable_rows.
+    """
+    for partner_id, product, plan_id, plan, usage in rows:
+        yield f"\t({partner_id}, '{product}', '{plan_id}', '{escape_sql_string(plan)}', {usage})"
@@ -0,0 +1,432 @@
+import glob
+import json
+import logging
+import os
+import shutil
+import tempfile
+from collections import defaultdict, deque
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import closing, contextmanager, nullcontext
+from itertools import chain, islice
+from constants import (
+    REQUIRED_COLUMNS,
+    CHARGEABLE_SQL_FILE,
+    DOMAINS_SQL_FILE,
+    BATCH_SUMMARY_FILE,
+    REPORT_EXTENSIONS,
+    DEFAULT_CHUNK_SIZE,
+    DEFAULT_WRITE_BUFFER_SIZE,
+    DEFAULT_DOMAIN_MEMORY_LIMIT,
+    DEFAULT_SMALL_REPORT_BYTES,
+    REPORTS_IN_FLIGHT_PER_WORKER,
+)
+from compressed_io import input_codec, output_path, open_output
+from domain_index import DomainIndex
+from metrics import RunMetrics, NullMetrics
+from mmap_scanner import MappedReport
+from sql_writer import chargeable_sql_writer, generate_domains_sql
+from stdlib_engine import read_report_stdlib, translate_rows
+from utils import SkippedRowSummary
+from validation import log_rows
+
+# The rules of the batch, sent to each worker process once by _init_worker
+_worker_rules = None
+
+
+def find_reports(pattern):
+    """
+    List the reports of a batch: the report files in a directory, or the files matching a glob pattern.
+
+    Returns:
+        csv_paths (list): The report paths, sorted.
+    """
+    if os.path.isdir(pattern):
+        paths = [
+            os.path.join(pattern, name) for name in os.listdir(pattern)
+            if any(name.endswith(extension) for extension in REPORT_EXTENSIONS)
+        ]
+    else:
+        paths = glob.glob(pattern)
+    return sorted(path for path in paths if os.path.isfile(path))
+
+
+def report_name(csv_path):
+    """
+    Name the outputs of a report after its file name, without the report extension.
+    """
+    name = os.path.basename(csv_path)
+    for extension in sorted(REPORT_EXTENSIONS, key=len, reverse=True):
+        if name.endswith(extension):
+            return name[:-len(extension)]
+    return name
+
+
+def _init_worker(rules):
+    global _worker_rules
+    _worker_rules = rules
+
+
+class _RecordFile(logging.Handler):
+    """
+    Write the log records of one report in a worker process to a file, one JSON [level, message]
+    per line, so the main process can log them in report order through its own handlers.
+    """
+
+    def __init__(self, path):
+        super().__init__(logging.INFO)
+        self._file = open(path, "w")
+
+    def emit(self, record):
+        self._file.write(json.dumps([record.levelno, record.getMessage()]) + "\n")
+
+    def close(self):
+        self._file.close()
+        super().close()
+
+
+@contextmanager
+def _captured_logs(log_path):
+    """
+    Send the log records of the enclosed block to log_path instead of the worker's handlers.
+    """
+    root = logging.getLogger()
+    handlers, level = root.handlers[:], root.level
+    handler = _RecordFile(log_path)
+    root.handlers = [handler]
+    root.setLevel(logging.INFO)
+    try:
+        yield
+    finally:
+        root.handlers = handlers
+        root.setLevel(level)
+        handler.close()
+
+
+def _domains_fragment_path(fragment_path):
+    return f"{fragment_path}.domains"
+
+
+def _write_domains_fragment(path, domain_partners):
+    """
+    Write the (domain, plan ID) pairs of a report to path, one JSON pair per line.
+    """
+    with open(path, "w") as f:
+        f.writelines(f"{json.dumps(pair)}\n" for pair in domain_partners.items())
+
+
+def _read_domains_fragment(path):
+    """
+    Read the (domain, plan ID) pairs written by _write_domains_fragment.
+    """
+    with open(path) as f:
+        for line in f:
+            yield tuple(json.loads(line))
+
+
+def _replay_logs(log_path):
+    """
+    Log the records a worker captured with _captured_logs, and remove their file.
+    """
+    if not os.path.exists(log_path):
+        return
+    with open(log_path) as f:
+        for line in f:
+            level, message = json.loads(line)
+            logging.log(level, message)
+    os.remove(log_path)
+
+
+def _rendered_rows(csv_path, rules, product_totals, domain_partners, skip_summary, metrics, options):
+    """
+    Translate a report with the stdlib or mmap engine, or for csv_engine "auto" with the stdlib
+    engine if it is small enough, otherwise with pandas in chunks.
+
+    The required columns are checked before the first chunk is yielded.
+
+    Yields:
+        sql_rows (list): The rendered VALUES tuples of each chunk, in CSV order.
+    """
+    csv_engine = options["csv_engine"]
+    if csv_engine in ("stdlib", "mmap") or (csv_engine == "auto" and os.path.getsize(csv_path) <= options["small_report_bytes"]):
+        report = MappedReport(csv_path) if csv_engine == "mmap" and not input_codec(csv_path) else read_report_stdlib(csv_path, options["chunk_size"])
+        with closing(report) if isinstance(report, MappedReport) else nullcontext():
+            _check_report(report)
+            row_offset = 0
+            for rows in metrics.timed(report.blocks(), "read_csv"):
+                with metrics.stage("translate"):
+                    sql_rows, row_log = translate_rows(rows, rules, product_totals, domain_partners)
+                with metrics.stage("log_rows"):
+                    log_rows(row_log, row_offset, skip_summary)
+                metrics.count("rows_read", len(rows))
+                metrics.count("rows_valid", len(sql_rows))
+                row_offset += len(rows)
+                yield sql_rows
+        return
+
+    from csv_reader import read_report
+    from processor import translate_chunks, render_chargeable_rows
+
+    chunks = read_report(csv_path, csv_engine, chunksize=options["chunk_size"])
+    first_chunk = next(chunks, None)
+    _check_report(first_chunk)
+    for chargeable_rows in translate_chunks(chain([first_chunk], chunks), rules, product_totals, domain_partners, skip_summary, metrics):
+        with metrics.stage("render"):
+            sql_rows = render_chargeable_rows(chargeable_rows)
+        yield sql_rows
+
+
+def _check_report(report):
+    """
+    Check that a report (or its first chunk) has rows and the required columns, like the command line does.
+    """
+    if report is None or report.empty:
+        raise ValueError("CSV file is empty")
+    missing_columns = [column for column in REQUIRED_COLUMNS if column not in report.columns]
+    if missing_columns:
+        raise ValueError(f"CSV file is missing required columns: {', '.join(missing_columns)}")
+
+
+def _translate_report(csv_path, output_folder, fragment_path, log_path, options):
+    """
+    Translate one report in a worker process.
+
+    Without fragment_path, the report's chargeable and domains SQL are written to output_folder.
+    With it, the VALUES tuples are written to fragment_path, one per line, and the domain map to
+    the fragment's _domains_fragment_path, so the main process can merge the reports. The report's log records (e.g. each
+    skipped row with skipped_rows "full") are written to log_path, see _replay_logs.
+
+    Returns:
+        result (dict): The report's totals and skip counts (see translate_reports), with
+            "stages" and "peak_rss_bytes" for the batch metrics.
+    """
+    with _captured_logs(log_path):
+        return _translate_report_logged(csv_path, output_folder, fragment_path, options)
+
+
+def _translate_report_logged(csv_path, output_folder, fragment_path, options):
+    product_totals = defaultdict(int)
+    domain_partners = DomainIndex(options["domain_memory_limit"])
+    skip_summary = SkippedRowSummary(log_each_row=options["skipped_rows"] == "full")
+    metrics = RunMetrics()
+    result = {"report": csv_path, "error": None}
+    output_paths = []
+    try:
+        rendered = _rendered_rows(csv_path, _worker_rules, product_totals, domain_partners, skip_summary, metrics, options)
+        # The report is checked before its first rows are yielded, so a bad report leaves no output behind
+        rendered = chain([next(rendered)], rendered)
+        if fragment_path is None:
+            name = report_name(csv_path)
+            codec = options["output_compression"]
+            chargeable_path = output_path(os.path.join(output_folder, f"{name}_{CHARGEABLE_SQL_FILE}"), codec)
+            domains_path = output_path(os.path.join(output_folder, f"{name}_{DOMAINS_SQL_FILE}"), codec)
+            output_paths += [chargeable_path, domains_path]
+            with open_output(chargeable_path, codec, options["compression_level"]) as f, chargeable_sql_writer(f, options["batch_insert_size"], options["buffer_size"], options["max_statement_bytes"]) as writer:
+                for sql_rows in rendered:
+                    with metrics.stage("write"):
+                        writer.write_rows(sql_rows)
+            with open_output(domains_path, codec, options["compression_level"]) as f:
+                generate_domains_sql(domain_partners, f, options["batch_insert_size"], options["buffer_size"], options["max_statement_bytes"])
+            result.update(chargeable_sql=chargeable_path, domains_sql=domains_path)
+        else:
+            with open(fragment_path, "w") as fragment:
+                for sql_rows in rendered:
+                    fragment.writelines(f"{sql_row}\n" for sql_row in sql_rows)
+            _write_domains_fragment(_domains_fragment_path(fragment_path), domain_partners)
+    except Exception as e:
+        # A report that fails for any reason is summarized and its partial SQL files removed, so the rest of the batch goes on
+        result["error"] = str(e) if isinstance(e, (OSError, ValueError)) else f"{type(e).__name__}: {e}"
+        for path in output_paths:
+            if os.path.exists(path):
+                os.remove(path)
+    finally:
+        domain_partners.close()
+
+    result.update(
+        rows_read=metrics.counters.get("rows_read", 0),
+        rows_valid=metrics.counters.get("rows_valid", 0),
+        rows_skipped=skip_summary.total,
+        product_totals=dict(product_totals),
+        domain_conflicts=domain_partners.conflicts,
+        skipped_rows=skip_summary.counts,
+        skipped_samples=skip_summary.samples,
+        stages=metrics.to_dict()["stages"],
+        peak_rss_bytes=metrics.peak_rss_bytes,
+    )
+    return result
+
+
+def translate_reports(csv_paths, rules, output_folder, workers=1, merge=False, batch_insert_size=0, buffer_size=DEFAULT_WRITE_BUFFER_SIZE, max_statement_bytes=0, csv_engine="auto", small_report_bytes=DEFAULT_SMALL_REPORT_BYTES, chunk_size=DEFAULT_CHUNK_SIZE, output_compression="none", compression_level=None, domain_memory_limit=DEFAULT_DOMAIN_MEMORY_LIMIT, skipped_rows="full", metrics=None):
+    """
+    Translate a batch of reports concurrently on one pool of worker processes.
+
+    The rules are sent to each worker once. Each worker translates whole reports, so one
+    report's reads and writes overlap with the translation of others. Small reports are
+    translated with the stdlib engine, larger ones with pandas, as in a single run.
+
+    Without merge, each report gets its own <name>_chargeable_insert_rows.sql and
+    <name>_domains_insert_rows.sql in output_folder. With merge, the reports are combined
+    into one chargeable_insert_rows.sql and one domains_insert_rows.sql, in the order of
+    csv_paths, with the domain map updated report by report as in a single run.
+
+    Each worker's log records are logged by the main process once its report is done, so the
+    messages of one report stay together and go through the main process's handlers. Only
+    REPORTS_IN_FLIGHT_PER_WORKER reports per worker are submitted ahead of the one being
+    logged or merged, and the rows and domains of a merged report come through fragment
+    files rather than the pool, so the main process's memory doesn't grow with the batch.
+
+    Args:
+        csv_paths (list): The report paths, see find_reports.
+        rules (RuleTable): The compiled rules.
+        output_folder (str): The folder for the SQL files.
+        workers (int): The number of worker processes.
+        merge (bool): If set, the reports are merged into one pair of SQL files.
+        batch_insert_size (int): The number of rows to include in each batch insert statement.
+            default: 0 (no batching).
+        buffer_size (int): The number of characters the SqlInsertWriter buffers within one statement.
+        max_statement_bytes (int): The largest statement to write, in bytes, see SqlInsertWriter.
+            default: 0 (no limit).
+        csv_engine (str): One of CSV_ENGINES, see usage_translator --csv-engine. "mmap" reads
+            compressed reports with the stdlib engine.
+        small_report_bytes (int): Largest report that csv_engine "auto" translates with the stdlib engine.
+        chunk_size (int): The number of CSV rows pandas translates at a time.
+        output_compression (str): One of OUTPUT_CODECS.
+        compression_level (int): The compression level, or None for the codec's default.
+        domain_memory_limit (int): Estimated bytes of each domain index to hold in memory, see DomainIndex.
+        skipped_rows (str): "full" to log every skipped row, or "summary" for only the counts per reason.
+        metrics (RunMetrics): Optional collector for the stage timings and row counters of all
+            reports, summed over the workers, and the peak memory of the busiest process.
+
+    Returns:
+        summary (dict): "reports" with the result of each report (its path, error, SQL files,
+            rows_read, rows_valid, rows_skipped, product_totals, domain_conflicts, skipped_rows and
+            skipped_samples), "product_totals" summed over the reports, and "failed_reports".
+    """
+    os.makedirs(output_folder, exist_ok=True)
+    options = {
+        "batch_insert_size": batch_insert_size,
+        "buffer_size": buffer_size,
+        "max_statement_bytes": max_statement_bytes,
+        "csv_engine": csv_engine,
+        "small_report_bytes": small_report_bytes,
+        "chunk_size": chunk_size,
+        "output_compression": output_compression,
+        "compression_level": compression_level,
+        "domain_memory_limit": domain_memory_limit,
+        "skipped_rows": skipped_rows,
+    }
+    metrics = metrics or NullMetrics()
+    work_folder = tempfile.mkdtemp(prefix="usage_translator_batch_")
+    fragment_paths = [os.path.join(work_folder, f"report_{index}.sql") if merge else None for index in range(len(csv_paths))]
+    log_paths = [os.path.join(work_folder, f"report_{index}.log") for index in range(len(csv_paths))]
+
+    product_totals = defaultdict(int)
+    results = []
+
+    def report_results(executor):
+        # Submit reports as earlier ones finish, and drop each future once its result is taken
+        pending = deque()
+        report_args = iter(zip(csv_paths, fragment_paths, log_paths))
+
+        def submit_next():
+            for csv_path, fragment_path, log_path in islice(report_args, 1):
+                pending.append(executor.submit(_translate_report, csv_path, output_folder, fragment_path, log_path, options))
+
+        for _ in range(workers * REPORTS_IN_FLIGHT_PER_WORKER):
+            submit_next()
+        while pending:
+            result = pending.popleft().result()
+            submit_next()
+            yield result
+
+    def finished_reports(report_results):
+        for result, log_path in zip(report_results, log_paths):
+            _replay_logs(log_path)
+            metrics.merge_stages(result.pop("stages"))
+            metrics.peak_rss_bytes = max(metrics.peak_rss_bytes, result.pop("peak_rss_bytes"))
+            metrics.count("rows_read", result["rows_read"])
+            metrics.count("rows_valid", result["rows_valid"])
+            for reason, count in result["skipped_rows"].items():
+                metrics.skipped_rows[reason] = metrics.skipped_rows.get(reason, 0) + count
+            yield _log_report(result)
+
+    try:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(rules,)) as executor:
+            if merge:
+                _merge_reports(finished_reports(report_results(executor)), fragment_paths, output_folder, options, results)
+            else:
+                results.extend(finished_reports(report_results(executor)))
+    finally:
+        shutil.rmtree(work_folder, ignore_errors=True)
+
+    for result in results:
+        if result["error"] is not None:
+            continue  # Its rows aren't in the SQL files, so its partial totals aren't either
+        for part_number, total in result["product_totals"].items():
+            product_totals[part_number] += total
+    return {
+        "reports": results,
+        "product_totals": dict(product_totals),
+        "failed_reports": sum(1 for result in results if result["error"] is not None),
+    }
+
+
+def _merge_reports(finished_reports, fragment_paths, output_folder, options, results):
+    """
+    Write the fragments and domain maps of the reports, in order, to one pair of SQL files.
+    """
+    codec = options["output_compression"]
+    domain_partners = DomainIndex(options["domain_memory_limit"])
+
+    def merged_rows():
+        for result, fragment_path in zip(finished_reports, fragment_paths):
+            results.append(result)
+            if result["error"] is not None:
+                continue
+            domains_path = _domains_fragment_path(fragment_path)
+            domain_partners.update(_read_domains_fragment(domains_path))
+            os.remove(domains_path)
+            with open(fragment_path) as fragment:
+                for sql_row in fragment:
+                    yield sql_row[:-1]
+            os.remove(fragment_path)
+
+    try:
+        chargeable_path = output_path(os.path.join(output_folder, CHARGEABLE_SQL_FILE), codec)
+        with open_output(chargeable_path, codec, options["compression_level"]) as f, chargeable_sql_writer(f, options["batch_insert_size"], options["buffer_size"], options["max_statement_bytes"]) as writer:
+            writer.write_rows(merged_rows())
+        domains_path = output_path(os.path.join(output_folder, DOMAINS_SQL_FILE), codec)
+        with open_output(domains_path, codec, options["compression_level"]) as f:
+            generate_domains_sql(domain_partners, f, options["batch_insert_size"], options["buffer_size"], options["max_statement_bytes"])
+        domain_partners.log_conflicts()
+    finally:
+        domain_partners.close()
+    logging.info(f"Merged {len(results)} reports into {chargeable_path} and {domains_path}")
+
+
+def _log_report(result):
+    """
+    Log the outcome of one report of the batch.
+    """
+    if result["error"] is not None:
+        logging.error(f"Failed to translate {result['report']}: {result['error']}")
+        return result
+    logging.info(f"Translated {result['report']}: {result['rows_valid']} of {result['rows_read']} rows")
+    skip_summary = SkippedRowSummary()
+    skip_summary.counts, skip_summary.samples = result["skipped_rows"], result["skipped_samples"]
+    skip_summary.log()
+    if result["domain_conflicts"]:
+        logging.warning(f"  {result['domain_conflicts']} domain assignments in {result['report']} replaced a different partnerPurchasedPlanID")
+    return result
+
+
+def write_summary(summary, output_folder):
+    """
+    Write the summary of a batch as JSON to BATCH_SUMMARY_FILE in output_folder.
+
+    Returns:
+        summary_path (str): The path of the summary file.
+    """
+    summary_path = os.path.join(output_folder, BATCH_SUMMARY_FILE)
+    with open(summary_path, "w") as f:
+        json.dump(summary, f, indent=2)
+    return summary_path
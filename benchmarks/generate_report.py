@@ -0,0 +1,138 @@
+import argparse
+import json
+import numpy as np
+from constants import DEFAULT_JSON_FILE, PARTNER_IDS_TO_SKIP, UNIT_REDUCTION
+
+REPORT_COLUMNS = [
+    "PartnerID", "partnerGuid", "accountid", "accountGuid", "username", "domains",
+    "itemname", "plan", "itemType", "PartNumber", "itemCount",
+]
+PLANS = ["E2016_Exch_1_HOSTWAY", "E2016_Comp_Sec_1_HOSTWAY", "E2016_Exch_Skype_1_HOSTWAY", "E2013_Everything_1"]
+ITEM_NAMES = ["Account_contacts", "Dns_foreignDomains", "SpamStopper_advancedFilteringMailboxes", "Exchange_mailboxes"]
+PARTNER_COUNT = 500
+BLOCK_ROWS = 500000
+
+# Kinds of invalid rows, drawn uniformly
+MISSING_PART_NUMBER = 0
+NON_POSITIVE_ITEM_COUNT = 1
+UNKNOWN_PART_NUMBER = 2
+
+
+def _guid(prefix, value):
+    """
+    Build a deterministic, canonical GUID string from an integer id.
+    """
+    return f"{prefix:08x}-0000-4000-8000-{value:012x}"
+
+
+def account_fields(domain_count):
+    """
+    Pre-render the per-account fields, so rows only have to index into them.
+
+    Every domain belongs to its own account, and every account to one of PARTNER_COUNT partners.
+
+    Returns:
+        before_item_name (np.ndarray): ",partnerGuid,accountid,accountGuid,username,domains," per account.
+        after_item_name (np.ndarray): ",plan,itemType," per account.
+    """
+    before_item_name = np.array([
+        f",{_guid(1, 10000 + domain_id % PARTNER_COUNT)},{1000000 + domain_id},{_guid(2, domain_id)},user{domain_id},acct{domain_id}.serverdata.net,"
+        for domain_id in range(domain_count)
+    ], dtype=object)
+    after_item_name = np.array([f",{PLANS[domain_id % len(PLANS)]},0," for domain_id in range(domain_count)], dtype=object)
+    return before_item_name, after_item_name
+
+
+def generate_block(rng, rows, part_numbers, invalid_ratio, skip_ratio, unit_reduction_ratio, accounts):
+    """
+    Generate one block of synthetic report lines.
+
+    Args:
+        rng (np.random.Generator): Random source.
+        rows (int): The number of rows to generate.
+        part_numbers (list): Typemap part numbers without a unit reduction.
+        invalid_ratio (float): Share of rows that fail validation (missing or unknown PartNumber, itemCount <= 0).
+        skip_ratio (float): Share of rows whose PartnerID is in the skip list.
+        unit_reduction_ratio (float): Share of rows whose PartNumber has a unit reduction.
+        accounts (tuple): The pre-rendered account fields returned by account_fields.
+
+    Returns:
+        lines (np.ndarray): The CSV lines, without line breaks.
+    """
+    before_item_name, after_item_name = accounts
+    domain_ids = rng.integers(0, len(before_item_name), rows)
+    partner_ids = 10000 + domain_ids % PARTNER_COUNT
+    skipped = rng.random(rows) < skip_ratio
+    partner_ids[skipped] = rng.choice(PARTNER_IDS_TO_SKIP, skipped.sum())
+
+    unit_reduced = rng.random(rows) < unit_reduction_ratio
+    row_part_numbers = np.array(part_numbers, dtype=object)[rng.integers(0, len(part_numbers), rows)]
+    reduction_part_numbers = np.array(list(UNIT_REDUCTION), dtype=object)
+    row_part_numbers[unit_reduced] = reduction_part_numbers[rng.integers(0, len(reduction_part_numbers), unit_reduced.sum())]
+    item_counts = np.where(unit_reduced, rng.integers(1000, 100000, rows), rng.integers(1, 50, rows))
+
+    invalid = rng.random(rows) < invalid_ratio
+    invalid_kinds = rng.integers(0, 3, rows)
+    row_part_numbers[invalid & (invalid_kinds == MISSING_PART_NUMBER)] = ""
+    row_part_numbers[invalid & (invalid_kinds == UNKNOWN_PART_NUMBER)] = "NOT_IN_TYPEMAP"
+    item_counts[invalid & (invalid_kinds == NON_POSITIVE_ITEM_COUNT)] = 0
+
+    item_names = np.array(ITEM_NAMES, dtype=object)[rng.integers(0, len(ITEM_NAMES), rows)]
+    return (
+        partner_ids.astype(str).astype(object)
+        + before_item_name[domain_ids]
+        + item_names
+        + after_item_name[domain_ids]
+        + row_part_numbers
+        + ","
+        + item_counts.astype(str).astype(object)
+    )
+
+
+def generate_report(path, rows, type_map, invalid_ratio=0.1, skip_ratio=0.01, unit_reduction_ratio=0.05, domain_count=10000, seed=0):
+    """
+    Write a synthetic usage report with the same schema as data/Sample_Report.csv.
+
+    Rows are generated and written in blocks, so reports of 100M rows don't have to fit in memory.
+    Each domain belongs to its own account, so domain_count also sets the number of distinct GUIDs.
+
+    Args:
+        path (str): Path of the CSV file to write.
+        rows (int): The number of data rows.
+        type_map (dict): Mapping of part numbers to product names; valid rows use its part numbers.
+        invalid_ratio (float): Share of rows that fail validation.
+        skip_ratio (float): Share of rows whose PartnerID is in the skip list.
+        unit_reduction_ratio (float): Share of rows whose PartNumber has a unit reduction.
+        domain_count (int): The number of distinct domains (and accounts) in the report.
+        seed (int): Random seed, so reports are reproducible.
+    """
+    rng = np.random.default_rng(seed)
+    part_numbers = [part_number for part_number in type_map if part_number not in UNIT_REDUCTION]
+    accounts = account_fields(domain_count)
+    with open(path, "w") as f:
+        f.write(",".join(REPORT_COLUMNS) + "\n")
+        for start in range(0, rows, BLOCK_ROWS):
+            lines = generate_block(rng, min(BLOCK_ROWS, rows - start), part_numbers, invalid_ratio, skip_ratio, unit_reduction_ratio, accounts)
+            f.write("\n".join(lines))
+            f.write("\n")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate a synthetic usage report")
+    parser.add_argument("output", help="Path of the CSV file to write")
+    parser.add_argument("--rows", type=int, default=1000000, help="Number of data rows")
+    parser.add_argument("--json", default=DEFAULT_JSON_FILE, help="Path to the typemap JSON file")
+    parser.add_argument("--invalid-ratio", type=float, default=0.1, help="Share of rows that fail validation")
+    parser.add_argument("--skip-ratio", type=float, default=0.01, help="Share of rows whose PartnerID is in the skip list")
+    parser.add_argument("--unit-reduction-ratio", type=float, default=0.05, help="Share of rows whose PartNumber has a unit reduction")
+    parser.add_argument("--domains", type=int, default=10000, help="Number of distinct domains")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed")
+    args = parser.parse_args()
+
+    with open(args.json) as f:
+        type_map = json.load(f)
+    generate_report(args.output, args.rows, type_map, args.invalid_ratio, args.skip_ratio, args.unit_reduction_ratio, args.domains, args.seed)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,209 @@
+import argparse
+import json
+import logging
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone
+from multiprocessing import get_context
+from benchmarks.generate_report import generate_report
+from constants import DEFAULT_JSON_FILE, OUTPUT_FOLDER, CHARGEABLE_SQL_FILE, DOMAINS_SQL_FILE
+
+BENCHMARKS = ["generate_chargeable_sql", "generate_domains_sql", "main"]
+RESULTS_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), "results")
+REPO_FOLDER = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def _peak_rss_mb():
+    """
+    Peak resident set size of this process, in MB (ru_maxrss is in KB on Linux).
+    """
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def _bench_chargeable(csv_path, json_path, work_folder):
+    from csv_reader import read_report
+    from processor import generate_chargeable_sql
+
+    df = read_report(csv_path)
+    with open(json_path) as f:
+        type_map = json.load(f)
+    output_path = os.path.join(work_folder, CHARGEABLE_SQL_FILE)
+    start = time.perf_counter()
+    with open(output_path, "w") as output_file:
+        generate_chargeable_sql(df, type_map, output_file)
+    seconds = time.perf_counter() - start
+    return len(df), seconds, os.path.getsize(output_path), _peak_rss_mb()
+
+
+def _bench_domains(csv_path, json_path, work_folder):
+    import io
+    from csv_reader import read_report
+    from processor import generate_chargeable_sql, generate_domains_sql
+
+    df = read_report(csv_path)
+    with open(json_path) as f:
+        type_map = json.load(f)
+    _, domain_map = generate_chargeable_sql(df, type_map, io.StringIO())
+    output_path = os.path.join(work_folder, DOMAINS_SQL_FILE)
+    start = time.perf_counter()
+    with open(output_path, "w") as output_file:
+        generate_domains_sql(domain_map, output_file)
+    seconds = time.perf_counter() - start
+    return len(domain_map), seconds, os.path.getsize(output_path), _peak_rss_mb()
+
+
+def _run_case(benchmark, csv_path, json_path, work_folder):
+    """
+    Run one benchmark in the current (fresh) process.
+
+    Returns:
+        rows (int): The number of rows processed.
+        seconds (float): Wall-clock time of the measured section.
+        output_bytes (int): Size of the SQL written.
+        peak_rss_mb (float): Peak resident memory of the process.
+    """
+    logging.disable(logging.CRITICAL)
+    if benchmark == "generate_chargeable_sql":
+        return _bench_chargeable(csv_path, json_path, work_folder)
+    return _bench_domains(csv_path, json_path, work_folder)
+
+
+def _run_main(csv_path, rows, json_path, work_folder, extra_args):
+    """
+    Run usage_translator.py end to end in a subprocess, with work_folder as its working directory.
+    """
+    os.makedirs(os.path.join(work_folder, OUTPUT_FOLDER), exist_ok=True)
+    command = [
+        sys.executable, os.path.join(REPO_FOLDER, "usage_translator.py"),
+        "--csv", csv_path, "--json", json_path, "--skipped-rows", "summary", *extra_args,
+    ]
+    start = time.perf_counter()
+    process = subprocess.Popen(command, cwd=work_folder, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    _, status, usage = os.wait4(process.pid, 0)
+    seconds = time.perf_counter() - start
+    if os.waitstatus_to_exitcode(status) != 0:
+        raise RuntimeError(f"usage_translator.py failed: {' '.join(command)}")
+
+    output_bytes = sum(
+        os.path.getsize(os.path.join(work_folder, OUTPUT_FOLDER, name))
+        for name in (CHARGEABLE_SQL_FILE, DOMAINS_SQL_FILE)
+    )
+    return rows, seconds, output_bytes, usage.ru_maxrss / 1024
+
+
+def run_benchmark(benchmark, csv_path, rows, json_path, main_args=()):
+    """
+    Run one benchmark in a fresh process, so peak memory isn't inherited from earlier runs.
+
+    Returns:
+        result (dict): Rows, seconds, rows/sec, peak memory and output bytes/sec.
+    """
+    with tempfile.TemporaryDirectory(prefix="usage_translator_bench_") as work_folder:
+        if benchmark == "main":
+            rows, seconds, output_bytes, peak_rss_mb = _run_main(csv_path, rows, json_path, work_folder, list(main_args))
+        else:
+            with ProcessPoolExecutor(max_workers=1, mp_context=get_context("spawn")) as executor:
+                rows, seconds, output_bytes, peak_rss_mb = executor.submit(_run_case, benchmark, csv_path, json_path, work_folder).result()
+
+    return {
+        "benchmark": benchmark,
+        "rows": rows,
+        "seconds": round(seconds, 4),
+        "rows_per_sec": round(rows / seconds, 1) if seconds else None,
+        "peak_rss_mb": round(peak_rss_mb, 1),
+        "output_bytes": output_bytes,
+        "output_bytes_per_sec": round(output_bytes / seconds, 1) if seconds else None,
+    }
+
+
+def compare_results(results, baseline_path, tolerance):
+    """
+    Log each benchmark's throughput against a saved baseline and flag regressions.
+
+    Returns:
+        regressions (list): Names of the benchmarks that are slower than the baseline by more than tolerance.
+    """
+    with open(baseline_path) as f:
+        baseline = {(r["benchmark"], r["rows"]): r for r in json.load(f)["results"]}
+
+    regressions = []
+    for result in results:
+        previous = baseline.get((result["benchmark"], result["rows"]))
+        if previous is None or not previous["rows_per_sec"]:
+            continue
+        ratio = result["rows_per_sec"] / previous["rows_per_sec"]
+        flag = ""
+        if ratio < 1 - tolerance:
+            regressions.append(f"{result['benchmark']}[{result['rows']}]")
+            flag = " REGRESSION"
+        logging.info(f"  - {result['benchmark']} ({result['rows']} rows): {ratio:.2f}x baseline throughput{flag}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the usage translator pipeline")
+    parser.add_argument("--rows", type=int, nargs="+", default=[100000, 1000000], help="Report sizes to benchmark")
+    parser.add_argument("--benchmarks", nargs="+", choices=BENCHMARKS, default=BENCHMARKS, help="Benchmarks to run")
+    parser.add_argument("--json", default=DEFAULT_JSON_FILE, help="Path to the typemap JSON file")
+    parser.add_argument("--invalid-ratio", type=float, default=0.1, help="Share of rows that fail validation")
+    parser.add_argument("--skip-ratio", type=float, default=0.01, help="Share of rows whose PartnerID is in the skip list")
+    parser.add_argument("--unit-reduction-ratio", type=float, default=0.05, help="Share of rows whose PartNumber has a unit reduction")
+    parser.add_argument("--domains", type=int, default=10000, help="Number of distinct domains")
+    parser.add_argument("--main-args", nargs=argparse.REMAINDER, default=[], help="Extra arguments for the full main run, e.g. --stream --workers 4")
+    parser.add_argument("--output", help="Path of the JSON results file (default: benchmarks/results/<timestamp>.json)")
+    parser.add_argument("--compare", help="JSON results file of a previous run to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.1, help="Allowed throughput drop before a benchmark counts as a regression")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(message)s", datefmt="%Y-%m-%d %H:%M:%S")
+    json_path = os.path.abspath(args.json)
+    with open(json_path) as f:
+        type_map = json.load(f)
+
+    results = []
+    with tempfile.TemporaryDirectory(prefix="usage_translator_reports_") as report_folder:
+        for rows in args.rows:
+            csv_path = os.path.join(report_folder, f"report_{rows}.csv")
+            generate_report(csv_path, rows, type_map, args.invalid_ratio, args.skip_ratio, args.unit_reduction_ratio, args.domains)
+            for benchmark in args.benchmarks:
+                result = run_benchmark(benchmark, csv_path, rows, json_path, args.main_args)
+                logging.info(
+                    f"{benchmark} ({rows} rows): {result['seconds']}s, {result['rows_per_sec']} rows/sec, "
+                    f"{result['peak_rss_mb']} MB peak, {result['output_bytes_per_sec']} output bytes/sec"
+                )
+                results.append(result)
+
+    timestamp = datetime.now(timezone.utc)
+    output_path = args.output or os.path.join(RESULTS_FOLDER, f"{timestamp:%Y%m%dT%H%M%SZ}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output_path)), exist_ok=True)
+    with open(output_path, "w") as f:
+        json.dump({
+            "timestamp": timestamp.isoformat(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "parameters": {
+                "invalid_ratio": args.invalid_ratio,
+                "skip_ratio": args.skip_ratio,
+                "unit_reduction_ratio": args.unit_reduction_ratio,
+                "domains": args.domains,
+                "main_args": args.main_args,
+            },
+            "results": results,
+        }, f, indent=2)
+    logging.info(f"Saved results: {output_path}")
+
+    if args.compare:
+        logging.info(f"Compared with {args.compare}:")
+        if compare_results(results, args.compare, args.tolerance):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,270 @@
+import hashlib
+import io
+import json
+import logging
+import os
+import sqlite3
+import time
+from collections import defaultdict
+from contextlib import closing
+from itertools import islice
+import pandas as pd
+from constants import CHECKPOINT_FORMAT, PARTNER_IDS_TO_SKIP, DEFAULT_CHUNK_SIZE, DEFAULT_WRITE_BUFFER_SIZE, DEFAULT_CHECKPOINT_INTERVAL, DEFAULT_DOMAIN_MEMORY_LIMIT
+from csv_reader import read_report
+from compressed_io import open_input
+from processor import translate_chunks, render_chargeable_rows
+from sql_writer import chargeable_sql_writer
+from metrics import NullMetrics
+from domain_index import DomainIndex
+from rules import compile_rules
+
+
+class LineBlockReader:
+    """
+    Read the data rows of a CSV file in blocks of lines, keeping track of the byte offset reached.
+
+    Compressed (.gz, .zst) files are decompressed as they are read, with offsets into the
+    uncompressed data; continuing from an offset decompresses everything before it again,
+    but nothing before it is parsed or translated.
+
+    After each block is yielded, offset and rows_read point just past it, so a later run can
+    continue from there with LineBlockReader(csv_path, ..., offset, rows_read).
+
+    Args:
+        csv_path (str): Path to the CSV report file.
+        chunk_size (int): The number of rows per block.
+        offset (int): Byte offset of the first row to read, or 0 to start after the header row.
+        rows_read (int): The number of data rows before offset.
+        csv_engine (str): The engine each block is parsed with, see csv_reader.read_report.
+
+    Assumptions:
+    - Quoted fields never contain line breaks, so every line break ends a CSV record.
+    """
+
+    def __init__(self, csv_path, chunk_size=DEFAULT_CHUNK_SIZE, offset=0, rows_read=0, csv_engine="auto"):
+        self.csv_path = csv_path
+        self.chunk_size = chunk_size
+        self.offset = offset
+        self.rows_read = rows_read
+        self.csv_engine = csv_engine
+        self.columns = pd.read_csv(csv_path, nrows=0).columns.tolist()
+
+    def __iter__(self):
+        with open_input(self.csv_path) as f:
+            if self.offset == 0:
+                f.readline()  # Skip the header row
+            else:
+                f.seek(self.offset)
+            while True:
+                lines = list(islice(f, self.chunk_size))
+                if not lines:
+                    self.offset = f.tell()
+                    return
+                df = read_report(io.BytesIO(b"".join(lines)), self.csv_engine, header=None, names=self.columns)
+                df.index = pd.RangeIndex(self.rows_read, self.rows_read + len(df))
+                self.offset = f.tell()
+                self.rows_read += len(df)
+                yield df
+
+
+def run_key(csv_path, rules, batch_insert_size, max_statement_bytes=0):
+    """
+    Identify the input and the settings of a run, so a checkpoint is only resumed by the same run.
+    """
+    stat = os.stat(csv_path)
+    settings = json.dumps([rules.fingerprint(), int(batch_insert_size), int(max_statement_bytes)])
+    return {
+        "format": CHECKPOINT_FORMAT,
+        "csv": os.path.abspath(csv_path),
+        "csv_size": stat.st_size,
+        "csv_mtime_ns": stat.st_mtime_ns,
+        "settings_sha256": hashlib.sha256(settings.encode()).hexdigest(),
+    }
+
+
+def load_checkpoint(checkpoint_path, key):
+    """
+    Load a checkpoint written by a run with the same key.
+
+    Returns:
+        checkpoint (dict): The checkpoint, or None if there is none to resume.
+    """
+    try:
+        with open(checkpoint_path) as f:
+            checkpoint = json.load(f)
+    except FileNotFoundError:
+        return None
+    if checkpoint.get("key") != key:
+        logging.warning(f"Checkpoint {checkpoint_path} was written for a different input or settings, starting over")
+        return None
+    return checkpoint
+
+
+def save_checkpoint(checkpoint_path, checkpoint):
+    """
+    Write a checkpoint atomically, so a crash while saving leaves the previous one intact.
+    """
+    temp_path = f"{checkpoint_path}.tmp"
+    with open(temp_path, "w") as f:
+        json.dump(checkpoint, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temp_path, checkpoint_path)
+
+
+def remove_checkpoint(checkpoint_path):
+    for path in (checkpoint_path, domain_journal_path(checkpoint_path)):
+        if os.path.exists(path):
+            os.remove(path)
+
+
+def domain_journal_path(checkpoint_path):
+    return f"{checkpoint_path}.domains.db"
+
+
+class DomainJournal:
+    """
+    Keep the domain index of a resumable run in a SQLite file next to its checkpoint.
+
+    Each checkpoint appends only the domains changed since the previous one (see
+    DomainIndex.changes), numbered with the checkpoint's generation, so a checkpoint costs
+    the changes rather than the whole index. The changes are committed before the checkpoint
+    that counts them is saved; changes of a later generation than the checkpoint, from a run
+    interrupted in between, are dropped when it is resumed.
+
+    Args:
+        path (str): The path of the journal, see domain_journal_path.
+        fresh (bool): If set, any previous journal is discarded.
+    """
+
+    def __init__(self, path, fresh):
+        if fresh and os.path.exists(path):
+            os.remove(path)
+        self.connection = sqlite3.connect(path)
+        self.connection.execute("CREATE TABLE IF NOT EXISTS changes (generation INTEGER, domain TEXT, partnerPurchasedPlanID TEXT)")
+        self.connection.commit()
+
+    def append(self, generation, pairs):
+        """
+        Save the (domain, plan ID) pairs of one checkpoint.
+        """
+        self.connection.executemany("INSERT INTO changes VALUES (?, ?, ?)", ((generation, domain, plan_id) for domain, plan_id in pairs))
+        self.connection.commit()
+
+    def restore(self, generation, domain_partners):
+        """
+        Replay the changes of every checkpoint up to generation into domain_partners, in the order they were saved.
+        """
+        self.connection.execute("DELETE FROM changes WHERE generation > ?", (generation,))
+        self.connection.commit()
+        domain_partners.update(self.connection.execute("SELECT domain, partnerPurchasedPlanID FROM changes ORDER BY rowid"))
+
+    def close(self):
+        self.connection.close()
+
+
+def generate_chargeable_sql_resumable(csv_path, rules, output_path, checkpoint_path, partner_id_skip_list=PARTNER_IDS_TO_SKIP, batch_insert_size=0, chunk_size=DEFAULT_CHUNK_SIZE, buffer_size=DEFAULT_WRITE_BUFFER_SIZE, max_statement_bytes=0, checkpoint_interval=DEFAULT_CHECKPOINT_INTERVAL, skip_summary=None, metrics=None, csv_engine="auto", domain_memory_limit=DEFAULT_DOMAIN_MEMORY_LIMIT):
+    """
+    Generate SQL for chargeable inserts, saving a checkpoint every checkpoint_interval seconds.
+
+    If checkpoint_path holds a checkpoint of the same input and settings, the run continues from it:
+    the output file is cut back to the checkpointed offset and reading starts at the checkpointed
+    row, so no row is translated or written twice. The final output is identical to an
+    uninterrupted run. The checkpoint is left in place; remove it with remove_checkpoint once
+    everything that depends on the returned totals has been written.
+
+    Args:
+        csv_path (str): Path to the CSV report file.
+        rules (RuleTable or dict): The compiled rules, or a typemap dict, see generate_chargeable_sql.
+        output_path (str): Path of the SQL file to write.
+        checkpoint_path (str): Path of the checkpoint JSON file.
+        partner_id_skip_list (list): List of PartnerIDs to skip, when rules is a typemap dict.
+        batch_insert_size (int): The number of rows to include in each batch insert statement.
+            default: 0 (no batching).
+        chunk_size (int): The number of CSV rows translated between checkpoints, at most.
+        buffer_size (int): The number of characters the SqlInsertWriter buffers within one statement.
+        max_statement_bytes (int): The largest statement to write, in bytes, see SqlInsertWriter.
+            default: 0 (no limit).
+        checkpoint_interval (float): Minimum number of seconds between checkpoints.
+        skip_summary (SkippedRowSummary): Optional per-reason counter for skipped rows, see log_rows.
+            Its counts are saved with the checkpoint.
+        metrics (RunMetrics): Optional collector for the stage timings, see generate_chargeable_sql.
+        csv_engine (str): The engine CSV blocks are parsed with, see csv_reader.read_report.
+        domain_memory_limit (int): Estimated bytes of the domain index to hold in memory, see DomainIndex.
+
+    Returns:
+        product_totals (dict): Dictionary mapping part numbers to total item counts (with unit reduction).
+        domain_partners (DomainIndex): Index mapping domains to partnerPurchasedPlanID.
+
+    Assumptions:
+    - Quoted fields never contain line breaks (see LineBlockReader).
+    - Nothing else writes to output_path between the interrupted run and the resumed one.
+    """
+    metrics = metrics or NullMetrics()
+    rules = compile_rules(rules, partner_id_skip_list)
+    key = run_key(csv_path, rules, batch_insert_size, max_statement_bytes)
+    checkpoint = load_checkpoint(checkpoint_path, key)
+
+    product_totals = defaultdict(int)
+    domain_partners = DomainIndex(domain_memory_limit, track_changes=True)
+    journal = DomainJournal(domain_journal_path(checkpoint_path), fresh=checkpoint is None)
+    generation = 0
+    if checkpoint is None:
+        reader = LineBlockReader(csv_path, chunk_size, csv_engine=csv_engine)
+        output_file = open(output_path, "w")
+    else:
+        logging.info(f"Resuming from checkpoint {checkpoint_path} at row {checkpoint['rows_read'] + 2}")
+        reader = LineBlockReader(csv_path, chunk_size, checkpoint["input_offset"], checkpoint["rows_read"], csv_engine)
+        product_totals.update(checkpoint["product_totals"])
+        generation = checkpoint["domains"]["generation"]
+        journal.restore(generation, domain_partners)
+        domain_partners.conflicts = checkpoint["domains"]["conflicts"]
+        domain_partners.conflicting_domains = checkpoint["domains"]["conflicting_domains"]
+        domain_partners.mark_saved()
+        if skip_summary is not None:
+            skip_summary.counts = checkpoint["skipped_rows"]["counts"]
+            skip_summary.samples = checkpoint["skipped_rows"]["samples"]
+        output_file = open(output_path, "r+")
+        output_file.seek(checkpoint["output_offset"])
+        output_file.truncate()
+
+    with closing(journal), output_file, chargeable_sql_writer(output_file, batch_insert_size, buffer_size, max_statement_bytes) as writer:
+        if checkpoint is not None:
+            writer.restore(checkpoint["writer"])
+        last_checkpoint = time.monotonic()
+        for chargeable_rows in translate_chunks(reader, rules, product_totals, domain_partners, skip_summary, metrics):
+            with metrics.stage("render"):
+                sql_rows = render_chargeable_rows(chargeable_rows)
+            with metrics.stage("write"):
+                writer.write_rows(sql_rows)
+
+            if time.monotonic() - last_checkpoint >= checkpoint_interval:
+                with metrics.stage("checkpoint"):
+                    # The output must be on disk before a checkpoint points past it
+                    writer.flush()
+                    output_file.flush()
+                    os.fsync(output_file.fileno())
+                    generation += 1
+                    journal.append(generation, domain_partners.changes())
+                    domain_partners.mark_saved()
+                    save_checkpoint(checkpoint_path, {
+                        "key": key,
+                        "input_offset": reader.offset,
+                        "rows_read": reader.rows_read,
+                        "output_offset": output_file.tell(),
+                        "writer": writer.state(),
+                        "product_totals": product_totals,
+                        "domains": {
+                            "generation": generation,
+                            "conflicts": domain_partners.conflicts,
+                            "conflicting_domains": domain_partners.conflicting_domains,
+                        },
+                        "skipped_rows": {
+                            "counts": skip_summary.counts if skip_summary is not None else {},
+                            "samples": skip_summary.samples if skip_summary is not None else {},
+                        },
+                    })
+                logging.debug("Checkpoint saved at row %d", reader.rows_read + 1)
+                last_checkpoint = time.monotonic()
+
+    return product_totals, domain_partners
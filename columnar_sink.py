@@ -0,0 +1,216 @@
+import logging
+from collections import defaultdict
+from constants import (
+    CHARGEABLE_COLUMNS,
+    PARTNER_IDS_TO_SKIP,
+    DEFAULT_ROW_GROUP_SIZE,
+    DEFAULT_DOMAIN_MEMORY_LIMIT,
+)
+from processor import translate_chunks
+from metrics import NullMetrics
+from domain_index import DomainIndex
+from rules import compile_rules
+
+
+def _pyarrow():
+    try:
+        import pyarrow
+    except ImportError as e:
+        raise ImportError("Parquet and Arrow output requires the pyarrow package (pip install pyarrow)") from e
+    return pyarrow
+
+
+def chargeable_schema():
+    """
+    The Arrow schema of the chargeable table, in CHARGEABLE_COLUMNS order.
+    """
+    pa = _pyarrow()
+    return pa.schema([
+        pa.field("partnerID", pa.int64(), nullable=False),
+        pa.field("product", pa.string(), nullable=False),
+        pa.field("productPurchasedPlanID", pa.string(), nullable=False),
+        pa.field("plan", pa.string()),
+        pa.field("usage", pa.int64(), nullable=False),
+    ])
+
+
+def domains_schema():
+    """
+    The Arrow schema of the domains table, in DOMAINS_COLUMNS order.
+    """
+    pa = _pyarrow()
+    return pa.schema([
+        pa.field("domain", pa.string()),
+        pa.field("partnerPurchasedPlanID", pa.string(), nullable=False),
+    ])
+
+
+class ColumnarWriter:
+    """
+    Write record batches of one table to a Parquet or Arrow IPC file.
+
+    The columnar counterpart of SqlInsertWriter: translated rows are buffered as Arrow
+    record batches and written as full row groups (Parquet) or batches (Arrow) of
+    row_group_size rows as soon as they fill, so memory is bounded by the row group rather
+    than the report. Nothing is rendered or escaped.
+
+    Args:
+        path (str): Path of the output file.
+        schema (pa.Schema): The table schema, see chargeable_schema and domains_schema.
+        file_format (str): "parquet" or "arrow", see COLUMNAR_FORMATS.
+        row_group_size (int): The number of rows per row group.
+        compression (str): "gzip" or "zstd", or "none" for the format's default
+            (snappy for Parquet, uncompressed for Arrow).
+    """
+
+    def __init__(self, path, schema, file_format="parquet", row_group_size=DEFAULT_ROW_GROUP_SIZE, compression="none"):
+        pa = _pyarrow()
+        self.path = path
+        self.schema = schema
+        self.row_group_size = row_group_size
+
+        if file_format == "parquet":
+            import pyarrow.parquet as pq
+            options = {} if compression == "none" else {"compression": compression}
+            self._writer = pq.ParquetWriter(path, schema, **options)
+        elif file_format == "arrow":
+            if compression == "gzip":
+                raise ValueError("Arrow IPC files can't be compressed with gzip, use zstd")
+            options = pa.ipc.IpcWriteOptions(compression=None if compression == "none" else compression)
+            self._writer = pa.ipc.new_file(path, schema, options=options)
+        else:
+            raise ValueError(f"Unsupported columnar format: {file_format}")
+
+        self.rows_written = 0
+        self._batches = []
+        self._pending_rows = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self._writer.close()
+
+    def write_columns(self, columns):
+        """
+        Add rows given as one sequence per schema column (lists, arrays or pandas Series).
+        """
+        pa = _pyarrow()
+        arrays = [
+            pa.array(column, from_pandas=True).cast(field.type)
+            for column, field in zip(columns, self.schema)
+        ]
+        batch = pa.RecordBatch.from_arrays(arrays, schema=self.schema)
+        if batch.num_rows == 0:
+            return
+        self._batches.append(batch)
+        self._pending_rows += batch.num_rows
+        if self._pending_rows >= self.row_group_size:
+            self._write(self._pending_rows - self._pending_rows % self.row_group_size)
+
+    def write_rows(self, rows, batch_size=DEFAULT_ROW_GROUP_SIZE):
+        """
+        Add every row tuple from an iterable, converting batch_size rows at a time.
+        """
+        batch = []
+        for row in rows:
+            batch.append(row)
+            if len(batch) >= batch_size:
+                self.write_columns(list(zip(*batch)))
+                batch = []
+        if batch:
+            self.write_columns(list(zip(*batch)))
+
+    def flush(self):
+        """
+        Write all pending rows, the last row group possibly partial.
+        """
+        self._write(self._pending_rows)
+
+    def _write(self, row_count):
+        """
+        Write the first row_count pending rows, row_group_size rows per row group, and keep the rest pending.
+        """
+        if row_count == 0:
+            return
+        pa = _pyarrow()
+        table = pa.Table.from_batches(self._batches, schema=self.schema)
+        if isinstance(self._writer, pa.ipc.RecordBatchFileWriter):
+            self._writer.write_table(table.slice(0, row_count), max_chunksize=self.row_group_size)
+        else:
+            self._writer.write_table(table.slice(0, row_count), row_group_size=self.row_group_size)
+        self.rows_written += row_count
+        logging.debug("Row groups written: %d rows; %d rows written to %s", row_count, self.rows_written, self.path)
+        self._batches = table.slice(row_count).to_batches()
+        self._pending_rows -= row_count
+
+    def close(self):
+        """
+        Write the last partial row group and the file footer.
+
+        Returns:
+            rows_written (int): The number of rows written.
+        """
+        self.flush()
+        self._writer.close()
+        if self.rows_written == 0:
+            logging.info(f"No valid rows to write to {self.path}")
+        else:
+            logging.info(f"Wrote {self.rows_written} rows to {self.path}")
+        return self.rows_written
+
+
+def write_chargeable_columnar(df, rules, path, file_format="parquet", partner_id_skip_list=PARTNER_IDS_TO_SKIP, row_group_size=DEFAULT_ROW_GROUP_SIZE, compression="none", skip_summary=None, metrics=None, domain_memory_limit=DEFAULT_DOMAIN_MEMORY_LIMIT):
+    """
+    Validate and translate usage data and write the chargeable rows to a Parquet or Arrow file.
+
+    The rows are validated and translated like generate_chargeable_sql, chunk by chunk, and
+    each chunk's columns are handed to the writer as they are produced.
+
+    Args:
+        df (pd.DataFrame or iterable of pd.DataFrame): Usage data, see generate_chargeable_sql.
+        rules (RuleTable or dict): The compiled rules, or a typemap dict, see generate_chargeable_sql.
+        path (str): Path of the output file.
+        file_format (str): "parquet" or "arrow".
+        partner_id_skip_list (list): List of PartnerIDs to skip, when rules is a typemap dict.
+        row_group_size (int): The number of rows per row group, see ColumnarWriter.
+        compression (str): The compression codec, see ColumnarWriter.
+        skip_summary (SkippedRowSummary): Optional per-reason counter for skipped rows, see log_rows.
+        metrics (RunMetrics): Optional collector for the stage timings, with writing counted as the write stage.
+        domain_memory_limit (int): Estimated bytes of the domain index to hold in memory, see DomainIndex.
+
+    Returns:
+        product_totals (dict): Dictionary mapping part numbers to total item counts (with unit reduction).
+        domain_partners (DomainIndex): Index mapping domains to partnerPurchasedPlanID.
+    """
+    rules = compile_rules(rules, partner_id_skip_list)
+    product_totals = defaultdict(int)
+    domain_partners = DomainIndex(domain_memory_limit)
+    metrics = metrics or NullMetrics()
+
+    with ColumnarWriter(path, chargeable_schema(), file_format, row_group_size, compression) as writer:
+        for chargeable_rows in translate_chunks(df, rules, product_totals, domain_partners, skip_summary, metrics):
+            with metrics.stage("write"):
+                writer.write_columns([chargeable_rows[column] for column in CHARGEABLE_COLUMNS])
+        with metrics.stage("write"):
+            writer.flush()
+
+    return product_totals, domain_partners
+
+
+def write_domains_columnar(domain_map, path, file_format="parquet", row_group_size=DEFAULT_ROW_GROUP_SIZE, compression="none"):
+    """
+    Write the domain to partnerPurchasedPlanID map to a Parquet or Arrow file.
+
+    Args:
+        domain_map (dict or DomainIndex): A mapping of domain names to partnerPurchasedPlanID.
+        path (str): Path of the output file.
+        file_format (str): "parquet" or "arrow".
+        row_group_size (int): The number of rows per row group, see ColumnarWriter.
+        compression (str): The compression codec, see ColumnarWriter.
+    """
+    with ColumnarWriter(path, domains_schema(), file_format, row_group_size, compression) as writer:
+        writer.write_rows(domain_map.items(), batch_size=row_group_size)
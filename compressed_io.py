@@ -0,0 +1,70 @@
+import gzip
+import io
+
+OUTPUT_CODECS = ["none", "gzip", "zstd"]
+CODEC_EXTENSIONS = {"gzip": ".gz", "zstd": ".zst"}
+
+
+def _zstandard():
+    try:
+        import zstandard
+    except ImportError as e:
+        raise ImportError("zstd compression requires the zstandard package (pip install zstandard)") from e
+    return zstandard
+
+
+def input_codec(path):
+    """
+    Get the codec of a file from its extension.
+
+    Returns:
+        codec (str): "gzip", "zstd", or None for an uncompressed file.
+    """
+    for codec, extension in CODEC_EXTENSIONS.items():
+        if path.endswith(extension):
+            return codec
+    return None
+
+
+def open_input(path):
+    """
+    Open a possibly compressed file for binary reading, decompressing as it is read.
+
+    tell() and seek() work on uncompressed offsets. Seeking forward decompresses up to the
+    target, so it is only cheap on uncompressed files.
+    """
+    codec = input_codec(path)
+    if codec == "gzip":
+        return gzip.open(path, "rb")
+    if codec == "zstd":
+        reader = _zstandard().ZstdDecompressor().stream_reader(open(path, "rb"), closefd=True)
+        return io.BufferedReader(reader)
+    return open(path, "rb")
+
+
+def output_path(path, codec):
+    """
+    Add the extension of the codec to an output path.
+    """
+    return path + CODEC_EXTENSIONS.get(codec, "")
+
+
+def open_output(path, codec="none", level=None):
+    """
+    Open a file for text writing, compressing as it is written.
+
+    Args:
+        path (str): The file path, including any extension of the codec.
+        codec (str): One of OUTPUT_CODECS.
+        level (int): The compression level, or None for the codec's default.
+
+    Returns:
+        output_file: A text file object that can be passed as output_file to the generate_*_sql functions.
+    """
+    options = {} if level is None else {"level": level}
+    if codec == "gzip":
+        return gzip.open(path, "wt", compresslevel=options.get("level", 9))
+    if codec == "zstd":
+        zstandard = _zstandard()
+        return zstandard.open(path, "wt", cctx=zstandard.ZstdCompressor(**options))
+    return open(path, "w")
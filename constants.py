@@ -4,6 +4,49 @@ DOMAINS_SQL_FILE = "domains_insert_rows.sql"
 DEFAULT_CSV_FILE = "data/Sample_Report.csv"
 DEFAULT_JSON_FILE = "data/typemap.json"
 DEFAULT_LOG_FILE = "usage_translator.log"
+DEFAULT_PROFILE_FILE = f"{OUTPUT_FOLDER}/usage_translator.prof"
+DEFAULT_CHECKPOINT_FILE = f"{OUTPUT_FOLDER}/usage_translator.checkpoint.json"
+DEFAULT_CHECKPOINT_INTERVAL = 60
+# Checkpoints of another format are not resumed
+CHECKPOINT_FORMAT = 2
+DEFAULT_DOMAIN_MEMORY_LIMIT = 512 * 1024 * 1024
+DEFAULT_AGGREGATE_MEMORY_LIMIT = 512 * 1024 * 1024
+DEFAULT_SNAPSHOT_FILE = f"{OUTPUT_FOLDER}/usage_snapshot.db"
+DEFAULT_BATCH_OUTPUT_FOLDER = f"{OUTPUT_FOLDER}/batch"
+BATCH_SUMMARY_FILE = "batch_summary.json"
+REPORT_EXTENSIONS = [".csv", ".csv.gz", ".csv.zst"]
+CHARGEABLE_DELTA_SQL_FILE = "chargeable_delta_rows.sql"
+DOMAINS_DELTA_SQL_FILE = "domains_delta_rows.sql"
+CHARGEABLE_COLUMNAR_FILE = "chargeable_rows"
+DOMAINS_COLUMNAR_FILE = "domains"
+DEFAULT_SMALL_REPORT_BYTES = 8 * 1024 * 1024
+DEFAULT_CHUNK_SIZE = 100000
+DEFAULT_SHARD_BYTES = 64 * 1024 * 1024
+# Shards submitted per --workers process ahead of the one being merged
+SHARDS_IN_FLIGHT_PER_WORKER = 2
+# Reports of a --batch submitted per worker process ahead of the one being logged or merged
+REPORTS_IN_FLIGHT_PER_WORKER = 2
+DEFAULT_SCAN_BLOCK_BYTES = 8 * 1024 * 1024
+DEFAULT_WRITE_BUFFER_SIZE = 1024 * 1024
+# Statement limit of --batch-insert-size auto: MySQL 5.7's default max_allowed_packet, the smallest of the common server defaults
+DEFAULT_MAX_STATEMENT_BYTES = 4 * 1024 * 1024
+TRANSFORM_CACHE_SIZE = 100000
+DEFAULT_DB_URL = "sqlite:///output/usage.db"
+DEFAULT_DB_BATCH_SIZE = 10000
+DEFAULT_ROW_GROUP_SIZE = 256 * 1024
+SKIPPED_ROWS_SAMPLE_SIZE = 10
+DEFAULT_SERVICE_HOST = "127.0.0.1"
+DEFAULT_SERVICE_WORKERS = 4
+DEFAULT_SERVICE_MAX_PENDING = 64
+DEFAULT_SERVICE_MAX_UPLOAD = 256 * 1024 * 1024
+DEFAULT_SERVICE_QUEUE_SIZE = 16
+SERVICE_STREAM_CHUNK_SIZE = 64 * 1024
+# Bytes of each uploaded report held in memory; the rest is spooled to a temporary file
+SERVICE_SPOOL_BYTES = 1024 * 1024
+
+CSV_ENGINES = ["auto", "c", "pyarrow", "stdlib", "mmap"]
+# Columnar output formats and their file extensions
+COLUMNAR_FORMATS = {"parquet": ".parquet", "arrow": ".arrow"}
 
 PARTNER_IDS_TO_SKIP = [26392]
 UNIT_REDUCTION = {
@@ -15,6 +58,8 @@ UNIT_REDUCTION = {
 
 NO_VALID_ROWS_CHARGEABLE_SQL = "-- No valid rows to insert into chargeable table"
 NO_VALID_ROWS_DOMAINS_SQL = "-- No valid rows to insert into domains table"
+NO_CHANGES_CHARGEABLE_SQL = "-- No changes to the chargeable table"
+NO_CHANGES_DOMAINS_SQL = "-- No changes to the domains table"
 
 # Column names for the CSV file
 PARTNER_ID = "PartnerID"
@@ -26,6 +71,18 @@ ITEM_COUNT = "itemCount"
 
 REQUIRED_COLUMNS = [PARTNER_ID, PART_NUMBER, ACCOUNT_GUID, PLAN, DOMAINS, ITEM_COUNT]
 
+# Integer columns must match this after stripping whitespace; anything longer could overflow int64
+INTEGER_PATTERN = r"[+-]?\d{1,18}"
+# Values read as missing, the default na_values of pd.read_csv
+CSV_NA_VALUES = frozenset([
+    "", "#N/A", "#N/A N/A", "#NA", "-1.#IND", "-1.#QNAN", "-NaN", "-nan", "1.#IND", "1.#QNAN",
+    "<NA>", "N/A", "NA", "NULL", "NaN", "None", "n/a", "nan", "null",
+])
+
+# Column names of the output tables
+CHARGEABLE_COLUMNS = ["partnerID", "product", "productPurchasedPlanID", "plan", "usage"]
+DOMAINS_COLUMNS = ["domain", "partnerPurchasedPlanID"]
+
 # SQL insert statement templates
 CHARGEABLE_INSERT_HEADER = "INSERT INTO chargeable (partnerID, product, productPurchasedPlanID, plan, usage) VALUES \n"
 DOMAINS_INSERT_HEADER = "INSERT INTO domains (domain, partnerPurchasedPlanID) VALUES \n"
@@ -0,0 +1,113 @@
+import importlib.util
+import logging
+import pandas as pd
+from constants import PARTNER_ID, PART_NUMBER, ACCOUNT_GUID, PLAN, DOMAINS, ITEM_COUNT, REQUIRED_COLUMNS, INTEGER_PATTERN
+
+# Integer columns are read as text and converted by _to_integer, so a stray string only affects its own row
+INTEGER_COLUMNS = [PARTNER_ID, ITEM_COUNT]
+READ_DTYPES = {
+    PARTNER_ID: str,
+    ITEM_COUNT: str,
+    PART_NUMBER: "category",
+    PLAN: "category",
+    ACCOUNT_GUID: str,
+    DOMAINS: str,
+}
+
+
+def pyarrow_available():
+    return importlib.util.find_spec("pyarrow") is not None
+
+
+def _choose_engine(engine, chunked, columns_known):
+    """
+    Resolve the CSV engine to use.
+
+    Args:
+        engine (str): "auto", "c" or "pyarrow".
+        chunked (bool): Whether the report is read in chunks, which the pyarrow engine doesn't support.
+        columns_known (bool): Whether the column names can be known before reading; the pyarrow
+            engine needs them to prune columns.
+
+    Returns:
+        engine (str): "c" or "pyarrow".
+    """
+    if engine == "c":
+        return "c"
+    if chunked or not columns_known:
+        if engine == "pyarrow":
+            logging.warning("The pyarrow CSV engine can't read this report in chunks or from a stream, using the c engine")
+        return "c"
+    if pyarrow_available():
+        return "pyarrow"
+    if engine == "pyarrow":
+        logging.warning("pyarrow is not installed, using the c CSV engine")
+    return "c"
+
+
+def _is_required(column):
+    return column in REQUIRED_COLUMNS
+
+
+def _to_integer(column):
+    """
+    Convert a text column to nullable Int64. Values that aren't integers (e.g. '', '1.5', 'abc') become <NA>.
+    """
+    # Python storage whether or not pyarrow is installed: pyarrow's cast rejects integers like '+3'
+    text = column.astype("string[python]").str.strip()
+    is_integer = text.str.fullmatch(INTEGER_PATTERN).fillna(False).astype(bool)
+    return text.where(is_integer).astype("Int64")
+
+
+def _convert_columns(df):
+    """
+    Convert the integer columns of a chunk that was read with READ_DTYPES.
+    """
+    for column in INTEGER_COLUMNS:
+        if column in df.columns:
+            df[column] = _to_integer(df[column])
+    return df
+
+
+def read_report(source, engine="auto", chunksize=None, **kwargs):
+    """
+    Read the required columns of a usage report with explicit types.
+
+    PartnerID and itemCount become nullable Int64 (<NA> for values that aren't integers),
+    PartNumber and plan become category, and accountGuid and domains stay strings.
+    The other columns of the report are never parsed.
+
+    Args:
+        source: Path or binary file-like object of the CSV report.
+        engine (str): "c", "pyarrow", or "auto" (pyarrow when it is installed and the report is
+            read whole from a path). Reports pyarrow can't parse, like ones with ragged rows, are
+            read with the c engine.
+        chunksize (int): If set, an iterator of DataFrames with this many rows each is returned.
+        **kwargs: Passed to pd.read_csv (e.g. nrows, header, names).
+
+    Returns:
+        df (pd.DataFrame or iterator of pd.DataFrame): The report, or its chunks. Chunks keep
+            the CSV's 0-based row positions as their index.
+
+    Assumptions:
+    - A missing required column is not an error here; the caller checks df.columns.
+    """
+    if "nrows" in kwargs:
+        engine = "c"  # Only used for short reads, which pyarrow doesn't support and wouldn't speed up
+    if "names" in kwargs:
+        engine = "c"  # Headerless blocks of --workers and --resume, whose columns pyarrow can't prune by name
+    requested_engine = engine
+    engine = _choose_engine(engine, chunksize is not None, isinstance(source, str))
+    kwargs.update(dtype=READ_DTYPES)
+    if chunksize is not None:
+        return (_convert_columns(chunk) for chunk in pd.read_csv(source, engine=engine, chunksize=chunksize, usecols=_is_required, **kwargs))
+    if engine == "pyarrow":
+        # The pyarrow engine only prunes columns given by name, and fails on names that aren't in the file
+        columns = pd.read_csv(source, nrows=0).columns
+        try:
+            return _convert_columns(pd.read_csv(source, engine="pyarrow", usecols=[column for column in columns if column in REQUIRED_COLUMNS], **kwargs))
+        except pd.errors.ParserError as e:
+            # Unlike the c engine, pyarrow rejects rows with fewer or more fields than the header
+            if requested_engine == "pyarrow":
+                logging.warning(f"The pyarrow CSV engine can't parse this report ({e}), using the c engine")
+    return _convert_columns(pd.read_csv(source, engine="c", usecols=_is_required, **kwargs))
@@ -0,0 +1,247 @@
+import logging
+import sqlite3
+from abc import ABC, abstractmethod
+from collections import defaultdict
+from constants import (
+    CHARGEABLE_COLUMNS,
+    DOMAINS_COLUMNS,
+    PARTNER_IDS_TO_SKIP,
+    DEFAULT_DB_BATCH_SIZE,
+    DEFAULT_DOMAIN_MEMORY_LIMIT,
+)
+from processor import translate_chunks
+from metrics import NullMetrics
+from domain_index import DomainIndex
+from rules import compile_rules
+
+
+class DatabaseDriver(ABC):
+    """
+    Interface for the database that a --sink db run loads rows into.
+
+    A driver keeps a single connection open for the whole run. insert_rows is called
+    once per batch and must load the batch in its own transaction. A driver that doesn't
+    implement every method can't be created.
+    """
+
+    @abstractmethod
+    def connect(self):
+        """
+        Open the connection.
+        """
+
+    @abstractmethod
+    def insert_rows(self, table, columns, rows):
+        """
+        Insert a batch of row tuples into a table in one transaction.
+        """
+
+    @abstractmethod
+    def close(self):
+        """
+        Close the connection, if it is open.
+        """
+
+    def __enter__(self):
+        self.connect()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class SqliteDriver(DatabaseDriver):
+    """
+    Load rows into a SQLite database file with parameterized executemany batches.
+
+    Args:
+        path (str): Path to the database file.
+        create_tables (bool): If set, the chargeable and domains tables are created when missing.
+    """
+
+    def __init__(self, path, create_tables=True):
+        self.path = path
+        self.create_tables = create_tables
+        self.connection = None
+
+    def connect(self):
+        self.connection = sqlite3.connect(self.path)
+        if self.create_tables:
+            with self.connection:
+                self.connection.execute(
+                    "CREATE TABLE IF NOT EXISTS chargeable "
+                    "(partnerID INTEGER, product TEXT, productPurchasedPlanID TEXT, plan TEXT, usage INTEGER)"
+                )
+                self.connection.execute("CREATE TABLE IF NOT EXISTS domains (domain TEXT, partnerPurchasedPlanID TEXT)")
+
+    def insert_rows(self, table, columns, rows):
+        placeholders = ", ".join("?" for _ in columns)
+        with self.connection:
+            self.connection.executemany(f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({placeholders})", rows)
+
+    def close(self):
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
+
+
+class PostgresCopyDriver(DatabaseDriver):
+    """
+    Load rows into PostgreSQL with COPY ... FROM STDIN, one COPY per batch.
+
+    Requires the optional psycopg (version 3) package.
+
+    Args:
+        dsn (str): libpq connection string or postgresql:// URL.
+    """
+
+    def __init__(self, dsn):
+        self.dsn = dsn
+        self.connection = None
+
+    def connect(self):
+        try:
+            import psycopg
+        except ImportError as e:
+            raise ImportError("PostgresCopyDriver requires the psycopg package (pip install psycopg)") from e
+        self.connection = psycopg.connect(self.dsn)
+
+    def insert_rows(self, table, columns, rows):
+        with self.connection.transaction():
+            with self.connection.cursor() as cursor:
+                with cursor.copy(f"COPY {table} ({', '.join(columns)}) FROM STDIN") as copy:
+                    for row in rows:
+                        copy.write_row(row)
+
+    def close(self):
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
+
+
+def get_driver(db_url):
+    """
+    Create the driver for a database URL.
+
+    Args:
+        db_url (str): sqlite:///path/to/file.db or postgresql://user@host/dbname.
+
+    Returns:
+        driver (DatabaseDriver): The driver, not yet connected.
+    """
+    if db_url.startswith("sqlite:///"):
+        return SqliteDriver(db_url[len("sqlite:///"):])
+    if db_url.startswith(("postgresql://", "postgres://")):
+        return PostgresCopyDriver(db_url)
+    raise ValueError(f"Unsupported database URL: {db_url}")
+
+
+class DatabaseWriter:
+    """
+    Collect row tuples for one table and load them through a driver in batches.
+
+    The database counterpart of SqlInsertWriter: rows are bound as parameters, so no
+    SQL text is rendered or escaped.
+
+    Args:
+        driver (DatabaseDriver): A connected driver.
+        table (str): The table to load.
+        columns (list): The table columns, in row tuple order.
+        batch_insert_size (int): The number of rows per transaction.
+            default: 0 (DEFAULT_DB_BATCH_SIZE).
+    """
+
+    def __init__(self, driver, table, columns, batch_insert_size=0):
+        self.driver = driver
+        self.table = table
+        self.columns = columns
+        self.batch_insert_size = batch_insert_size if batch_insert_size > 0 else DEFAULT_DB_BATCH_SIZE
+
+        self.rows_written = 0
+        self._batch = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+
+    def write_rows(self, rows):
+        """
+        Add every row tuple from an iterable, loading each batch as it fills.
+        """
+        for row in rows:
+            self._batch.append(row)
+            if len(self._batch) >= self.batch_insert_size:
+                self.flush()
+
+    def flush(self):
+        """
+        Load the pending rows in one transaction.
+        """
+        if self._batch:
+            self.driver.insert_rows(self.table, self.columns, self._batch)
+            self.rows_written += len(self._batch)
+            logging.debug("Batch loaded: %d rows; %d rows loaded into %s table", len(self._batch), self.rows_written, self.table)
+            self._batch = []
+
+    def close(self):
+        """
+        Load the last partial batch.
+
+        Returns:
+            rows_written (int): The number of rows loaded.
+        """
+        self.flush()
+        if self.rows_written == 0:
+            logging.info(f"No valid rows to insert into {self.table} table")
+        else:
+            logging.info(f"Loaded {self.rows_written} rows into {self.table} table")
+        return self.rows_written
+
+
+def load_chargeable_rows(df, rules, driver, partner_id_skip_list=PARTNER_IDS_TO_SKIP, batch_insert_size=0, skip_summary=None, metrics=None, domain_memory_limit=DEFAULT_DOMAIN_MEMORY_LIMIT):
+    """
+    Validate and translate usage data and load the chargeable rows straight into a database.
+
+    Args:
+        df (pd.DataFrame or iterable of pd.DataFrame): Usage data, see generate_chargeable_sql.
+        rules (RuleTable or dict): The compiled rules, or a typemap dict, see generate_chargeable_sql.
+        driver (DatabaseDriver): A connected driver.
+        partner_id_skip_list (list): List of PartnerIDs to skip, when rules is a typemap dict.
+        batch_insert_size (int): The number of rows per transaction.
+            default: 0 (DEFAULT_DB_BATCH_SIZE).
+        skip_summary (SkippedRowSummary): Optional per-reason counter for skipped rows, see log_rows.
+        metrics (RunMetrics): Optional collector for the stage timings, with loading counted as the write stage.
+        domain_memory_limit (int): Estimated bytes of the domain index to hold in memory, see DomainIndex.
+
+    Returns:
+        product_totals (dict): Dictionary mapping part numbers to total item counts (with unit reduction).
+        domain_partners (DomainIndex): Index mapping domains to partnerPurchasedPlanID.
+    """
+    rules = compile_rules(rules, partner_id_skip_list)
+    product_totals = defaultdict(int)
+    domain_partners = DomainIndex(domain_memory_limit)
+    metrics = metrics or NullMetrics()
+
+    with DatabaseWriter(driver, "chargeable", CHARGEABLE_COLUMNS, batch_insert_size) as writer:
+        for chargeable_rows in translate_chunks(df, rules, product_totals, domain_partners, skip_summary, metrics):
+            with metrics.stage("write"):
+                writer.write_rows(chargeable_rows.itertuples(index=False, name=None))
+
+    return product_totals, domain_partners
+
+
+def load_domains(domain_map, driver, batch_insert_size=0):
+    """
+    Load the domain to partnerPurchasedPlanID map straight into a database.
+
+    Args:
+        domain_map (dict or DomainIndex): A mapping of domain names to partnerPurchasedPlanID.
+        driver (DatabaseDriver): A connected driver.
+        batch_insert_size (int): The number of rows per transaction.
+            default: 0 (DEFAULT_DB_BATCH_SIZE).
+    """
+    with DatabaseWriter(driver, "domains", DOMAINS_COLUMNS, batch_insert_size) as writer:
+        writer.write_rows(domain_map.items())
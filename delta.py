@@ -0,0 +1,231 @@
+import logging
+import os
+import sqlite3
+from collections import defaultdict
+from constants import (
+    PARTNER_IDS_TO_SKIP,
+    DEFAULT_WRITE_BUFFER_SIZE,
+    DEFAULT_DOMAIN_MEMORY_LIMIT,
+    CHARGEABLE_INSERT_HEADER,
+    DOMAINS_INSERT_HEADER,
+    NO_CHANGES_CHARGEABLE_SQL,
+    NO_CHANGES_DOMAINS_SQL,
+)
+from processor import translate_chunks
+from sql_writer import SqlInsertWriter
+from utils import escape_sql_string
+from metrics import NullMetrics
+from domain_index import DomainIndex
+from rules import compile_rules
+
+# Rows of the chargeable table are identified by these columns. A key that appears on several
+# rows of a report keeps all of its usages, comma separated in CSV order.
+CHARGEABLE_KEY = "partnerID, product, productPurchasedPlanID, plan"
+
+SNAPSHOT_TABLES = [
+    f"CREATE TABLE {{schema}}.chargeable (partnerID INTEGER, product TEXT, productPurchasedPlanID TEXT, plan TEXT, usages TEXT, UNIQUE ({CHARGEABLE_KEY}))",
+    "CREATE TABLE {schema}.domains (domain TEXT PRIMARY KEY, partnerPurchasedPlanID TEXT)",
+]
+
+UPSERT_CHARGEABLE = (
+    f"INSERT INTO chargeable ({CHARGEABLE_KEY}, usages) VALUES (?, ?, ?, ?, ?) "
+    f"ON CONFLICT ({CHARGEABLE_KEY}) DO UPDATE SET usages = usages || ',' || excluded.usages"
+)
+
+# The usages of a key are compared as multisets, so rows of a key that only come in a
+# different order are not a change. A key whose usages changed is updated in place when it
+# has a single row before and after, and deleted and inserted again otherwise.
+CHANGED = "NOT same_usages(n.usages, o.usages)"
+REPLACED = f"({CHANGED} AND (instr(n.usages, ',') > 0 OR instr(o.usages, ',') > 0))"
+CHARGEABLE_DELETES = (
+    f"SELECT o.partnerID, o.product, o.productPurchasedPlanID, o.plan FROM old.chargeable o "
+    f"LEFT JOIN main.chargeable n USING ({CHARGEABLE_KEY}) WHERE n.usages IS NULL OR {REPLACED} ORDER BY o.rowid"
+)
+CHARGEABLE_UPDATES = (
+    f"SELECT n.partnerID, n.product, n.productPurchasedPlanID, n.plan, n.usages FROM main.chargeable n "
+    f"JOIN old.chargeable o USING ({CHARGEABLE_KEY}) WHERE {CHANGED} AND NOT {REPLACED} ORDER BY n.rowid"
+)
+CHARGEABLE_INSERTS = (
+    f"SELECT n.partnerID, n.product, n.productPurchasedPlanID, n.plan, n.usages FROM main.chargeable n "
+    f"LEFT JOIN old.chargeable o USING ({CHARGEABLE_KEY}) WHERE o.usages IS NULL OR {REPLACED} ORDER BY n.rowid"
+)
+DOMAINS_DELETES = (
+    "SELECT o.domain FROM old.domains o LEFT JOIN main.domains n USING (domain) "
+    "WHERE n.domain IS NULL ORDER BY o.rowid"
+)
+DOMAINS_UPDATES = (
+    "SELECT n.domain, n.partnerPurchasedPlanID FROM main.domains n JOIN old.domains o USING (domain) "
+    "WHERE n.partnerPurchasedPlanID != o.partnerPurchasedPlanID ORDER BY n.rowid"
+)
+DOMAINS_INSERTS = (
+    "SELECT n.domain, n.partnerPurchasedPlanID FROM main.domains n LEFT JOIN old.domains o USING (domain) "
+    "WHERE o.domain IS NULL ORDER BY n.rowid"
+)
+
+
+def _new_snapshot_path(snapshot_path):
+    return f"{snapshot_path}.new"
+
+
+def _same_usages(new_usages, old_usages):
+    """
+    Compare two comma separated usage lists regardless of order, as the same_usages SQL function.
+    """
+    if new_usages is None or old_usages is None:
+        return None  # Like a comparison with NULL in SQL
+    if new_usages == old_usages:
+        return True
+    return sorted(map(int, new_usages.split(","))) == sorted(map(int, old_usages.split(",")))
+
+
+def _open_new_snapshot(snapshot_path):
+    """
+    Create an empty snapshot next to snapshot_path. It is only moved into place by commit_snapshot.
+    """
+    path = _new_snapshot_path(snapshot_path)
+    if os.path.exists(path):
+        os.remove(path)
+    connection = sqlite3.connect(path)
+    # The new snapshot is rebuilt from scratch on every run, so it doesn't need a journal
+    connection.execute("PRAGMA journal_mode = OFF")
+    connection.execute("PRAGMA synchronous = OFF")
+    connection.create_function("same_usages", 2, _same_usages, deterministic=True)
+    for create_table in SNAPSHOT_TABLES:
+        connection.execute(create_table.format(schema="main"))
+    return connection
+
+
+def _attach_previous_snapshot(connection, snapshot_path):
+    """
+    Attach the previous snapshot as the old schema, or an empty one on the first run.
+    """
+    if os.path.exists(snapshot_path):
+        connection.execute("ATTACH DATABASE ? AS old", (snapshot_path,))
+        return True
+    connection.execute("ATTACH DATABASE ':memory:' AS old")
+    for create_table in SNAPSHOT_TABLES:
+        connection.execute(create_table.format(schema="old"))
+    return False
+
+
+def _chargeable_where(partner_id, product, partner_purchased_plan_id, plan):
+    return f"partnerID = {partner_id} AND product = '{product}' AND productPurchasedPlanID = '{partner_purchased_plan_id}' AND plan = '{escape_sql_string(plan)}'"
+
+
+def _write_chargeable_delta(connection, output_file, batch_insert_size, buffer_size, max_statement_bytes):
+    """
+    Write the DELETE, UPDATE and INSERT statements that turn the old chargeable rows into the new ones.
+
+    Returns:
+        counts (tuple): The number of rows deleted, updated and inserted.
+    """
+    deleted = updated = 0
+    for row in connection.execute(CHARGEABLE_DELETES):
+        output_file.write(f"DELETE FROM chargeable WHERE {_chargeable_where(*row)};\n")
+        deleted += 1
+    for *key, usages in connection.execute(CHARGEABLE_UPDATES):
+        output_file.write(f"UPDATE chargeable SET usage = {usages} WHERE {_chargeable_where(*key)};\n")
+        updated += 1
+
+    no_changes_sql = "" if deleted or updated else NO_CHANGES_CHARGEABLE_SQL
+    with SqlInsertWriter(output_file, "chargeable", CHARGEABLE_INSERT_HEADER, no_changes_sql, batch_insert_size, buffer_size, max_statement_bytes) as writer:
+        for partner_id, product, partner_purchased_plan_id, plan, usages in connection.execute(CHARGEABLE_INSERTS):
+            for usage in usages.split(","):
+                writer.write_row(f"\t({partner_id}, '{product}', '{partner_purchased_plan_id}', '{escape_sql_string(plan)}', {usage})")
+    return deleted, updated, writer.rows_written
+
+
+def _write_domains_delta(connection, output_file, batch_insert_size, buffer_size, max_statement_bytes):
+    """
+    Write the DELETE, UPDATE and INSERT statements that turn the old domain map into the new one.
+
+    Returns:
+        counts (tuple): The number of rows deleted, updated and inserted.
+    """
+    deleted = updated = 0
+    for (domain,) in connection.execute(DOMAINS_DELETES):
+        output_file.write(f"DELETE FROM domains WHERE domain = '{escape_sql_string(domain)}';\n")
+        deleted += 1
+    for domain, partner_purchased_plan_id in connection.execute(DOMAINS_UPDATES):
+        output_file.write(f"UPDATE domains SET partnerPurchasedPlanID = '{partner_purchased_plan_id}' WHERE domain = '{escape_sql_string(domain)}';\n")
+        updated += 1
+
+    no_changes_sql = "" if deleted or updated else NO_CHANGES_DOMAINS_SQL
+    with SqlInsertWriter(output_file, "domains", DOMAINS_INSERT_HEADER, no_changes_sql, batch_insert_size, buffer_size, max_statement_bytes) as writer:
+        writer.write_rows(
+            f"\t('{escape_sql_string(domain)}', '{partner_purchased_plan_id}')"
+            for domain, partner_purchased_plan_id in connection.execute(DOMAINS_INSERTS)
+        )
+    return deleted, updated, writer.rows_written
+
+
+def generate_delta_sql(df, rules, snapshot_path, chargeable_output, domains_output, partner_id_skip_list=PARTNER_IDS_TO_SKIP, batch_insert_size=0, buffer_size=DEFAULT_WRITE_BUFFER_SIZE, max_statement_bytes=0, skip_summary=None, metrics=None, domain_memory_limit=DEFAULT_DOMAIN_MEMORY_LIMIT):
+    """
+    Generate only the SQL that changes the tables loaded from the previous report into this report's rows.
+
+    The translated rows and the domain map are written to a new SQLite snapshot, which is then
+    compared with the previous snapshot by indexed joins, so memory use doesn't grow with the
+    report. Deletes come first, then updates, then (optionally batched) inserts. Without a
+    previous snapshot every row is an insert.
+
+    The new snapshot only replaces the previous one when commit_snapshot is called, which should
+    happen once the delta SQL is safely written.
+
+    Args:
+        df (pd.DataFrame or iterable of pd.DataFrame): Usage data, see generate_chargeable_sql.
+        rules (RuleTable or dict): The compiled rules, or a typemap dict, see generate_chargeable_sql.
+        snapshot_path (str): Path of the snapshot of the previous run.
+        chargeable_output: The file to write the chargeable table changes to.
+        domains_output: The file to write the domains table changes to.
+        partner_id_skip_list (list): List of PartnerIDs to skip, when rules is a typemap dict.
+        batch_insert_size (int): The number of rows to include in each batch insert statement.
+            default: 0 (no batching).
+        buffer_size (int): The number of characters the SqlInsertWriter buffers within one statement.
+        max_statement_bytes (int): The largest statement to write, in bytes, see SqlInsertWriter.
+            default: 0 (no limit).
+        skip_summary (SkippedRowSummary): Optional per-reason counter for skipped rows, see log_rows.
+        metrics (RunMetrics): Optional collector for the stage timings, with the snapshot and delta stages.
+        domain_memory_limit (int): Estimated bytes of the domain index to hold in memory, see DomainIndex.
+
+    Returns:
+        product_totals (dict): Dictionary mapping part numbers to total item counts of the whole report.
+        domain_partners (DomainIndex): Index mapping domains to partnerPurchasedPlanID.
+
+    Assumptions:
+    - The snapshot describes what was loaded into the tables, i.e. every earlier delta has been applied.
+    - Rows with the same key are interchangeable, so a key is compared by its usages as a whole, in any order.
+    """
+    rules = compile_rules(rules, partner_id_skip_list)
+    product_totals = defaultdict(int)
+    domain_partners = DomainIndex(domain_memory_limit)
+    metrics = metrics or NullMetrics()
+
+    connection = _open_new_snapshot(snapshot_path)
+    try:
+        for chargeable_rows in translate_chunks(df, rules, product_totals, domain_partners, skip_summary, metrics):
+            with metrics.stage("snapshot"):
+                chargeable_rows = chargeable_rows.astype({"usage": str})
+                connection.executemany(UPSERT_CHARGEABLE, chargeable_rows.itertuples(index=False, name=None))
+        with metrics.stage("snapshot"):
+            connection.executemany("INSERT INTO domains (domain, partnerPurchasedPlanID) VALUES (?, ?)", domain_partners.items())
+            connection.commit()
+
+        with metrics.stage("delta"):
+            if not _attach_previous_snapshot(connection, snapshot_path):
+                logging.info(f"No snapshot found at {snapshot_path}, every row is new")
+            chargeable_counts = _write_chargeable_delta(connection, chargeable_output, batch_insert_size, buffer_size, max_statement_bytes)
+            domains_counts = _write_domains_delta(connection, domains_output, batch_insert_size, buffer_size, max_statement_bytes)
+    finally:
+        connection.close()
+
+    logging.info("Delta for chargeable table: %d deleted, %d updated, %d inserted", *chargeable_counts)
+    logging.info("Delta for domains table: %d deleted, %d updated, %d inserted", *domains_counts)
+    return product_totals, domain_partners
+
+
+def commit_snapshot(snapshot_path):
+    """
+    Replace the previous snapshot with the one written by generate_delta_sql.
+    """
+    os.replace(_new_snapshot_path(snapshot_path), snapshot_path)
+    logging.info(f"Snapshot saved: {snapshot_path}")
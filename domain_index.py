@@ -0,0 +1,314 @@
+import logging
+import os
+import sqlite3
+import sys
+import tempfile
+import weakref
+from array import array
+from constants import DEFAULT_DOMAIN_MEMORY_LIMIT, SKIPPED_ROWS_SAMPLE_SIZE
+
+# Approximate bytes of an interned plan ID's dict entry on top of the string itself
+ENTRY_OVERHEAD = 100
+# Approximate bytes of a domain on top of its UTF-8 bytes: its offset, plan number, hash and hash table slots
+DOMAIN_OVERHEAD = 40
+# Number of hash table slots an empty index starts with; it doubles when two thirds are used
+INITIAL_TABLE_SIZE = 1024
+EMPTY = -1
+
+
+def _remove_spill_file(path):
+    if os.path.exists(path):
+        os.remove(path)
+
+
+class DomainIndex:
+    """
+    Map domains to partnerPurchasedPlanIDs with the semantics of dict.update: domains keep the
+    order they were first seen in, and a later plan ID replaces an earlier one.
+
+    Domains are kept in a string pool: their UTF-8 bytes are appended to one bytearray, in
+    first-seen order, with an array of offsets into it, so a domain costs its bytes and a few
+    array items rather than a str object and a dict entry. An open-addressing hash table of
+    domain numbers finds the domain again. Each plan ID is stored once, in a table of
+    interned IDs, and domains only hold a small integer into it. Once the estimated size
+    exceeds memory_limit bytes, the index moves to a temporary SQLite file and continues
+    there. Domains that get a different plan ID than the one they had are counted as conflicts.
+
+    With track_changes, the index also keeps track of what changed since mark_saved was last
+    called, so a checkpoint only has to save those changes, see changes.
+
+    Args:
+        memory_limit (int): Estimated bytes to hold in memory before spilling to disk.
+        spill_folder (str): Folder of the temporary SQLite file (default: the system temp folder).
+        track_changes (bool): If set, the changes since the last mark_saved can be listed.
+    """
+
+    def __init__(self, memory_limit=DEFAULT_DOMAIN_MEMORY_LIMIT, spill_folder=None, track_changes=False):
+        self.memory_limit = memory_limit
+        self.spill_folder = spill_folder
+        self.conflicts = 0
+        self.conflicting_domains = []
+        self._changed = set() if track_changes else None  # Domains whose plan ID changed since mark_saved
+        self._saved_slots = 0
+        self._clear_memory()
+
+        self._connection = None
+        self._next_slot = 0
+
+    @property
+    def spilled(self):
+        return self._connection is not None
+
+    def _clear_memory(self):
+        self._pool = bytearray()  # UTF-8 bytes of the domains, in first-seen order
+        self._offsets = array("Q", [0])  # Domain n is _pool[_offsets[n]:_offsets[n + 1]]
+        self._plan_id_numbers = array("I")  # Domain n -> its plan number
+        self._hashes = array("q")  # Domain n -> hash of the domain, so the table grows without decoding
+        self._table = array("l", [EMPTY]) * INITIAL_TABLE_SIZE  # Domain numbers by hash, with linear probing
+        self._plan_id_table = {}  # Plan ID -> its number
+        self._plan_ids = []  # Number -> plan ID
+        self._memory = 0
+
+    def _intern(self, plan_id):
+        number = self._plan_id_table.get(plan_id)
+        if number is None:
+            number = len(self._plan_ids)
+            self._plan_id_table[plan_id] = number
+            self._plan_ids.append(plan_id)
+            self._memory += sys.getsizeof(plan_id) + ENTRY_OVERHEAD
+        return number
+
+    def _conflict(self, domain):
+        self.conflicts += 1
+        if self._changed is not None:
+            self._changed.add(domain)
+        if len(self.conflicting_domains) < SKIPPED_ROWS_SAMPLE_SIZE:
+            self.conflicting_domains.append(domain)
+
+    def update(self, pairs):
+        """
+        Set the plan ID of each domain, from a mapping or an iterable of (domain, plan ID) pairs.
+        """
+        if hasattr(pairs, "items"):
+            pairs = pairs.items()
+        pairs = iter(pairs)
+        if self.spilled:
+            self._update_spilled(pairs)
+            return
+
+        pool = self._pool
+        offsets = self._offsets
+        plan_id_numbers = self._plan_id_numbers
+        hashes = self._hashes
+        table = self._table
+        mask = len(table) - 1
+        grow_at = len(table) * 2 // 3
+        last_pair = None
+        for pair in pairs:
+            if pair == last_pair:
+                continue  # Rows of one account are usually adjacent
+            last_pair = pair
+            domain, plan_id = pair
+            number = self._plan_id_table.get(plan_id)
+            if number is None:
+                number = self._intern(plan_id)
+            # The lookup of _find, inlined since it runs for every row
+            encoded = domain.encode()
+            domain_hash = hash(domain)
+            position = domain_hash & mask
+            while True:
+                slot = table[position]
+                if slot == EMPTY or (hashes[slot] == domain_hash and pool[offsets[slot]:offsets[slot + 1]] == encoded):
+                    break
+                position = (position + 1) & mask
+            if slot == EMPTY:
+                table[position] = len(plan_id_numbers)
+                pool += encoded
+                offsets.append(len(pool))
+                plan_id_numbers.append(number)
+                hashes.append(domain_hash)
+                if len(plan_id_numbers) > grow_at:
+                    self._grow_table()
+                    table = self._table
+                    mask = len(table) - 1
+                    grow_at = len(table) * 2 // 3
+                self._memory += len(encoded) + DOMAIN_OVERHEAD
+                if self._memory > self.memory_limit:
+                    self._spill()
+                    self._update_spilled(pairs)
+                    return
+            elif plan_id_numbers[slot] != number:
+                self._conflict(domain)
+                plan_id_numbers[slot] = number
+
+    def _find(self, domain, encoded):
+        """
+        Look up a domain in the hash table.
+
+        Returns:
+            position (int): The table position of the domain, or the empty one where it goes.
+            slot (int): The number of the domain, or EMPTY if it isn't in the index.
+        """
+        table = self._table
+        pool = self._pool
+        offsets = self._offsets
+        hashes = self._hashes
+        domain_hash = hash(domain)
+        mask = len(table) - 1
+        position = domain_hash & mask
+        while True:
+            slot = table[position]
+            if slot == EMPTY or (hashes[slot] == domain_hash and pool[offsets[slot]:offsets[slot + 1]] == encoded):
+                return position, slot
+            position = (position + 1) & mask
+
+    def _grow_table(self):
+        table = array("l", [EMPTY]) * (len(self._table) * 2)
+        mask = len(table) - 1
+        for slot, domain_hash in enumerate(self._hashes):
+            position = domain_hash & mask
+            while table[position] != EMPTY:
+                position = (position + 1) & mask
+            table[position] = slot
+        self._table = table
+
+    def _domains(self, start=0):
+        """
+        Iterate over the domains in the string pool from number start on, in first-seen order.
+        """
+        pool = self._pool
+        offsets = self._offsets
+        for slot in range(start, len(offsets) - 1):
+            yield pool[offsets[slot]:offsets[slot + 1]].decode()
+
+    def _spill(self):
+        """
+        Move the index to a temporary SQLite file.
+        """
+        handle, path = tempfile.mkstemp(prefix="usage_translator_domains_", suffix=".db", dir=self.spill_folder)
+        os.close(handle)
+        self._finalizer = weakref.finalize(self, _remove_spill_file, path)
+        logging.info(f"Domain index is over {self.memory_limit} bytes, moving it to {path}")
+
+        connection = sqlite3.connect(path)
+        connection.execute("PRAGMA journal_mode = OFF")
+        connection.execute("PRAGMA synchronous = OFF")
+        connection.execute("CREATE TABLE domains (domain TEXT PRIMARY KEY, slot INTEGER, partnerPurchasedPlanID TEXT)")
+        if self._changed is not None:
+            connection.execute("CREATE INDEX domains_slot ON domains (slot)")  # For the new domains of changes()
+        connection.execute("CREATE TEMP TABLE conflicts (domain TEXT)")
+        connection.execute(
+            "CREATE TEMP TRIGGER count_conflicts AFTER UPDATE ON domains BEGIN INSERT INTO conflicts VALUES (NEW.domain); END"
+        )
+        plan_ids = self._plan_ids
+        plan_id_numbers = self._plan_id_numbers
+        connection.executemany(
+            "INSERT INTO domains VALUES (?, ?, ?)",
+            ((domain, slot, plan_ids[plan_id_numbers[slot]]) for slot, domain in enumerate(self._domains())),
+        )
+        self._connection = connection
+        self._next_slot = len(plan_id_numbers)
+        self._clear_memory()
+
+    def _update_spilled(self, pairs):
+        connection = self._connection
+
+        def numbered(pairs):
+            for domain, plan_id in pairs:
+                yield domain, self._next_slot, plan_id
+                self._next_slot += 1
+
+        connection.executemany(
+            "INSERT INTO domains VALUES (?, ?, ?) ON CONFLICT (domain) DO UPDATE "
+            "SET partnerPurchasedPlanID = excluded.partnerPurchasedPlanID "
+            "WHERE partnerPurchasedPlanID != excluded.partnerPurchasedPlanID",
+            numbered(pairs),
+        )
+        for (domain,) in connection.execute("SELECT domain FROM conflicts"):
+            self._conflict(domain)
+        connection.execute("DELETE FROM conflicts")
+
+    def items(self):
+        """
+        Iterate over (domain, plan ID) pairs in the order the domains were first seen.
+        """
+        if self.spilled:
+            yield from self._connection.execute("SELECT domain, partnerPurchasedPlanID FROM domains ORDER BY slot")
+            return
+        plan_ids = self._plan_ids
+        plan_id_numbers = self._plan_id_numbers
+        for slot, domain in enumerate(self._domains()):
+            yield domain, plan_ids[plan_id_numbers[slot]]
+
+    def changes(self):
+        """
+        Iterate over the (domain, plan ID) pairs set since mark_saved was last called (or since
+        the index was created): the new domains in the order they were first seen, then the
+        domains whose plan ID changed. Updating an index saved at that point with these pairs
+        gives this index. Needs track_changes.
+        """
+        if self.spilled:
+            yield from self._connection.execute(
+                "SELECT domain, partnerPurchasedPlanID FROM domains WHERE slot >= ? ORDER BY slot", (self._saved_slots,)
+            )
+        else:
+            plan_ids = self._plan_ids
+            plan_id_numbers = self._plan_id_numbers
+            for slot, domain in enumerate(self._domains(self._saved_slots), self._saved_slots):
+                yield domain, plan_ids[plan_id_numbers[slot]]
+        for domain in self._changed:
+            yield domain, self[domain]
+
+    def mark_saved(self):
+        """
+        Start a new set of changes, once the current ones are saved.
+        """
+        self._saved_slots = self._next_slot if self.spilled else len(self._plan_id_numbers)
+        self._changed.clear()
+
+    def keys(self):
+        return (domain for domain, _ in self.items())
+
+    def __iter__(self):
+        return self.keys()
+
+    def __getitem__(self, domain):
+        if self.spilled:
+            row = self._connection.execute("SELECT partnerPurchasedPlanID FROM domains WHERE domain = ?", (domain,)).fetchone()
+            if row is None:
+                raise KeyError(domain)
+            return row[0]
+        _, slot = self._find(domain, domain.encode())
+        if slot == EMPTY:
+            raise KeyError(domain)
+        return self._plan_ids[self._plan_id_numbers[slot]]
+
+    def __contains__(self, domain):
+        try:
+            self[domain]
+        except KeyError:
+            return False
+        return True
+
+    def __len__(self):
+        if self.spilled:
+            return self._connection.execute("SELECT count(*) FROM domains").fetchone()[0]
+        return len(self._plan_id_numbers)
+
+    def log_conflicts(self):
+        """
+        Log how many times a domain was assigned a different partnerPurchasedPlanID, with a sample of the domains.
+        """
+        if self.conflicts:
+            sample = ", ".join(str(domain) for domain in self.conflicting_domains)
+            more = ", ..." if self.conflicts > len(self.conflicting_domains) else ""
+            logging.warning(f"{self.conflicts} domain assignments replaced a different partnerPurchasedPlanID, the last one is kept ({sample}{more})")
+
+    def close(self):
+        """
+        Remove the temporary SQLite file, if the index was spilled.
+        """
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
+            self._finalizer()
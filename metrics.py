@@ -0,0 +1,162 @@
+import json
+import logging
+import resource
+import time
+from contextlib import contextmanager, nullcontext
+
+PROMETHEUS_PREFIX = "usage_translator"
+
+
+def _peak_rss_bytes():
+    """
+    Peak resident set size of this process so far (ru_maxrss is in KB on Linux).
+    """
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def _prometheus_label(value):
+    """
+    Escape a Prometheus label value.
+    """
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class RunMetrics:
+    """
+    Collect per-stage timings, row counters and peak memory for one run.
+
+    Stages can be entered many times (e.g. once per chunk); their time and call count accumulate.
+    Peak memory is sampled whenever a stage ends.
+    """
+
+    def __init__(self):
+        self.stages = {}
+        self.counters = {}
+        self.skipped_rows = {}
+        self.peak_rss_bytes = 0
+
+    @contextmanager
+    def stage(self, name):
+        """
+        Time the enclosed block as one call of the named stage.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(name, time.perf_counter() - start)
+
+    def add_time(self, name, seconds):
+        stage = self.stages.setdefault(name, {"seconds": 0.0, "calls": 0})
+        stage["seconds"] += seconds
+        stage["calls"] += 1
+        self.sample_memory()
+
+    def merge_stages(self, stages):
+        """
+        Add stage timings collected elsewhere (e.g. in a worker process), as returned in to_dict()["stages"].
+        """
+        for name, other in stages.items():
+            stage = self.stages.setdefault(name, {"seconds": 0.0, "calls": 0})
+            stage["seconds"] += other["seconds"]
+            stage["calls"] += other["calls"]
+
+    def timed(self, iterable, name):
+        """
+        Wrap an iterable so the time spent producing each item counts towards the named stage.
+        """
+        iterator = iter(iterable)
+        while True:
+            with self.stage(name):
+                item = next(iterator, StopIteration)
+            if item is StopIteration:
+                return
+            yield item
+
+    def count(self, name, value=1):
+        self.counters[name] = self.counters.get(name, 0) + value
+
+    def sample_memory(self):
+        self.peak_rss_bytes = max(self.peak_rss_bytes, _peak_rss_bytes())
+
+    def to_dict(self):
+        self.sample_memory()
+        return {
+            "stages": {name: {"seconds": round(stage["seconds"], 6), "calls": stage["calls"]} for name, stage in self.stages.items()},
+            "counters": dict(self.counters),
+            "skipped_rows": dict(self.skipped_rows),
+            "peak_rss_bytes": self.peak_rss_bytes,
+        }
+
+    def write_json(self, path):
+        with open(path, "w") as f:
+            json.dump(self.to_dict(), f, indent=2)
+        logging.info(f"Metrics written to {path}")
+
+    def write_prometheus(self, path):
+        """
+        Write the metrics in the Prometheus text exposition format (e.g. for the node_exporter textfile collector).
+        """
+        metrics = self.to_dict()
+        lines = [
+            f"# HELP {PROMETHEUS_PREFIX}_stage_seconds Wall-clock seconds spent in each stage.",
+            f"# TYPE {PROMETHEUS_PREFIX}_stage_seconds gauge",
+        ]
+        lines += [f'{PROMETHEUS_PREFIX}_stage_seconds{{stage="{_prometheus_label(name)}"}} {stage["seconds"]}' for name, stage in metrics["stages"].items()]
+        lines += [
+            f"# HELP {PROMETHEUS_PREFIX}_stage_calls Number of times each stage ran.",
+            f"# TYPE {PROMETHEUS_PREFIX}_stage_calls gauge",
+        ]
+        lines += [f'{PROMETHEUS_PREFIX}_stage_calls{{stage="{_prometheus_label(name)}"}} {stage["calls"]}' for name, stage in metrics["stages"].items()]
+        lines += [
+            f"# HELP {PROMETHEUS_PREFIX}_rows Row counters of the run.",
+            f"# TYPE {PROMETHEUS_PREFIX}_rows gauge",
+        ]
+        lines += [f'{PROMETHEUS_PREFIX}_rows{{counter="{_prometheus_label(name)}"}} {value}' for name, value in metrics["counters"].items()]
+        lines += [
+            f"# HELP {PROMETHEUS_PREFIX}_rows_skipped Skipped rows per reason.",
+            f"# TYPE {PROMETHEUS_PREFIX}_rows_skipped gauge",
+        ]
+        lines += [f'{PROMETHEUS_PREFIX}_rows_skipped{{reason="{_prometheus_label(reason)}"}} {count}' for reason, count in metrics["skipped_rows"].items()]
+        lines += [
+            f"# HELP {PROMETHEUS_PREFIX}_peak_rss_bytes Peak resident memory of the run.",
+            f"# TYPE {PROMETHEUS_PREFIX}_peak_rss_bytes gauge",
+            f"{PROMETHEUS_PREFIX}_peak_rss_bytes {metrics['peak_rss_bytes']}",
+        ]
+        with open(path, "w") as f:
+            f.write("\n".join(lines) + "\n")
+        logging.info(f"Prometheus metrics written to {path}")
+
+    def log(self):
+        """
+        Log the time spent in each stage and the peak memory.
+        """
+        logging.info("Stage timings:")
+        for name, stage in self.stages.items():
+            logging.info(f"  - {name}: {stage['seconds']:.3f}s ({stage['calls']} calls)")
+        self.sample_memory()
+        logging.info(f"Peak memory: {self.peak_rss_bytes / (1024 * 1024):.1f} MB")
+
+
+class NullMetrics(RunMetrics):
+    """
+    Metrics that record nothing, used when a caller doesn't pass any.
+    """
+
+    def stage(self, name):
+        return nullcontext()
+
+    def add_time(self, name, seconds):
+        pass
+
+    def merge_stages(self, stages):
+        pass
+
+    def timed(self, iterable, name):
+        return iterable
+
+    def count(self, name, value=1):
+        pass
+
+    def sample_memory(self):
+        pass
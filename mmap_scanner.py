@@ -0,0 +1,134 @@
+import csv
+import io
+import mmap
+import re
+from operator import itemgetter
+from constants import REQUIRED_COLUMNS, CSV_NA_VALUES, DEFAULT_SCAN_BLOCK_BYTES
+from stdlib_engine import NA
+
+_non_blank = re.compile(rb"[^\r\n]")
+
+
+class MappedReport:
+    """
+    A report scanned in place from a memory-mapped file, for the stdlib engine.
+
+    The file is mapped instead of read, and split into blocks of about block_bytes that end
+    on a line boundary. Each block is decoded once and split into lines and fields with the
+    str methods, and only the REQUIRED_COLUMNS of each row are kept, so the wide columns are
+    never parsed into rows, values or DataFrames. Blocks that contain a quote are parsed with
+    the csv module instead, so quoted commas, quotes and line breaks are read correctly, and
+    so are blocks with carriage returns.
+
+    Use as a context manager, or call close, to unmap the file.
+
+    Args:
+        csv_path (str): Path to an uncompressed CSV report.
+        block_bytes (int): The approximate number of bytes scanned and translated at a time.
+
+    Assumptions:
+    - Quotes only appear around quoted fields and doubled within them, so a block boundary
+      with an even number of quotes before it is outside any quoted field.
+    """
+
+    def __init__(self, csv_path, block_bytes=DEFAULT_SCAN_BLOCK_BYTES):
+        self.csv_path = csv_path
+        self.block_bytes = block_bytes
+        with open(csv_path, "rb") as f:
+            size = f.seek(0, io.SEEK_END)
+            self._buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if size else b""
+
+        header, header_end = self._read_records(0, 0)
+        self.columns = next(csv.reader(io.StringIO(header.decode("utf-8-sig"), newline="")), [])
+        self._data_start = header_end
+        self._width = len(self.columns)
+        self._positions = [self.columns.index(column) if column in self.columns else None for column in REQUIRED_COLUMNS]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        if isinstance(self._buffer, mmap.mmap):
+            self._buffer.close()
+
+    @property
+    def empty(self):
+        return _non_blank.search(self._buffer, self._data_start) is None
+
+    def _read_records(self, start, size):
+        """
+        Copy the records from start up to the first line break past start + size that is
+        outside quoted fields.
+
+        Returns:
+            data (bytes): The records.
+            end (int): The offset just past them.
+        """
+        buffer = self._buffer
+        end = _line_end(buffer, min(start + size, len(buffer)))
+        parts = [buffer[start:end]]
+        quotes = parts[0].count(b'"')
+        while quotes % 2 and end < len(buffer):
+            next_end = _line_end(buffer, end)
+            parts.append(buffer[end:next_end])
+            quotes += parts[-1].count(b'"')
+            end = next_end
+        return b"".join(parts) if len(parts) > 1 else parts[0], end
+
+    def blocks(self):
+        """
+        Scan the report block by block.
+
+        Yields:
+            rows (list): One tuple per data row with the values of REQUIRED_COLUMNS, NA where
+                missing, like the rows of read_report_stdlib.
+        """
+        start = self._data_start
+        while start < len(self._buffer):
+            data, start = self._read_records(start, self.block_bytes)
+            text = data.decode("utf-8")
+            rows = self._parse_quoted(text) if '"' in text or "\r" in text else self._parse(text)
+            if rows:
+                yield rows
+
+    def _parse(self, text):
+        """
+        Split an unquoted block on line breaks and commas, keeping only the required fields.
+        """
+        lines = [line for line in text.split("\n") if line]
+        if None not in self._positions:
+            get_fields = itemgetter(*self._positions)
+            try:
+                return list(map(_na_values, map(get_fields, map(str.split, lines, [","] * len(lines)))))
+            except IndexError:
+                pass  # A short row: pad the rows below, like csv.reader rows in read_report_stdlib
+        return self._rows(line.split(",") for line in lines)
+
+    def _parse_quoted(self, text):
+        return self._rows(record for record in csv.reader(io.StringIO(text, newline="")) if record)
+
+    def _rows(self, records):
+        positions, width = self._positions, self._width
+        rows = []
+        for record in records:
+            if len(record) < width:
+                record += [""] * (width - len(record))
+            rows.append(tuple(
+                NA if position is None or record[position] in CSV_NA_VALUES else record[position]
+                for position in positions
+            ))
+        return rows
+
+
+def _line_end(buffer, position):
+    line_end = buffer.find(b"\n", position)
+    return len(buffer) if line_end < 0 else line_end + 1
+
+
+def _na_values(row, _is_disjoint=CSV_NA_VALUES.isdisjoint):
+    if _is_disjoint(row):
+        return row
+    return tuple(NA if value in CSV_NA_VALUES else value for value in row)
@@ -0,0 +1,183 @@
+import io
+import os
+import shutil
+import tempfile
+import pandas as pd
+from collections import defaultdict, deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+from constants import PARTNER_IDS_TO_SKIP, DEFAULT_SHARD_BYTES, SHARDS_IN_FLIGHT_PER_WORKER, DEFAULT_WRITE_BUFFER_SIZE, DEFAULT_DOMAIN_MEMORY_LIMIT
+from csv_reader import read_report
+from processor import translate_chunk, render_chargeable_rows, log_rows
+from sql_writer import chargeable_sql_writer
+from metrics import RunMetrics, NullMetrics
+from domain_index import DomainIndex
+from rules import compile_rules
+
+# The rules of the run, sent to each worker process once by _init_worker
+_worker_rules = None
+
+
+def split_csv_shards(csv_path, shard_count):
+    """
+    Split the data rows of a CSV file into byte ranges that start and end on line boundaries.
+
+    Args:
+        csv_path (str): Path to the CSV report file.
+        shard_count (int): The number of shards to aim for. Fewer are returned for small files.
+
+    Returns:
+        shards (list): (start, end) byte offsets of each shard, in file order.
+
+    Assumptions:
+    - Quoted fields never contain line breaks, so every line break ends a CSV record.
+    """
+    size = os.path.getsize(csv_path)
+    with open(csv_path, "rb") as f:
+        f.readline()  # Skip the header row
+        data_start = f.tell()
+        boundaries = [data_start]
+        for shard in range(1, shard_count):
+            target = data_start + (size - data_start) * shard // shard_count
+            if target <= boundaries[-1]:
+                continue
+            # Move to the start of the first line at or after the target offset
+            f.seek(target - 1)
+            f.readline()
+            boundary = f.tell()
+            if boundary >= size:
+                break
+            if boundary > boundaries[-1]:
+                boundaries.append(boundary)
+    if size > boundaries[-1]:
+        boundaries.append(size)
+    return list(zip(boundaries[:-1], boundaries[1:]))
+
+
+def _init_worker(rules):
+    global _worker_rules
+    _worker_rules = rules
+
+
+def _translate_shard(csv_path, start, end, columns, fragment_path, csv_engine="auto"):
+    """
+    Translate one shard of the CSV in a worker process.
+
+    The VALUES tuples are written to fragment_path, one per line. Row numbers in the
+    returned row log are relative to the start of the shard. Stage timings are always
+    collected; they are cheap next to the work they time.
+
+    Returns:
+        row_count (int): The number of CSV rows in the shard.
+        row_log (list): (csv_row_number, level, message) entries, see translate_chunk.
+        product_totals (dict): Totals per part number for this shard.
+        domain_partners (dict): Domain to partnerPurchasedPlanID map for this shard.
+        stages (dict): Stage timings of this shard, see RunMetrics.merge_stages.
+    """
+    metrics = RunMetrics()
+    with metrics.stage("read_csv"):
+        with open(csv_path, "rb") as f:
+            f.seek(start)
+            data = f.read(end - start)
+        df = read_report(io.BytesIO(data), csv_engine, header=None, names=columns)
+
+    product_totals = defaultdict(int)
+    domain_partners = {}
+    chargeable_rows, row_log = translate_chunk(df, _worker_rules, product_totals, domain_partners, metrics)
+    with metrics.stage("render"):
+        sql_rows = render_chargeable_rows(chargeable_rows)
+    with metrics.stage("write_fragment"):
+        with open(fragment_path, "w") as fragment:
+            fragment.writelines(f"{sql_row}\n" for sql_row in sql_rows)
+
+    return len(df), row_log, dict(product_totals), domain_partners, metrics.stages
+
+
+def generate_chargeable_sql_parallel(csv_path, rules, output_file, workers, partner_id_skip_list=PARTNER_IDS_TO_SKIP, batch_insert_size=0, shard_bytes=DEFAULT_SHARD_BYTES, buffer_size=DEFAULT_WRITE_BUFFER_SIZE, max_statement_bytes=0, skip_summary=None, metrics=None, csv_engine="auto", domain_memory_limit=DEFAULT_DOMAIN_MEMORY_LIMIT):
+    """
+    Generate SQL for chargeable inserts, translating byte-range shards of the CSV in a process pool.
+
+    Shard results are merged in file order, so the SQL, the logged row numbers, the product
+    totals and the domain map are identical to generate_chargeable_sql on the whole file.
+    Only SHARDS_IN_FLIGHT_PER_WORKER shards per worker are submitted ahead of the one being
+    merged, and each shard's result is released once it is merged, so the memory of the main
+    process is bounded by a few shards rather than the whole report.
+
+    Args:
+        csv_path (str): Path to the CSV report file.
+        rules (RuleTable or dict): The compiled rules, or a typemap dict, see generate_chargeable_sql.
+            They are sent to each worker process once.
+        output_file: The file to write the SQL insert statements to.
+        workers (int): The number of worker processes.
+        partner_id_skip_list (list): List of PartnerIDs to skip, when rules is a typemap dict.
+        batch_insert_size (int): The number of rows to include in each batch insert statement.
+            default: 0 (no batching).
+        shard_bytes (int): Upper bound on the size of a shard, which bounds each worker's memory.
+        buffer_size (int): The number of characters the SqlInsertWriter buffers within one statement.
+        max_statement_bytes (int): The largest statement to write, in bytes, see SqlInsertWriter.
+            default: 0 (no limit).
+        skip_summary (SkippedRowSummary): Optional per-reason counter for skipped rows, see log_rows.
+        metrics (RunMetrics): Optional collector for stage timings and row counters. The worker
+            stages are summed over all shards, so they add up to more than the wall-clock time.
+        csv_engine (str): The engine each worker reads its shard with, see csv_reader.read_report.
+        domain_memory_limit (int): Estimated bytes of the domain index to hold in memory, see DomainIndex.
+
+    Returns:
+        product_totals (dict): Dictionary mapping part numbers to total item counts (with unit reduction).
+        domain_partners (DomainIndex): Index mapping domains to partnerPurchasedPlanID.
+
+    Assumptions:
+    - Quoted fields never contain line breaks (see split_csv_shards).
+    """
+    rules = compile_rules(rules, partner_id_skip_list)
+    product_totals = defaultdict(int)
+    domain_partners = DomainIndex(domain_memory_limit)
+    metrics = metrics or NullMetrics()
+
+    columns = pd.read_csv(csv_path, nrows=0).columns.tolist()
+    shard_count = max(workers, -(-os.path.getsize(csv_path) // shard_bytes))
+    shards = split_csv_shards(csv_path, shard_count)
+    fragment_folder = tempfile.mkdtemp(prefix="usage_translator_")
+    fragment_paths = [os.path.join(fragment_folder, f"shard_{index}.sql") for index in range(len(shards))]
+
+    def shard_results(executor):
+        # Submit shards as earlier ones are merged, and drop each future once its result is taken
+        pending = deque()
+        shard_args = iter(zip(shards, fragment_paths))
+
+        def submit_next():
+            for (start, end), fragment_path in islice(shard_args, 1):
+                pending.append(executor.submit(_translate_shard, csv_path, start, end, columns, fragment_path, csv_engine))
+
+        for _ in range(workers * SHARDS_IN_FLIGHT_PER_WORKER):
+            submit_next()
+        while pending:
+            result = pending.popleft().result()
+            submit_next()
+            yield result
+
+    def merged_rows(results):
+        row_offset = 0
+        for fragment_path, (row_count, row_log, shard_totals, shard_domains, shard_stages) in zip(fragment_paths, results):
+            metrics.merge_stages(shard_stages)
+            with metrics.stage("log_rows"):
+                log_rows(row_log, row_offset, skip_summary)
+            for part_number, total in shard_totals.items():
+                product_totals[part_number] += total
+            domain_partners.update(shard_domains)
+            with open(fragment_path) as fragment:
+                for sql_row in fragment:
+                    yield sql_row[:-1]
+            os.remove(fragment_path)
+            metrics.count("rows_read", row_count)
+            row_offset += row_count
+
+    try:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(rules,)) as executor:
+            with chargeable_sql_writer(output_file, batch_insert_size, buffer_size, max_statement_bytes) as writer:
+                writer.write_rows(merged_rows(shard_results(executor)))
+            metrics.count("rows_valid", writer.rows_written)
+    finally:
+        shutil.rmtree(fragment_folder, ignore_errors=True)
+
+    return product_totals, domain_partners
@@ -1,3 +1,4 @@
+import numpy as np
 import pandas as pd
 from collections import defaultdict
 import logging
@@ -9,155 +10,277 @@ from constants import (
     PARTNER_ID,
     PLAN,
     PARTNER_IDS_TO_SKIP,
-    UNIT_REDUCTION,
-    CHARGEABLE_INSERT_HEADER,
-    DOMAINS_INSERT_HEADER,
-    NO_VALID_ROWS_CHARGEABLE_SQL,
-    NO_VALID_ROWS_DOMAINS_SQL,
+    DEFAULT_WRITE_BUFFER_SIZE,
+    DEFAULT_DOMAIN_MEMORY_LIMIT,
+    CHARGEABLE_COLUMNS,
 )
 from utils import clean_guid, escape_sql_string
+from sql_writer import chargeable_sql_writer, generate_domains_sql
+from metrics import NullMetrics
+from domain_index import DomainIndex
+from rules import compile_rules
+from aggregate import render_rows
+from validation import (
+    VALID,
+    MISSING_PART_NUMBER,
+    ITEM_COUNT_NOT_INTEGER,
+    ITEM_COUNT_NOT_POSITIVE,
+    PARTNER_ID_NOT_INTEGER,
+    PARTNER_ID_SKIPPED,
+    PART_NUMBER_NOT_IN_TYPEMAP,
+    INVALID_PLAN_ID,
+    MAX_PLAN_ID_LENGTH,
+    skip_message,
+    log_rows,
+)
+
 
-def generate_chargeable_sql(df, type_map, output_file, partner_id_skip_list=PARTNER_IDS_TO_SKIP, batch_insert_size=0):
+def _integer_column(column):
     """
-    Generate SQL for chargeable inserts.
+    Check which values of a column are integers, mirroring isinstance(value, int) on a row value.
+    In a nullable integer column (as read by csv_reader.read_report), every value but <NA> is an integer.
+
+    Returns:
+        is_integer (np.ndarray): Boolean mask of integer values.
+        values (np.ndarray): The integer values as int64, with 0 where the value is not an integer.
+    """
+    if isinstance(column.dtype, pd.api.extensions.ExtensionDtype) and pd.api.types.is_integer_dtype(column):
+        return column.notna().to_numpy(dtype=bool), column.fillna(0).to_numpy(dtype=np.int64)
+    if pd.api.types.is_integer_dtype(column) or pd.api.types.is_bool_dtype(column):
+        return np.ones(len(column), dtype=bool), column.to_numpy(dtype=np.int64)
+    if column.dtype != object:
+        return np.zeros(len(column), dtype=bool), np.zeros(len(column), dtype=np.int64)
+
+    is_integer = column.map(lambda value: isinstance(value, int)).to_numpy(dtype=bool)
+    values = np.zeros(len(column), dtype=np.int64)
+    values[is_integer] = column[is_integer].to_numpy(dtype=np.int64)
+    return is_integer, values
+
+
+def _validate_rows(df, rules):
+    """
+    Run every validation rule over whole columns of the DataFrame.
 
     Args:
-        df (pd.DataFrame): DataFrame containing usage data.
-        type_map (dict): Mapping of part numbers to product names.
-        output_file: The file to write the SQL insert statements to.
-        partner_id_skip_list (list): List of PartnerIDs to skip.
-        batch_insert_size (int): The number of rows to include in each batch insert statement.
-            default: 0 (no batching).
+        df (pd.DataFrame): Chunk of usage data.
+        rules (RuleTable): The compiled typemap and skip list.
 
     Returns:
-        product_totals (dict): Dictionary mapping part numbers to total item counts (with unit reduction).
-        domain_partners (dict): Dictionary mapping domains to partnerPurchasedPlanID.
+        reasons (np.ndarray): The first failed rule for each row, or VALID.
+        item_counts (np.ndarray): ItemCount values as int64.
+        plan_ids (np.ndarray): Cleaned partnerPurchasedPlanID for rows that reached the GUID check, '' otherwise.
+    """
+    part_numbers = df[PART_NUMBER]
+    count_is_integer, item_counts = _integer_column(df[ITEM_COUNT])
+    partner_id_is_integer, partner_id_values = _integer_column(df[PARTNER_ID])
+    partner_id_skipped = partner_id_is_integer & rules.is_skipped(partner_id_values)
 
-    Assumptions:
-    - Any varchar field will fit in its column (i.e. no need to check length of plan).
-    - The totals of usage per part number are calculated using the unit reduction factor.
+    reasons = np.select(
+        [
+            part_numbers.isna().to_numpy(dtype=bool),
+            ~count_is_integer,
+            item_counts <= 0,
+            ~partner_id_is_integer,
+            partner_id_skipped,
+            ~part_numbers.isin(rules.part_numbers).to_numpy(dtype=bool),
+        ],
+        [
+            MISSING_PART_NUMBER,
+            ITEM_COUNT_NOT_INTEGER,
+            ITEM_COUNT_NOT_POSITIVE,
+            PARTNER_ID_NOT_INTEGER,
+            PARTNER_ID_SKIPPED,
+            PART_NUMBER_NOT_IN_TYPEMAP,
+        ],
+        default=VALID,
+    )
+
+    # Only clean the GUIDs of rows that passed every other rule
+    plan_ids = np.full(len(df), "", dtype=object)
+    candidates = reasons == VALID
+    cleaned = df[ACCOUNT_GUID][candidates].map(clean_guid).astype(object)
+    plan_ids[candidates] = cleaned.to_numpy(dtype=object)
+    plan_id_lengths = cleaned.str.len().to_numpy(dtype=np.int64)
+    invalid_plan_id = (plan_id_lengths == 0) | (plan_id_lengths > MAX_PLAN_ID_LENGTH)
+    reasons[np.flatnonzero(candidates)[invalid_plan_id]] = INVALID_PLAN_ID
+
+    return reasons, item_counts, plan_ids
+
+
+def translate_chunk(df, rules, product_totals, domain_partners, metrics=None):
     """
-    product_totals = defaultdict(int)
-    domain_partners = defaultdict(str)
-    
-    rows_to_insert = 0
-    batch_count = 0
-    insert_started = False
-
-    for index, row in df.iterrows():
-        csv_row_number = index + 2  # Adjust for header row and 0-based index
-        
-        part_number = row[PART_NUMBER]
-        item_count = row[ITEM_COUNT]
-        partner_id = row[PARTNER_ID]
-        account_guid = row[ACCOUNT_GUID]
-        domain = row[DOMAINS]
-        plan = row[PLAN]
-        partner_purchased_plan_id = clean_guid(account_guid)
-
-        try:
-            if pd.isna(part_number):
-                raise ValueError("PartNumber is missing")
-            elif not isinstance(item_count, int):
-                raise ValueError("ItemCount is not an integer")
-            elif item_count <= 0:
-                raise ValueError("ItemCount is zero or negative")
-            elif not isinstance(partner_id, int):
-                raise ValueError("PartnerID is not an integer")
-            elif partner_id_skip_list and partner_id in partner_id_skip_list:
-                raise ValueError(f"PartnerID {partner_id} is in the skip list")
-            elif part_number not in type_map:
-                raise ValueError(f"PartNumber {part_number} not found in typemap")
-            elif len(partner_purchased_plan_id) == 0 or len(partner_purchased_plan_id) > 32:
-                raise ValueError(f"Invalid partnerPurchasedPlanID ('{partner_purchased_plan_id}')")
-        except ValueError as e:
-            logging.warning(f"{e}: skipping row {csv_row_number}")
-            continue
-
-        translated_part_number = type_map[part_number]
-
-        if part_number in UNIT_REDUCTION:
-            item_count = item_count // UNIT_REDUCTION[part_number]
-        
-        product_totals[part_number] += item_count
-        domain_partners[domain] = partner_purchased_plan_id
-
-        if batch_count == 0:
-            output_file.write(CHARGEABLE_INSERT_HEADER)
-            insert_started = True
-        elif batch_count > 0:
-            output_file.write(",\n")
-
-        output_file.write(
-            f"\t({partner_id}, '{translated_part_number}', '{partner_purchased_plan_id}', '{escape_sql_string(plan)}', {item_count})"
+    Validate and translate one chunk of usage data, logging every skipped row.
+
+    Args:
+        df (pd.DataFrame): Chunk of usage data, indexed by its 0-based position in the CSV.
+        rules (RuleTable): The compiled typemap, unit reductions and skip list.
+        product_totals (dict): Running totals per part number, updated in place.
+        domain_partners (dict): Running domain to partnerPurchasedPlanID map, updated in place.
+        metrics (RunMetrics): Optional collector for the validate and translate stage timings.
+
+    Returns:
+        chargeable_rows (pd.DataFrame): The translated valid rows, with CHARGEABLE_COLUMNS, in CSV order.
+        row_log (list): (csv_row_number, level, message) for every skipped row, and for every
+            processed row when DEBUG logging is enabled, in CSV order.
+    """
+    metrics = metrics or NullMetrics()
+    with metrics.stage("validate"):
+        reasons, item_counts, plan_ids = _validate_rows(df, rules)
+    with metrics.stage("translate"):
+        is_valid = reasons == VALID
+        csv_row_numbers = df.index.to_numpy() + 2  # Adjust for header row and 0-based index
+
+        valid_rows = df[is_valid]
+        part_numbers = valid_rows[PART_NUMBER]
+        partner_ids = valid_rows[PARTNER_ID]
+        if isinstance(partner_ids.dtype, pd.api.extensions.ExtensionDtype):
+            partner_ids = partner_ids.astype(np.int64)  # No <NA> is left among the valid rows
+        valid_plan_ids = pd.Series(plan_ids[is_valid], index=valid_rows.index, dtype=object)
+        translated_part_numbers = part_numbers.map(rules.products).astype(str)
+        unit_reductions = part_numbers.map(rules.divisors).to_numpy(dtype=np.int64)
+        usage = pd.Series(item_counts[is_valid] // unit_reductions, index=valid_rows.index)
+
+        for part_number, total in usage.groupby(part_numbers, sort=False).sum().items():
+            product_totals[part_number] += int(total)
+        domain_partners.update(zip(valid_rows[DOMAINS], valid_plan_ids))
+
+        chargeable_rows = pd.DataFrame(
+            dict(zip(CHARGEABLE_COLUMNS, (partner_ids, translated_part_numbers, valid_plan_ids, valid_rows[PLAN], usage)))
         )
-        rows_to_insert += 1
-        batch_count += 1
-        logging.debug(f"Processed row {csv_row_number}: {partner_id}, {translated_part_number}, {partner_purchased_plan_id}, {plan}, {item_count}")
-        
-        if batch_insert_size > 0 and batch_count >= batch_insert_size:
-            logging.debug(f"Batch insert size reached: {batch_insert_size}; {rows_to_insert} rows inserted")
-            output_file.write(";\n")
-            batch_count = 0
-            insert_started = False
-    
-    if rows_to_insert == 0: 
-        output_file.truncate(0)
-        output_file.write(NO_VALID_ROWS_CHARGEABLE_SQL)
-        logging.info("No valid rows to insert into chargeable table")
-    elif insert_started:
-        output_file.write(";\n")
-        logging.info(f"Query inserts {rows_to_insert} rows into chargeable table")
 
-    return product_totals, domain_partners
+        # Keep the row log in CSV order so it matches a row-by-row pass
+        row_log = []
+        log_debug = logging.getLogger().isEnabledFor(logging.DEBUG)
+        if log_debug:
+            processed_rows = iter(zip(partner_ids, translated_part_numbers, valid_plan_ids, valid_rows[PLAN], usage))
+        partner_id_values = df[PARTNER_ID].to_numpy(dtype=object)
+        part_number_values = df[PART_NUMBER].to_numpy(dtype=object)
+        for position in (range(len(df)) if log_debug else np.flatnonzero(~is_valid)):
+            csv_row_number = int(csv_row_numbers[position])
+            if is_valid[position]:
+                partner_id, translated_part_number, partner_purchased_plan_id, plan, item_count = next(processed_rows)
+                row_log.append((csv_row_number, logging.DEBUG, f"{partner_id}, {translated_part_number}, {partner_purchased_plan_id}, {plan}, {item_count}"))
+                continue
+            message = skip_message(reasons[position], partner_id_values[position], part_number_values[position], plan_ids[position])
+            row_log.append((csv_row_number, logging.WARNING, message))
+
+    return chargeable_rows, row_log
+
 
-def generate_domains_sql(domain_map, output_file, batch_insert_size=0):
+def render_chargeable_rows(chargeable_rows):
     """
-    Generate SQL query for domain inserts.
+    Render translated chargeable rows as VALUES tuples.
 
     Args:
-        domain_map (dict): A dictionary mapping domain names to partnerPurchasedPlanID.
+        chargeable_rows (pd.DataFrame): Rows returned by translate_chunk.
+
+    Returns:
+        sql_rows (list): The VALUES tuple of each row.
+    """
+    # Formatted from Python values, so the result doesn't depend on the string dtype of each column
+    columns = (chargeable_rows[column].tolist() for column in CHARGEABLE_COLUMNS)
+    return [
+        f"\t({partner_id}, '{product}', '{partner_purchased_plan_id}', '{escape_sql_string(plan)}', {usage})"
+        for partner_id, product, partner_purchased_plan_id, plan, usage in zip(*columns)
+    ]
+
+
+def aggregate_chargeable_rows(chargeable_rows):
+    """
+    Sum the usage of translated chargeable rows per (partnerID, product, productPurchasedPlanID, plan).
+
+    Args:
+        chargeable_rows (pd.DataFrame): Rows returned by translate_chunk.
+
+    Returns:
+        rows (list): One (partnerID, product, productPurchasedPlanID, plan, usage) tuple of
+            Python values per group, in the order the groups first appear.
+    """
+    grouped = chargeable_rows.groupby(CHARGEABLE_COLUMNS[:-1], sort=False, observed=True, dropna=False)[CHARGEABLE_COLUMNS[-1]].sum().reset_index()
+    return list(zip(*(grouped[column].tolist() for column in CHARGEABLE_COLUMNS)))
+
+
+def translate_chunks(df, rules, product_totals, domain_partners, skip_summary=None, metrics=None):
+    """
+    Translate a DataFrame, or consecutive chunks of one, logging the per-row messages as it goes.
+
+    Args:
+        df (pd.DataFrame or iterable of pd.DataFrame): Usage data, see generate_chargeable_sql.
+        rules (RuleTable): The compiled typemap, unit reductions and skip list.
+        product_totals (dict): Running totals per part number, updated in place.
+        domain_partners (dict): Running domain to partnerPurchasedPlanID map, updated in place.
+        skip_summary (SkippedRowSummary): Optional per-reason counter for skipped rows, see log_rows.
+        metrics (RunMetrics): Optional collector for stage timings and row counters. Time spent
+            reading chunks from an iterator counts as the read_csv stage.
+
+    Yields:
+        chargeable_rows (pd.DataFrame): The translated valid rows of each chunk, see translate_chunk.
+    """
+    metrics = metrics or NullMetrics()
+    chunks = [df] if isinstance(df, pd.DataFrame) else metrics.timed(df, "read_csv")
+    for chunk in chunks:
+        chargeable_rows, row_log = translate_chunk(chunk, rules, product_totals, domain_partners, metrics)
+        with metrics.stage("log_rows"):
+            log_rows(row_log, skip_summary=skip_summary)
+        metrics.count("rows_read", len(chunk))
+        metrics.count("rows_valid", len(chargeable_rows))
+        yield chargeable_rows
+
+
+def generate_chargeable_sql(df, rules, output_file, partner_id_skip_list=PARTNER_IDS_TO_SKIP, batch_insert_size=0, buffer_size=DEFAULT_WRITE_BUFFER_SIZE, max_statement_bytes=0, skip_summary=None, metrics=None, domain_memory_limit=DEFAULT_DOMAIN_MEMORY_LIMIT, aggregate=None):
+    """
+    Generate SQL for chargeable inserts.
+
+    Validation and translation run as boolean masks over whole columns; only the
+    warnings for skipped rows and the rendered SQL lines are produced row by row.
+
+    Args:
+        df (pd.DataFrame or iterable of pd.DataFrame): DataFrame containing usage data, or consecutive
+            chunks of it (e.g. from pd.read_csv(..., chunksize=n)). Product totals, the domain map and
+            the open batch carry over from one chunk to the next.
+        rules (RuleTable or dict): The compiled rules (see rules.load_rules), or a typemap dict
+            mapping part numbers to product names, compiled with UNIT_REDUCTION and partner_id_skip_list.
         output_file: The file to write the SQL insert statements to.
+        partner_id_skip_list (list): List of PartnerIDs to skip, when rules is a typemap dict.
         batch_insert_size (int): The number of rows to include in each batch insert statement.
             default: 0 (no batching).
+        buffer_size (int): The number of characters the SqlInsertWriter buffers within one statement.
+        max_statement_bytes (int): The largest statement to write, in bytes, see SqlInsertWriter.
+            default: 0 (no limit).
+        skip_summary (SkippedRowSummary): Optional per-reason counter for skipped rows, see log_rows.
+        metrics (RunMetrics): Optional collector for the read_csv, validate, translate, log_rows,
+            render and write stage timings.
+        domain_memory_limit (int): Estimated bytes of the domain index to hold in memory, see DomainIndex.
+        aggregate (UsageAggregate): If given, the usage of each chunk is summed into it per
+            (partnerID, product, productPurchasedPlanID, plan), and one row per group is written
+            once every chunk is translated.
 
     Returns:
-        None
-    
+        product_totals (dict): Dictionary mapping part numbers to total item counts (with unit reduction).
+        domain_partners (DomainIndex): Index mapping domains to partnerPurchasedPlanID.
+
     Assumptions:
-    - Each unique domain only has a single corresponding partnerPurchasedPlanID
-    - The table is empty before running this script, so no need to check for duplicates
-    - Domain names shouldn't contain ' characters, but if they do, they will be escaped
-    - partnerPurchasedPlanID should be a valid GUID and is already cleaned
+    - Any varchar field will fit in its column (i.e. no need to check length of plan).
+    - The totals of usage per part number are calculated using the unit reduction factor.
+    - Chunks keep the CSV's 0-based row positions as their index, so warnings report global row numbers.
     """
-    if len(domain_map) == 0:
-        output_file.write(NO_VALID_ROWS_DOMAINS_SQL)
-        logging.info("No valid rows to insert into domains table")
-        return
-
-    rows_to_insert = 0
-    batch_count = 0
-    insert_started = False
-
-    for domain, partner_purchased_plan_id in domain_map.items():
-        if batch_count == 0:
-            output_file.write(DOMAINS_INSERT_HEADER)
-            insert_started = True
-        elif batch_count > 0:
-            output_file.write(",\n")
-        
-        output_file.write(f"\t('{escape_sql_string(domain)}', '{partner_purchased_plan_id}')")
-        rows_to_insert += 1
-        batch_count += 1
-        logging.debug(f"Processed domain {domain}: {partner_purchased_plan_id}")
-        
-        if batch_insert_size > 0 and batch_count >= batch_insert_size:
-            logging.debug(f"Batch insert size reached: {batch_insert_size}; {rows_to_insert} rows inserted")
-            output_file.write(";\n")
-            batch_count = 0
-            insert_started = False
-
-    if insert_started:
-        output_file.write(";\n")
-        
-    logging.info(f"Query inserts {rows_to_insert} rows into domains table")
+    rules = compile_rules(rules, partner_id_skip_list)
+    product_totals = defaultdict(int)
+    domain_partners = DomainIndex(domain_memory_limit)
+    metrics = metrics or NullMetrics()
+
+    with chargeable_sql_writer(output_file, batch_insert_size, buffer_size, max_statement_bytes) as writer:
+        for chargeable_rows in translate_chunks(df, rules, product_totals, domain_partners, skip_summary, metrics):
+            if aggregate is not None:
+                with metrics.stage("aggregate"):
+                    aggregate.add(aggregate_chargeable_rows(chargeable_rows), len(chargeable_rows))
+                continue
+            with metrics.stage("render"):
+                sql_rows = render_chargeable_rows(chargeable_rows)
+            with metrics.stage("write"):
+                writer.write_rows(sql_rows)
+        if aggregate is not None:
+            with metrics.stage("write"):
+                writer.write_rows(render_rows(aggregate.rows()))
+
+    return product_totals, domain_partners
@@ -0,0 +1,137 @@
+import hashlib
+import json
+import logging
+import os
+import pickle
+from constants import PARTNER_IDS_TO_SKIP, UNIT_REDUCTION
+
+# Bump when the pickled RuleTable changes, so older caches are rebuilt
+RULES_CACHE_VERSION = 2
+
+
+class RuleTable:
+    """
+    The typemap, unit reductions and partner skip list, compiled for vectorized lookups.
+
+    Every part number of the typemap gets one record: its product and the divisor of its
+    item counts (1 when it has no unit reduction). Part numbers outside the typemap are
+    never translated, so their unit reductions are dropped. The skip list is a frozenset for
+    row-by-row checks; for whole chunks it is copied once into a sorted int64 array and looked
+    up with a binary search, so a chunk is checked against hundreds of thousands of partner IDs
+    without building a hash table per chunk. numpy is only imported for the chunk lookups.
+
+    Args:
+        type_map (dict): Mapping of part numbers to product names.
+        unit_reduction (dict): Mapping of part numbers to the factor their item counts are divided by.
+        partner_id_skip_list (iterable): PartnerIDs to skip.
+    """
+
+    def __init__(self, type_map, unit_reduction=UNIT_REDUCTION, partner_id_skip_list=PARTNER_IDS_TO_SKIP):
+        self.products = dict(type_map)
+        self.divisors = {part_number: int(unit_reduction.get(part_number, 1)) for part_number in self.products}
+        self.part_numbers = list(self.products)
+        self.skip_partner_ids = frozenset(int(partner_id) for partner_id in partner_id_skip_list)
+        self._sorted_skip_partner_ids = None
+
+    def is_skipped(self, partner_ids):
+        """
+        Check which partner IDs are in the skip list.
+
+        Args:
+            partner_ids (np.ndarray): int64 partner IDs.
+
+        Returns:
+            is_skipped (np.ndarray): Boolean mask of the skipped partner IDs.
+        """
+        import numpy as np
+
+        if not self.skip_partner_ids:
+            return np.zeros(len(partner_ids), dtype=bool)
+        if self._sorted_skip_partner_ids is None:
+            self._sorted_skip_partner_ids = np.array(sorted(self.skip_partner_ids), dtype=np.int64)
+        skip_partner_ids = self._sorted_skip_partner_ids
+        positions = np.searchsorted(skip_partner_ids, partner_ids)
+        positions[positions == len(skip_partner_ids)] = 0
+        return skip_partner_ids[positions] == partner_ids
+
+    def fingerprint(self):
+        """
+        Hash the rules, so a checkpoint is only resumed with the rules it was written with.
+        """
+        rules = json.dumps([self.products, self.divisors, sorted(self.skip_partner_ids)], sort_keys=True)
+        return hashlib.sha256(rules.encode()).hexdigest()
+
+    def __len__(self):
+        return len(self.products)
+
+
+def compile_rules(rules, partner_id_skip_list=PARTNER_IDS_TO_SKIP):
+    """
+    Get a RuleTable from either a RuleTable or a plain typemap dict.
+
+    A typemap dict is compiled with UNIT_REDUCTION and partner_id_skip_list;
+    partner_id_skip_list is ignored for a RuleTable, which has its own.
+    """
+    if isinstance(rules, RuleTable):
+        return rules
+    return RuleTable(rules, UNIT_REDUCTION, partner_id_skip_list)
+
+
+def load_skip_list(path):
+    """
+    Read a partner skip list: a JSON list, or one PartnerID per line with blank lines and # comments ignored.
+    """
+    with open(path) as f:
+        if path.endswith(".json"):
+            return json.load(f)
+        return [int(line) for line in (line.split("#", 1)[0].strip() for line in f) if line]
+
+
+def _source_stats(paths):
+    return [(os.path.abspath(path), os.stat(path).st_size, os.stat(path).st_mtime_ns) for path in paths]
+
+
+def load_rules(typemap_path, unit_reduction_path=None, skip_list_path=None, cache_path=None):
+    """
+    Load and compile the rules from their files.
+
+    Args:
+        typemap_path (str): Path to the typemap JSON file.
+        unit_reduction_path (str): Path to a JSON file mapping part numbers to unit reduction
+            factors, or None for the built-in UNIT_REDUCTION.
+        skip_list_path (str): Path to a skip list file (see load_skip_list), or None for the
+            built-in PARTNER_IDS_TO_SKIP.
+        cache_path (str): If given, the compiled RuleTable is pickled here and loaded from it
+            on later runs, until one of the source files changes.
+
+    Returns:
+        rules (RuleTable): The compiled rules.
+    """
+    paths = [path for path in (typemap_path, unit_reduction_path, skip_list_path) if path is not None]
+    sources = [RULES_CACHE_VERSION, _source_stats(paths)]
+    if cache_path is not None and os.path.exists(cache_path):
+        try:
+            with open(cache_path, "rb") as f:
+                cached_sources, rules = pickle.load(f)
+            if cached_sources == sources:
+                logging.info(f"Loaded compiled rules: {cache_path}")
+                return rules
+        except (pickle.UnpicklingError, EOFError, AttributeError, ValueError):
+            logging.warning(f"Rules cache {cache_path} is unreadable, rebuilding it")
+
+    with open(typemap_path) as f:
+        type_map = json.load(f)
+    unit_reduction = UNIT_REDUCTION
+    if unit_reduction_path is not None:
+        with open(unit_reduction_path) as f:
+            unit_reduction = json.load(f)
+    partner_id_skip_list = PARTNER_IDS_TO_SKIP if skip_list_path is None else load_skip_list(skip_list_path)
+    rules = RuleTable(type_map, unit_reduction, partner_id_skip_list)
+
+    if cache_path is not None:
+        temp_path = f"{cache_path}.tmp"
+        with open(temp_path, "wb") as f:
+            pickle.dump((sources, rules), f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(temp_path, cache_path)
+        logging.info(f"Saved compiled rules: {cache_path}")
+    return rules
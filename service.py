@@ -0,0 +1,335 @@
+import asyncio
+import csv
+import logging
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit, parse_qs
+from constants import (
+    REQUIRED_COLUMNS,
+    DEFAULT_CHUNK_SIZE,
+    DEFAULT_SERVICE_HOST,
+    DEFAULT_WRITE_BUFFER_SIZE,
+    DEFAULT_SERVICE_WORKERS,
+    DEFAULT_SERVICE_MAX_PENDING,
+    DEFAULT_SERVICE_MAX_UPLOAD,
+    DEFAULT_SERVICE_QUEUE_SIZE,
+    SERVICE_STREAM_CHUNK_SIZE,
+    SERVICE_SPOOL_BYTES,
+)
+from csv_reader import read_report
+from processor import generate_chargeable_sql, generate_domains_sql
+from utils import SkippedRowSummary
+
+REASONS = {
+    200: "OK",
+    400: "Bad Request",
+    404: "Not Found",
+    405: "Method Not Allowed",
+    411: "Length Required",
+    413: "Payload Too Large",
+    503: "Service Unavailable",
+}
+
+
+class HttpError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+
+
+class ResponseStream:
+    """
+    Text file handed to the SQL generators in a worker thread, which sends what is written to
+    the event loop through a bounded queue.
+
+    Writes are collected into chunks of SERVICE_STREAM_CHUNK_SIZE characters. When the queue
+    is full because the client reads slowly, the worker thread blocks until there is room,
+    so a request never holds more than the queue size of SQL in memory.
+    """
+
+    def __init__(self, loop, queue):
+        self.loop = loop
+        self.queue = queue
+        self.aborted = False
+        self._buffer = []
+        self._buffered_chars = 0
+
+    def write(self, text):
+        self._buffer.append(text)
+        self._buffered_chars += len(text)
+        if self._buffered_chars >= SERVICE_STREAM_CHUNK_SIZE:
+            self.flush()
+
+    def flush(self):
+        if self._buffer:
+            self._put("".join(self._buffer).encode())
+            self._buffer.clear()
+            self._buffered_chars = 0
+
+    def close(self):
+        self.flush()
+        self._put(None)
+
+    def _put(self, data):
+        if self.aborted:
+            raise ConnectionAbortedError("The client closed the connection")
+        asyncio.run_coroutine_threadsafe(self.queue.put(data), self.loop).result()
+
+
+def check_columns(report):
+    """
+    Check the header row of an uploaded report file, like the command line does before translating.
+    """
+    header = report.readline().decode("utf-8", errors="replace").strip()
+    report.seek(0)
+    if not header:
+        raise HttpError(400, "CSV is empty")
+    columns = next(csv.reader([header]))
+    missing_columns = [column for column in REQUIRED_COLUMNS if column not in columns]
+    if missing_columns:
+        raise HttpError(400, f"CSV is missing required columns: {', '.join(missing_columns)}")
+
+
+def translate_report(report, rules, output_file, batch_insert_size=0, chunk_size=DEFAULT_CHUNK_SIZE, max_statement_bytes=0, log_each_row=False):
+    """
+    Translate an uploaded report, a binary file, writing the chargeable SQL and then the domains SQL to output_file.
+
+    Returns:
+        product_totals (dict): Dictionary mapping part numbers to total item counts (with unit reduction).
+        skip_summary (SkippedRowSummary): Counts of the skipped rows per reason.
+    """
+    skip_summary = SkippedRowSummary(log_each_row=log_each_row)
+    chunks = read_report(report, "c", chunksize=chunk_size)
+    product_totals, domain_map = generate_chargeable_sql(chunks, rules, output_file, batch_insert_size=batch_insert_size, buffer_size=min(DEFAULT_WRITE_BUFFER_SIZE, SERVICE_STREAM_CHUNK_SIZE), max_statement_bytes=max_statement_bytes, skip_summary=skip_summary)
+    try:
+        generate_domains_sql(domain_map, output_file, batch_insert_size=batch_insert_size, buffer_size=SERVICE_STREAM_CHUNK_SIZE, max_statement_bytes=max_statement_bytes)
+    finally:
+        domain_map.close()
+    return product_totals, skip_summary
+
+
+class TranslatorService:
+    """
+    Translate uploaded reports over HTTP, keeping the rules and imports warm between requests.
+
+    POST /translate with a CSV report as the body streams back the chargeable SQL followed by
+    the domains SQL, with chunked transfer encoding, as it is generated. The batch size can be
+    set with ?batch_insert_size=n and the statement size limit with ?max_statement_bytes=n.
+    GET /health answers "ok".
+
+    Reports are translated by a pool of worker threads. Up to max_pending requests wait for a
+    free worker; requests beyond that are answered with 503 right away. Each uploaded report
+    is held in memory up to SERVICE_SPOOL_BYTES and spooled to a temporary file beyond that,
+    so the bodies of all requests take at most (workers + max_pending) * SERVICE_SPOOL_BYTES
+    of memory. While a response is streamed, at most queue_size chunks are held for a slow
+    client before its worker pauses.
+
+    Args:
+        rules (RuleTable): The compiled rules, shared by all requests.
+        workers (int): The number of reports translated at the same time.
+        max_pending (int): The number of requests that can wait for a worker.
+        max_upload_bytes (int): The largest report accepted, larger ones get 413.
+        queue_size (int): The number of response chunks buffered per request.
+        chunk_size (int): The number of CSV rows translated at a time.
+        log_skipped_rows (bool): If set, every skipped row is logged, as with --skipped-rows full;
+            otherwise only the number of skipped rows of each report.
+
+    Assumptions:
+    - Each connection carries one request; responses are sent with Connection: close.
+    """
+
+    def __init__(self, rules, workers=DEFAULT_SERVICE_WORKERS, max_pending=DEFAULT_SERVICE_MAX_PENDING, max_upload_bytes=DEFAULT_SERVICE_MAX_UPLOAD, queue_size=DEFAULT_SERVICE_QUEUE_SIZE, chunk_size=DEFAULT_CHUNK_SIZE, log_skipped_rows=False):
+        self.rules = rules
+        self.workers = workers
+        self.max_pending = max_pending
+        self.max_upload_bytes = max_upload_bytes
+        self.queue_size = queue_size
+        self.chunk_size = chunk_size
+        self.log_skipped_rows = log_skipped_rows
+        self.active_requests = 0
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="translator")
+
+    async def start(self, host=None, port=None, socket_path=None):
+        """
+        Start listening on host:port, or on a Unix socket at socket_path.
+
+        Returns:
+            server (asyncio.Server): The listening server.
+        """
+        if socket_path is not None:
+            server = await asyncio.start_unix_server(self.handle, path=socket_path)
+            logging.info(f"Translator service listening on {socket_path} ({self.workers} workers)")
+        else:
+            server = await asyncio.start_server(self.handle, host, port)
+            address = server.sockets[0].getsockname()
+            logging.info(f"Translator service listening on http://{address[0]}:{address[1]} ({self.workers} workers)")
+        return server
+
+    def close(self):
+        self._executor.shutdown(wait=True)
+
+    async def handle(self, reader, writer):
+        """
+        Serve one connection.
+        """
+        try:
+            try:
+                method, target, headers = await self._read_request_head(reader)
+                await self._route(method, target, headers, reader, writer)
+            except HttpError as e:
+                await self._send_error(writer, e.status, e.message)
+        except (ConnectionError, asyncio.IncompleteReadError):
+            logging.info("Client closed the connection before the response was sent")
+        finally:
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except ConnectionError:
+                pass
+
+    async def _read_request_head(self, reader):
+        request_line = (await reader.readline()).decode("latin-1").strip()
+        parts = request_line.split()
+        if len(parts) != 3:
+            raise HttpError(400, "Malformed request line")
+        headers = {}
+        while True:
+            line = (await reader.readline()).decode("latin-1")
+            if line in ("\r\n", "\n", ""):
+                break
+            name, _, value = line.partition(":")
+            headers[name.strip().lower()] = value.strip()
+        return parts[0], parts[1], headers
+
+    async def _route(self, method, target, headers, reader, writer):
+        url = urlsplit(target)
+        if url.path == "/health":
+            if method != "GET":
+                raise HttpError(405, "Use GET")
+            await self._send_text(writer, 200, "ok\n")
+            return
+        if url.path != "/translate":
+            raise HttpError(404, f"Unknown path {url.path}")
+        if method != "POST":
+            raise HttpError(405, "Use POST")
+
+        query = parse_qs(url.query)
+        try:
+            batch_insert_size = int(query.get("batch_insert_size", ["0"])[0])
+            max_statement_bytes = int(query.get("max_statement_bytes", ["0"])[0])
+        except ValueError:
+            raise HttpError(400, "batch_insert_size and max_statement_bytes must be integers")
+        if "content-length" not in headers:
+            raise HttpError(411, "Content-Length is required")
+        try:
+            content_length = int(headers["content-length"])
+        except ValueError:
+            raise HttpError(400, "Content-Length must be an integer")
+        if content_length > self.max_upload_bytes:
+            raise HttpError(413, f"Reports are limited to {self.max_upload_bytes} bytes")
+        if self.active_requests >= self.workers + self.max_pending:
+            raise HttpError(503, "Too many reports in progress, retry later")
+
+        self.active_requests += 1
+        try:
+            with tempfile.SpooledTemporaryFile(max_size=SERVICE_SPOOL_BYTES) as report:
+                await self._receive_report(reader, content_length, report)
+                check_columns(report)
+                await self._stream_translation(report, content_length, batch_insert_size, max_statement_bytes, writer)
+        finally:
+            self.active_requests -= 1
+
+    async def _receive_report(self, reader, content_length, report):
+        """
+        Copy the request body into the report file, a chunk at a time.
+        """
+        remaining = content_length
+        while remaining:
+            data = await reader.read(min(remaining, SERVICE_STREAM_CHUNK_SIZE))
+            if not data:
+                raise asyncio.IncompleteReadError(b"", remaining)
+            report.write(data)
+            remaining -= len(data)
+        report.seek(0)
+
+    async def _stream_translation(self, report, report_bytes, batch_insert_size, max_statement_bytes, writer):
+        loop = asyncio.get_running_loop()
+        queue = asyncio.Queue(maxsize=self.queue_size)
+        stream = ResponseStream(loop, queue)
+
+        def translate():
+            product_totals, skip_summary = translate_report(report, self.rules, stream, batch_insert_size, self.chunk_size, max_statement_bytes, self.log_skipped_rows)
+            stream.close()
+            return product_totals, skip_summary
+
+        def end_stream_on_failure(job):
+            # A failed job never closes the stream, so end it here for the loop below
+            if not job.cancelled() and job.exception() is not None:
+                loop.create_task(queue.put(None))
+
+        job = loop.run_in_executor(self._executor, translate)
+        job.add_done_callback(end_stream_on_failure)
+
+        writer.write(self._head(200, "application/sql; charset=utf-8", chunked=True))
+        try:
+            while (data := await queue.get()) is not None:
+                writer.write(b"%x\r\n%s\r\n" % (len(data), data))
+                await writer.drain()
+        except ConnectionError:
+            stream.aborted = True
+            await self._discard(queue, job)
+            raise
+
+        try:
+            _, skip_summary = await job
+        except Exception:
+            logging.exception("Translating an uploaded report failed")
+            return  # The response ends without its last chunk, so the client sees it is incomplete
+        writer.write(b"0\r\n\r\n")
+        await writer.drain()
+        logging.info(f"Translated an uploaded report ({report_bytes} bytes, {skip_summary.total} rows skipped)")
+
+    async def _discard(self, queue, job):
+        """
+        Empty the queue until the job has stopped, so a worker blocked on a full queue can finish.
+        """
+        while not job.done():
+            getter = asyncio.ensure_future(queue.get())
+            await asyncio.wait({getter, job}, return_when=asyncio.FIRST_COMPLETED)
+            getter.cancel()
+        job.exception()  # The ConnectionAbortedError raised in the worker is expected
+
+    def _head(self, status, content_type, chunked=False, content_length=0):
+        lines = [f"HTTP/1.1 {status} {REASONS[status]}", f"Content-Type: {content_type}", "Connection: close"]
+        lines.append("Transfer-Encoding: chunked" if chunked else f"Content-Length: {content_length}")
+        return ("\r\n".join(lines) + "\r\n\r\n").encode("latin-1")
+
+    async def _send_text(self, writer, status, text):
+        data = text.encode()
+        writer.write(self._head(status, "text/plain; charset=utf-8", content_length=len(data)) + data)
+        await writer.drain()
+
+    async def _send_error(self, writer, status, message):
+        logging.warning(f"Rejected request: {status} {message}")
+        await self._send_text(writer, status, f"{message}\n")
+
+
+async def serve(rules, host=DEFAULT_SERVICE_HOST, port=8080, socket_path=None, **options):
+    """
+    Run a TranslatorService until the task is cancelled.
+
+    Args:
+        rules (RuleTable): The compiled rules.
+        host (str): The address to listen on.
+        port (int): The TCP port to listen on.
+        socket_path (str): If given, listen on this Unix socket instead of host:port.
+        **options: Passed to TranslatorService (e.g. workers, max_pending).
+    """
+    service = TranslatorService(rules, **options)
+    server = await service.start(host, port, socket_path)
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        service.close()
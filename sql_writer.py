@@ -0,0 +1,253 @@
+import logging
+from collections import Counter
+from constants import (
+    CHARGEABLE_INSERT_HEADER,
+    DOMAINS_INSERT_HEADER,
+    NO_VALID_ROWS_CHARGEABLE_SQL,
+    NO_VALID_ROWS_DOMAINS_SQL,
+    DEFAULT_WRITE_BUFFER_SIZE,
+)
+from utils import escape_sql_string
+
+
+class SqlInsertWriter:
+    """
+    Write rendered VALUES tuples as (optionally batched) INSERT statements.
+
+    Each batch is built in memory and written with a single write call. Only the
+    rows that exceed buffer_size characters within one statement are written early,
+    so unbatched inserts of large reports don't have to be held in memory.
+    The writer never seeks, so it also works on pipes and other non-seekable streams.
+
+    A statement ends after batch_insert_size rows, or before the row that would take it past
+    max_statement_bytes UTF-8 bytes (from the INSERT line to the closing semicolon), whichever
+    comes first. A single row that is over the budget on its own gets a statement of its own and
+    a warning. The number of rows per statement is counted, see statement_stats.
+
+    Args:
+        output_file: The file to write the SQL insert statements to.
+        table (str): The table name, used in log messages.
+        header (str): The INSERT ... VALUES line that starts each statement.
+        no_rows_sql (str): Written instead of any statement when no rows are written.
+        batch_insert_size (int): The number of rows to include in each batch insert statement.
+            default: 0 (no batching).
+        buffer_size (int): The number of characters to buffer before writing a partial statement.
+        max_statement_bytes (int): The largest statement to write, in bytes.
+            default: 0 (no limit).
+    """
+
+    def __init__(self, output_file, table, header, no_rows_sql, batch_insert_size=0, buffer_size=DEFAULT_WRITE_BUFFER_SIZE, max_statement_bytes=0):
+        self.output_file = output_file
+        self.table = table
+        self.header = header
+        self.no_rows_sql = no_rows_sql
+        self.batch_insert_size = batch_insert_size
+        self.buffer_size = buffer_size
+        self.max_statement_bytes = max_statement_bytes
+
+        self.rows_written = 0
+        self.statement_rows = Counter()  # rows per statement -> number of statements
+        self.largest_statement = 0
+        self.widest_row = 0
+        self.oversized_statements = 0
+        self._batch_count = 0
+        self._statement_bytes = 0
+        self._header_bytes = len(header.encode("utf-8"))
+        # Sizes are only needed for the limit and the statement stats, which unbatched runs don't log
+        self._count_bytes = batch_insert_size > 0 or max_statement_bytes > 0
+        self._buffer = []
+        self._buffered_chars = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.flush()
+
+    def write_row(self, sql_row):
+        """
+        Add one VALUES tuple, starting or ending a statement as needed.
+        """
+        if self._count_bytes:
+            row_bytes = len(sql_row) if sql_row.isascii() else len(sql_row.encode("utf-8"))
+            if row_bytes > self.widest_row:
+                self.widest_row = row_bytes
+        else:
+            row_bytes = 0
+
+        if self._batch_count > 0 and self.max_statement_bytes > 0 and self._statement_bytes + 2 + row_bytes > self.max_statement_bytes:
+            logging.debug("Max statement bytes reached: %d; %d rows inserted", self.max_statement_bytes, self.rows_written)
+            self._end_statement()
+            self.flush()
+
+        if self._batch_count == 0:
+            separator = self.header
+            self._statement_bytes = self._header_bytes + row_bytes + 1  # 1 for the closing semicolon
+            if self.max_statement_bytes > 0 and self._statement_bytes > self.max_statement_bytes:
+                self.oversized_statements += 1
+                logging.warning("Row %d of the %s table makes a %d byte statement on its own, over the %d byte limit", self.rows_written + 1, self.table, self._statement_bytes, self.max_statement_bytes)
+        else:
+            separator = ",\n"
+            self._statement_bytes += 2 + row_bytes
+        self._buffer.append(separator)
+        self._buffer.append(sql_row)
+        self._buffered_chars += len(separator) + len(sql_row)
+        self.rows_written += 1
+        self._batch_count += 1
+
+        if self.batch_insert_size > 0 and self._batch_count >= self.batch_insert_size:
+            logging.debug("Batch insert size reached: %d; %d rows inserted", self.batch_insert_size, self.rows_written)
+            self._end_statement()
+            self.flush()
+        elif self._buffered_chars >= self.buffer_size:
+            self.flush()
+
+    def _end_statement(self):
+        self._buffer.append(";\n")
+        self.statement_rows[self._batch_count] += 1
+        if self._statement_bytes > self.largest_statement:
+            self.largest_statement = self._statement_bytes
+        self._batch_count = 0
+
+    def write_rows(self, sql_rows):
+        """
+        Add every VALUES tuple from an iterable.
+        """
+        for sql_row in sql_rows:
+            self.write_row(sql_row)
+
+    def flush(self):
+        """
+        Write everything buffered so far in a single call.
+        """
+        if self._buffer:
+            self.output_file.write("".join(self._buffer))
+            self._buffer.clear()
+            self._buffered_chars = 0
+
+    def state(self):
+        """
+        Get the position of the writer within its statements, for a checkpoint.
+
+        Call flush first, so the state matches what has been written to the output file.
+        """
+        return {"rows_written": self.rows_written, "batch_count": self._batch_count, "statement_bytes": self._statement_bytes}
+
+    def restore(self, state):
+        """
+        Continue from a state returned by state(), with the output file positioned where it was then.
+        """
+        self.rows_written = state["rows_written"]
+        self._batch_count = state["batch_count"]
+        self._statement_bytes = state["statement_bytes"]
+
+    def statement_stats(self):
+        """
+        Summarize the statements written so far (by this writer, so not before a restore). Sizes
+        are only counted when batch_insert_size or max_statement_bytes is set.
+
+        Returns:
+            stats (dict): The number of statements, the min, median and max rows per statement,
+                the largest statement and the widest row in bytes, and the number of statements
+                over max_statement_bytes. With max_statement_bytes, also safe_batch_insert_size:
+                the most rows per statement that stay within the limit if every row is as wide
+                as the widest row seen.
+        """
+        statements = sum(self.statement_rows.values())
+        stats = {
+            "statements": statements,
+            "min_rows": min(self.statement_rows, default=0),
+            "median_rows": 0,
+            "max_rows": max(self.statement_rows, default=0),
+            "largest_statement_bytes": self.largest_statement,
+            "widest_row_bytes": self.widest_row,
+            "oversized_statements": self.oversized_statements,
+        }
+        seen = 0
+        for rows in sorted(self.statement_rows):
+            seen += self.statement_rows[rows]
+            if seen * 2 >= statements:
+                stats["median_rows"] = rows
+                break
+        if self.max_statement_bytes > 0 and self.widest_row:
+            # header + n rows + (n - 1) separators + semicolon <= max_statement_bytes
+            stats["safe_batch_insert_size"] = max((self.max_statement_bytes - self._header_bytes + 1) // (self.widest_row + 2), 1)
+        return stats
+
+    def log_statement_stats(self):
+        """
+        Log the distribution of rows per statement.
+        """
+        stats = self.statement_stats()
+        logging.info(
+            f"{stats['statements']} statements into {self.table} table: {stats['min_rows']} min, {stats['median_rows']} median, "
+            f"{stats['max_rows']} max rows per statement; largest statement {stats['largest_statement_bytes']} bytes, widest row {stats['widest_row_bytes']} bytes"
+        )
+        if "safe_batch_insert_size" in stats:
+            logging.info(f"Largest --batch-insert-size that keeps rows this wide within {self.max_statement_bytes} bytes: {stats['safe_batch_insert_size']}")
+        if stats["oversized_statements"]:
+            logging.warning(f"{stats['oversized_statements']} {self.table} statements are over {self.max_statement_bytes} bytes with a single row")
+
+    def close(self):
+        """
+        End the open statement, or write the no valid rows comment if nothing was written.
+
+        Returns:
+            rows_written (int): The number of rows written.
+        """
+        if self.rows_written == 0:
+            self._buffer.append(self.no_rows_sql)
+            logging.info(f"No valid rows to insert into {self.table} table")
+        else:
+            if self._batch_count > 0:
+                self._end_statement()
+            logging.info(f"Query inserts {self.rows_written} rows into {self.table} table")
+            if self.batch_insert_size > 0 or self.max_statement_bytes > 0:
+                self.log_statement_stats()
+        self.flush()
+        return self.rows_written
+
+
+def chargeable_sql_writer(output_file, batch_insert_size=0, buffer_size=DEFAULT_WRITE_BUFFER_SIZE, max_statement_bytes=0):
+    """
+    Create a SqlInsertWriter for the chargeable table.
+    """
+    return SqlInsertWriter(output_file, "chargeable", CHARGEABLE_INSERT_HEADER, NO_VALID_ROWS_CHARGEABLE_SQL, batch_insert_size, buffer_size, max_statement_bytes)
+
+
+def domains_sql_writer(output_file, batch_insert_size=0, buffer_size=DEFAULT_WRITE_BUFFER_SIZE, max_statement_bytes=0):
+    """
+    Create a SqlInsertWriter for the domains table.
+    """
+    return SqlInsertWriter(output_file, "domains", DOMAINS_INSERT_HEADER, NO_VALID_ROWS_DOMAINS_SQL, batch_insert_size, buffer_size, max_statement_bytes)
+
+
+def generate_domains_sql(domain_map, output_file, batch_insert_size=0, buffer_size=DEFAULT_WRITE_BUFFER_SIZE, max_statement_bytes=0):
+    """
+    Generate SQL query for domain inserts.
+
+    Args:
+        domain_map (dict or DomainIndex): A mapping of domain names to partnerPurchasedPlanID.
+        output_file: The file to write the SQL insert statements to.
+        batch_insert_size (int): The number of rows to include in each batch insert statement.
+            default: 0 (no batching).
+        buffer_size (int): The number of characters the SqlInsertWriter buffers within one statement.
+        max_statement_bytes (int): The largest statement to write, in bytes.
+            default: 0 (no limit).
+
+    Returns:
+        None
+    
+    Assumptions:
+    - Each unique domain only has a single corresponding partnerPurchasedPlanID
+    - The table is empty before running this script, so no need to check for duplicates
+    - Domain names shouldn't contain ' characters, but if they do, they will be escaped
+    - partnerPurchasedPlanID should be a valid GUID and is already cleaned
+    """
+    with domains_sql_writer(output_file, batch_insert_size, buffer_size, max_statement_bytes) as writer:
+        for domain, partner_purchased_plan_id in domain_map.items():
+            writer.write_row(f"\t('{escape_sql_string(domain)}', '{partner_purchased_plan_id}')")
+            logging.debug("Processed domain %s: %s", domain, partner_purchased_plan_id)
@@ -0,0 +1,228 @@
+import csv
+import io
+import logging
+import re
+from collections import defaultdict
+from contextlib import contextmanager
+from constants import (
+    REQUIRED_COLUMNS,
+    PARTNER_IDS_TO_SKIP,
+    DEFAULT_CHUNK_SIZE,
+    DEFAULT_WRITE_BUFFER_SIZE,
+    DEFAULT_DOMAIN_MEMORY_LIMIT,
+    INTEGER_PATTERN,
+    CSV_NA_VALUES,
+)
+from compressed_io import open_input
+from utils import clean_guid, escape_sql_string
+from sql_writer import chargeable_sql_writer
+from metrics import NullMetrics
+from domain_index import DomainIndex
+from rules import compile_rules
+from aggregate import render_rows
+from validation import (
+    VALID,
+    MISSING_PART_NUMBER,
+    ITEM_COUNT_NOT_INTEGER,
+    ITEM_COUNT_NOT_POSITIVE,
+    PARTNER_ID_NOT_INTEGER,
+    PARTNER_ID_SKIPPED,
+    PART_NUMBER_NOT_IN_TYPEMAP,
+    INVALID_PLAN_ID,
+    MAX_PLAN_ID_LENGTH,
+    skip_message,
+    log_rows,
+)
+
+# Missing values are represented like pandas reads them, so the string transforms see the same values
+NA = float("nan")
+_integer = re.compile(INTEGER_PATTERN)
+
+
+class CsvReport:
+    """
+    The required columns of a (possibly compressed) report, read with the csv module.
+
+    The header row is read when the report is created; the data rows are read, and
+    decompressed, each time blocks is iterated, block_rows at a time, so memory is bounded by
+    a block rather than the report.
+
+    Values that pd.read_csv reads as missing (CSV_NA_VALUES) become NA, and blank lines are
+    skipped, so the rows match the DataFrame of csv_reader.read_report. Required columns that
+    the report doesn't have are NA in every row; check columns before translating.
+
+    Args:
+        csv_path (str): Path to the CSV report file.
+        block_rows (int): The number of rows read and translated at a time.
+    """
+
+    def __init__(self, csv_path, block_rows=DEFAULT_CHUNK_SIZE):
+        self.csv_path = csv_path
+        self.block_rows = block_rows
+        with self._records() as records:
+            self.columns = next(records, [])
+            self.empty = not any(records)  # Stops at the first non-blank row
+
+    @contextmanager
+    def _records(self):
+        with open_input(self.csv_path) as binary, io.TextIOWrapper(binary, encoding="utf-8-sig", newline="") as f:
+            yield csv.reader(f)
+
+    def blocks(self):
+        """
+        Yield lists of row tuples with the values of REQUIRED_COLUMNS, NA where missing, like MappedReport.blocks.
+        """
+        positions = [self.columns.index(column) if column in self.columns else None for column in REQUIRED_COLUMNS]
+        width = len(self.columns)
+        with self._records() as records:
+            next(records, None)  # Skip the header row
+            rows = []
+            for record in records:
+                if not record:
+                    continue
+                if len(record) < width:
+                    record += [""] * (width - len(record))
+                rows.append(tuple(
+                    NA if position is None or record[position] in CSV_NA_VALUES else record[position]
+                    for position in positions
+                ))
+                if len(rows) == self.block_rows:
+                    yield rows
+                    rows = []
+            if rows:
+                yield rows
+
+
+def read_report_stdlib(csv_path, block_rows=DEFAULT_CHUNK_SIZE):
+    """
+    Open a (possibly compressed) report for the stdlib engine, without pandas. See CsvReport.
+    """
+    return CsvReport(csv_path, block_rows)
+
+
+def _to_integer(value):
+    """
+    Convert a field like csv_reader does: an integer, or None for anything that isn't one.
+    """
+    if value is NA:
+        return None
+    value = value.strip()
+    return int(value) if _integer.fullmatch(value) else None
+
+
+def translate_rows(rows, rules, product_totals, domain_partners, render=True):
+    """
+    Validate and translate report rows one by one, with the same rules as processor.translate_chunk.
+
+    Args:
+        rows (list): A block of row tuples, see CsvReport.blocks.
+        rules (RuleTable): The compiled typemap, unit reductions and skip list.
+        product_totals (dict): Running totals per part number, updated in place.
+        domain_partners (DomainIndex): Running domain to partnerPurchasedPlanID map, updated in place.
+        render (bool): If unset, valid rows are returned as (partnerID, product,
+            productPurchasedPlanID, plan, usage) tuples instead of VALUES tuples.
+
+    Returns:
+        sql_rows (list): The VALUES tuple of each valid row, in CSV order.
+        row_log (list): (csv_row_number, level, message) entries, see processor.translate_chunk.
+    """
+    products = rules.products
+    divisors = rules.divisors
+    skip_partner_ids = rules.skip_partner_ids
+    log_debug = logging.getLogger().isEnabledFor(logging.DEBUG)
+
+    sql_rows = []
+    row_log = []
+    domain_pairs = []
+    for csv_row_number, (partner_id, part_number, account_guid, plan, domain, item_count) in enumerate(rows, start=2):
+        plan_id = ""
+        item_count = _to_integer(item_count)
+        partner_id = _to_integer(partner_id)
+        if part_number is NA:
+            reason = MISSING_PART_NUMBER
+        elif item_count is None:
+            reason = ITEM_COUNT_NOT_INTEGER
+        elif item_count <= 0:
+            reason = ITEM_COUNT_NOT_POSITIVE
+        elif partner_id is None:
+            reason = PARTNER_ID_NOT_INTEGER
+        elif partner_id in skip_partner_ids:
+            reason = PARTNER_ID_SKIPPED
+        elif part_number not in products:
+            reason = PART_NUMBER_NOT_IN_TYPEMAP
+        else:
+            plan_id = clean_guid(account_guid)
+            reason = INVALID_PLAN_ID if not 0 < len(plan_id) <= MAX_PLAN_ID_LENGTH else VALID
+
+        if reason != VALID:
+            row_log.append((csv_row_number, logging.WARNING, skip_message(reason, partner_id, part_number, plan_id)))
+            continue
+        product = products[part_number]
+        usage = item_count // divisors[part_number]
+        product_totals[part_number] += usage
+        domain_pairs.append((domain, plan_id))
+        if render:
+            sql_rows.append(f"\t({partner_id}, '{product}', '{plan_id}', '{escape_sql_string(plan)}', {usage})")
+        else:
+            sql_rows.append((partner_id, product, plan_id, plan, usage))
+        if log_debug:
+            row_log.append((csv_row_number, logging.DEBUG, f"{partner_id}, {product}, {plan_id}, {plan}, {usage}"))
+
+    domain_partners.update(domain_pairs)
+    return sql_rows, row_log
+
+
+def generate_chargeable_sql_stdlib(report, rules, output_file, partner_id_skip_list=PARTNER_IDS_TO_SKIP, batch_insert_size=0, buffer_size=DEFAULT_WRITE_BUFFER_SIZE, max_statement_bytes=0, skip_summary=None, metrics=None, domain_memory_limit=DEFAULT_DOMAIN_MEMORY_LIMIT, aggregate=None):
+    """
+    Generate SQL for chargeable inserts of a small report without pandas.
+
+    Starting pandas takes longer than translating a small report row by row, so this engine
+    only imports the standard library. Its output, logs and totals are the same as
+    generate_chargeable_sql on the same report.
+
+    Args:
+        report (CsvReport or MappedReport): The report, see read_report_stdlib and MappedReport.
+            It is read and translated one block at a time.
+        rules (RuleTable or dict): The compiled rules, or a typemap dict, see generate_chargeable_sql.
+        output_file: The file to write the SQL insert statements to.
+        partner_id_skip_list (list): List of PartnerIDs to skip, when rules is a typemap dict.
+        batch_insert_size (int): The number of rows to include in each batch insert statement.
+            default: 0 (no batching).
+        buffer_size (int): The number of characters the SqlInsertWriter buffers within one statement.
+        max_statement_bytes (int): The largest statement to write, in bytes, see SqlInsertWriter.
+            default: 0 (no limit).
+        skip_summary (SkippedRowSummary): Optional per-reason counter for skipped rows, see log_rows.
+        metrics (RunMetrics): Optional collector for the translate, log_rows and write stage timings.
+        domain_memory_limit (int): Estimated bytes of the domain index to hold in memory, see DomainIndex.
+        aggregate (UsageAggregate): If given, usage is summed per group and written once, see generate_chargeable_sql.
+
+    Returns:
+        product_totals (dict): Dictionary mapping part numbers to total item counts (with unit reduction).
+        domain_partners (DomainIndex): Index mapping domains to partnerPurchasedPlanID.
+    """
+    rules = compile_rules(rules, partner_id_skip_list)
+    product_totals = defaultdict(int)
+    domain_partners = DomainIndex(domain_memory_limit)
+    metrics = metrics or NullMetrics()
+
+    with chargeable_sql_writer(output_file, batch_insert_size, buffer_size, max_statement_bytes) as writer:
+        row_offset = 0
+        for rows in metrics.timed(report.blocks(), "read_csv"):
+            with metrics.stage("translate"):
+                sql_rows, row_log = translate_rows(rows, rules, product_totals, domain_partners, render=aggregate is None)
+            with metrics.stage("log_rows"):
+                log_rows(row_log, row_offset, skip_summary)
+            metrics.count("rows_read", len(rows))
+            metrics.count("rows_valid", len(sql_rows))
+            row_offset += len(rows)
+            if aggregate is not None:
+                with metrics.stage("aggregate"):
+                    aggregate.add(sql_rows)
+                continue
+            with metrics.stage("write"):
+                writer.write_rows(sql_rows)
+        if aggregate is not None:
+            with metrics.stage("write"):
+                writer.write_rows(render_rows(aggregate.rows()))
+
+    return product_totals, domain_partners
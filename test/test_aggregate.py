@@ -0,0 +1,92 @@
+import io
+import json
+import logging
+import pytest
+from aggregate import UsageAggregate
+from constants import DEFAULT_CSV_FILE, DEFAULT_JSON_FILE
+from csv_reader import read_report
+from mmap_scanner import MappedReport
+from processor import generate_chargeable_sql
+from stdlib_engine import read_report_stdlib, generate_chargeable_sql_stdlib
+
+type_map = {
+    "ADS000010U0R": "core.chargeable.adsync",
+    "EA000001GB0O": "core.chargeable.addarchiveingestspace",
+}
+
+REPORT = (
+    "PartnerID,accountGuid,domains,plan,PartNumber,itemCount\n"
+    "1,acc-1,a.com,Plan A,ADS000010U0R,5\n"
+    "1,acc-1,b.com,Plan A,ADS000010U0R,7\n"
+    "2,acc-2,c.com,Plan's B,EA000001GB0O,3000\n"
+    "1,acc-1,a.com,Plan A,EA000001GB0O,1500\n"
+    "26392,acc-3,d.com,Plan C,ADS000010U0R,1\n"
+    "2,acc-2,c.com,Plan's B,EA000001GB0O,999\n"
+    "1,acc-1,a.com,Plan Z,ADS000010U0R,1\n"
+    "1,acc-1,a.com,Plan A,ADS000010U0R,2\n"
+)
+
+EXPECTED_ROWS = [
+    "\t(1, 'core.chargeable.adsync', 'acc1', 'Plan A', 14)",
+    "\t(2, 'core.chargeable.addarchiveingestspace', 'acc2', 'Plan''s B', 3)",
+    "\t(1, 'core.chargeable.addarchiveingestspace', 'acc1', 'Plan A', 1)",
+    "\t(1, 'core.chargeable.adsync', 'acc1', 'Plan Z', 1)",
+]
+
+ROWS = [(1, "p", "a", "x", 5), (2, "p", "b", "x", 1), (1, "p", "a", "x", 2), (1, "q", "a", "x", 4), (2, "p", "b", "x", 3)]
+
+@pytest.mark.parametrize("memory_limit", [0, 1 << 20])
+def test_groups_are_summed_in_first_seen_order(memory_limit):
+    aggregate = UsageAggregate(memory_limit)
+    aggregate.add(ROWS[:2])
+    aggregate.add(ROWS[2:], row_count=10)
+    assert aggregate.spilled == (memory_limit == 0)
+    assert list(aggregate.rows()) == [(1, "p", "a", "x", 7), (2, "p", "b", "x", 4), (1, "q", "a", "x", 4)]
+    assert len(aggregate) == 3
+    assert aggregate.rows_added == 12
+    aggregate.close()
+
+def test_log_reduction(caplog):
+    aggregate = UsageAggregate()
+    aggregate.add(ROWS)
+    with caplog.at_level(logging.INFO):
+        aggregate.log_reduction()
+    assert "Aggregated 5 chargeable rows into 3 (40.0% fewer rows)" in caplog.text
+
+def generate(read, generate_sql, csv_path, memory_limit, batch_insert_size):
+    output = io.StringIO()
+    aggregate = UsageAggregate(memory_limit)
+    product_totals, _ = generate_sql(read(csv_path), type_map, output, batch_insert_size=batch_insert_size, aggregate=aggregate)
+    aggregate.close()
+    return output.getvalue(), dict(product_totals), aggregate.rows_added
+
+@pytest.mark.parametrize("read, generate_sql", [
+    (read_report, generate_chargeable_sql),
+    (lambda path: read_report(path, chunksize=3), generate_chargeable_sql),
+    (read_report_stdlib, generate_chargeable_sql_stdlib),
+    (lambda path: MappedReport(path, 60), generate_chargeable_sql_stdlib),
+])
+@pytest.mark.parametrize("memory_limit", [0, 1 << 20])
+def test_aggregated_sql(tmp_path, read, generate_sql, memory_limit):
+    csv_path = tmp_path / "report.csv"
+    csv_path.write_text(REPORT)
+    sql, product_totals, rows_added = generate(read, generate_sql, str(csv_path), memory_limit, batch_insert_size=3)
+    assert sql.split("\n") == [
+        "INSERT INTO chargeable (partnerID, product, productPurchasedPlanID, plan, usage) VALUES ",
+        *(f"{row}," for row in EXPECTED_ROWS[:2]), f"{EXPECTED_ROWS[2]};",
+        "INSERT INTO chargeable (partnerID, product, productPurchasedPlanID, plan, usage) VALUES ",
+        f"{EXPECTED_ROWS[3]};", "",
+    ]
+    assert product_totals == {"ADS000010U0R": 15, "EA000001GB0O": 4}
+    assert rows_added == 7
+
+def test_sample_report_without_duplicates_is_unchanged():
+    with open(DEFAULT_JSON_FILE) as f:
+        sample_type_map = json.load(f)
+    output = io.StringIO()
+    generate_chargeable_sql(read_report(DEFAULT_CSV_FILE), sample_type_map, output, batch_insert_size=100)
+    aggregate = UsageAggregate()
+    aggregated = io.StringIO()
+    generate_chargeable_sql(read_report(DEFAULT_CSV_FILE), sample_type_map, aggregated, batch_insert_size=100, aggregate=aggregate)
+    assert aggregated.getvalue() == output.getvalue()
+    assert aggregate.rows_added == len(aggregate) > 0
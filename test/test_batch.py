@@ -0,0 +1,144 @@
+import gzip
+import io
+import json
+import logging
+from concurrent.futures import ProcessPoolExecutor
+import pytest
+import batch
+from batch import find_reports, report_name, translate_reports, write_summary
+from constants import DEFAULT_CSV_FILE, CHARGEABLE_SQL_FILE, DOMAINS_SQL_FILE, BATCH_SUMMARY_FILE, REPORTS_IN_FLIGHT_PER_WORKER
+from csv_reader import read_report
+from metrics import RunMetrics
+from processor import generate_chargeable_sql
+from rules import RuleTable
+from sql_writer import generate_domains_sql
+
+type_map = {
+    "ADS000010U0R": "core.chargeable.adsync",
+    "EA000001GB0O": "core.chargeable.addarchiveingestspace",
+    "PLN006NR": "core.chargeable.exchange",
+}
+
+HEADER = "PartnerID,accountGuid,domains,plan,PartNumber,itemCount\n"
+FIRST_ROWS = ["1,acc-1,a.com,Plan A,ADS000010U0R,5", "26392,acc-2,b.com,Plan B,ADS000010U0R,7", "3,acc-3,c.com,Plan C,EA000001GB0O,3000"]
+SECOND_ROWS = ["4,acc-4,a.com,Plan D,PLN006NR,2", "5,acc-5,d.com,Plan E,UNKNOWN,1", "6,acc-6,e.com,Plan's F,ADS000010U0R,0"]
+
+def write_report(path, rows):
+    path.write_text(HEADER + "".join(f"{row}\n" for row in rows))
+    return str(path)
+
+def expected_sql(csv_path, batch_insert_size=0):
+    chargeable_sql, domains_sql = io.StringIO(), io.StringIO()
+    product_totals, domain_map = generate_chargeable_sql(read_report(csv_path), RuleTable(type_map), chargeable_sql, batch_insert_size=batch_insert_size)
+    generate_domains_sql(domain_map, domains_sql, batch_insert_size=batch_insert_size)
+    return chargeable_sql.getvalue(), domains_sql.getvalue(), dict(product_totals)
+
+def test_find_reports(tmp_path):
+    for name in ["b.csv", "a.csv.gz", "c.csv.zst", "notes.txt"]:
+        (tmp_path / name).write_text("")
+    (tmp_path / "folder.csv").mkdir()
+    assert find_reports(str(tmp_path)) == [str(tmp_path / name) for name in ["a.csv.gz", "b.csv", "c.csv.zst"]]
+    assert find_reports(str(tmp_path / "*.csv")) == [str(tmp_path / "b.csv")]
+    assert report_name("reports/march.csv.gz") == "march"
+    assert report_name("reports/march.tsv") == "march.tsv"
+
+@pytest.mark.parametrize("csv_engine", ["auto", "c", "mmap"])
+def test_reports_match_single_runs(tmp_path, csv_engine):
+    csv_paths = [write_report(tmp_path / "first.csv", FIRST_ROWS), DEFAULT_CSV_FILE]
+    output_folder = tmp_path / "output"
+    summary = translate_reports(csv_paths, RuleTable(type_map), str(output_folder), workers=2, batch_insert_size=2, csv_engine=csv_engine, chunk_size=1000)
+
+    totals = {}
+    for csv_path in csv_paths:
+        name = report_name(csv_path)
+        chargeable_sql, domains_sql, product_totals = expected_sql(csv_path, batch_insert_size=2)
+        assert (output_folder / f"{name}_{CHARGEABLE_SQL_FILE}").read_text() == chargeable_sql
+        assert (output_folder / f"{name}_{DOMAINS_SQL_FILE}").read_text() == domains_sql
+        for part_number, total in product_totals.items():
+            totals[part_number] = totals.get(part_number, 0) + total
+    assert summary["product_totals"] == totals
+    assert summary["failed_reports"] == 0
+    assert [report["rows_read"] for report in summary["reports"]] == [3, 13424]
+
+def test_merged_reports_match_one_concatenated_report(tmp_path):
+    csv_paths = [write_report(tmp_path / "first.csv", FIRST_ROWS), str(tmp_path / "second.csv.gz")]
+    with gzip.open(csv_paths[1], "wt") as f:
+        f.write(HEADER + "".join(f"{row}\n" for row in SECOND_ROWS))
+    output_folder = tmp_path / "output"
+    summary = translate_reports(csv_paths, RuleTable(type_map), str(output_folder), workers=2, merge=True)
+
+    chargeable_sql, domains_sql, product_totals = expected_sql(write_report(tmp_path / "all.csv", FIRST_ROWS + SECOND_ROWS))
+    assert (output_folder / CHARGEABLE_SQL_FILE).read_text() == chargeable_sql
+    assert (output_folder / DOMAINS_SQL_FILE).read_text() == domains_sql
+    assert summary["product_totals"] == product_totals
+    assert summary["reports"][1]["rows_skipped"] == 2
+
+def test_only_a_few_reports_are_in_flight(tmp_path, monkeypatch):
+    rows = FIRST_ROWS + SECOND_ROWS
+    csv_paths = [write_report(tmp_path / f"report_{index}.csv", rows[index % 6:] + rows[:index % 6]) for index in range(12)]
+    submitted, finished, in_flight = [0], [0], []
+
+    class RecordingExecutor(ProcessPoolExecutor):
+        def submit(self, *args, **kwargs):
+            submitted[0] += 1
+            in_flight.append(submitted[0] - finished[0])
+            return super().submit(*args, **kwargs)
+
+    def counting_replay_logs(log_path):
+        finished[0] += 1
+        return replay_logs(log_path)
+
+    replay_logs = batch._replay_logs
+    monkeypatch.setattr(batch, "ProcessPoolExecutor", RecordingExecutor)
+    monkeypatch.setattr(batch, "_replay_logs", counting_replay_logs)
+    output_folder = tmp_path / "output"
+    summary = translate_reports(csv_paths, RuleTable(type_map), str(output_folder), workers=2, merge=True)
+
+    all_rows = [row for index in range(12) for row in rows[index % 6:] + rows[:index % 6]]
+    chargeable_sql, domains_sql, product_totals = expected_sql(write_report(tmp_path / "all.csv", all_rows))
+    assert (output_folder / CHARGEABLE_SQL_FILE).read_text() == chargeable_sql
+    assert (output_folder / DOMAINS_SQL_FILE).read_text() == domains_sql
+    assert summary["product_totals"] == product_totals
+    assert submitted[0] == finished[0] == 12
+    # The report being merged, plus the ones submitted ahead of it
+    assert max(in_flight) == 2 * REPORTS_IN_FLIGHT_PER_WORKER + 1
+
+def test_failed_reports_are_summarized(tmp_path):
+    csv_paths = [write_report(tmp_path / "first.csv", FIRST_ROWS), str(tmp_path / "columns.csv"), str(tmp_path / "missing.csv")]
+    (tmp_path / "columns.csv").write_text("PartnerID,plan\n1,Plan A\n")
+    output_folder = tmp_path / "output"
+    summary = translate_reports(csv_paths, RuleTable(type_map), str(output_folder))
+    assert summary["failed_reports"] == 2
+    assert "missing required columns" in summary["reports"][1]["error"]
+    assert sorted(path.name for path in output_folder.iterdir()) == [f"first_{CHARGEABLE_SQL_FILE}", f"first_{DOMAINS_SQL_FILE}"]
+
+    write_summary(summary, str(output_folder))
+    with open(output_folder / BATCH_SUMMARY_FILE) as f:
+        assert json.load(f) == summary
+
+@pytest.mark.parametrize("csv_engine", ["auto", "c"])
+def test_unexpected_errors_fail_only_their_report(tmp_path, csv_engine):
+    # An empty plan reaches escape_sql_string as NaN, which raises an AttributeError rather than an IO error
+    csv_paths = [write_report(tmp_path / "first.csv", FIRST_ROWS), write_report(tmp_path / "plan.csv", ["1,acc-1,a.com,,ADS000010U0R,5"])]
+    output_folder = tmp_path / "output"
+    summary = translate_reports(csv_paths, RuleTable(type_map), str(output_folder), workers=2, csv_engine=csv_engine)
+    assert summary["failed_reports"] == 1
+    assert summary["reports"][0]["error"] is None
+    assert summary["reports"][1]["error"].startswith("AttributeError")
+    assert summary["product_totals"] == expected_sql(csv_paths[0])[2]
+    assert sorted(path.name for path in output_folder.iterdir()) == [f"first_{CHARGEABLE_SQL_FILE}", f"first_{DOMAINS_SQL_FILE}"]
+    assert (output_folder / f"first_{CHARGEABLE_SQL_FILE}").read_text() == expected_sql(csv_paths[0])[0]
+
+@pytest.mark.parametrize("skipped_rows", ["full", "summary"])
+def test_worker_logs_and_metrics_reach_the_main_process(tmp_path, caplog, skipped_rows):
+    csv_paths = [write_report(tmp_path / "first.csv", FIRST_ROWS), write_report(tmp_path / "second.csv", SECOND_ROWS)]
+    metrics = RunMetrics()
+    with caplog.at_level(logging.INFO):
+        translate_reports(csv_paths, RuleTable(type_map), str(tmp_path / "output"), workers=2, skipped_rows=skipped_rows, metrics=metrics)
+    messages = [record.getMessage() for record in caplog.records]
+    # The per-row lines of each report come before the report's summary, in report order
+    assert ("PartNumber UNKNOWN not found in typemap: skipping row 3" in messages) == (skipped_rows == "full")
+    assert messages.index("Query inserts 2 rows into chargeable table") < messages.index(f"Translated {csv_paths[0]}: 2 of 3 rows") < messages.index(f"Translated {csv_paths[1]}: 1 of 3 rows")
+    assert metrics.counters == {"rows_read": 6, "rows_valid": 3}
+    assert metrics.skipped_rows == {"PartnerID 26392 is in the skip list": 1, "PartNumber UNKNOWN not found in typemap": 1, "ItemCount is zero or negative": 1}
+    assert metrics.stages["translate"]["calls"] == 2
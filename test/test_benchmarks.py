@@ -0,0 +1,30 @@
+import json
+import pandas as pd
+from benchmarks.generate_report import generate_report, REPORT_COLUMNS
+from constants import DEFAULT_JSON_FILE, PARTNER_IDS_TO_SKIP, UNIT_REDUCTION
+
+with open(DEFAULT_JSON_FILE) as f:
+    type_map = json.load(f)
+
+def test_generate_report_schema(tmp_path):
+    csv_path = tmp_path / "report.csv"
+    generate_report(csv_path, 1000, type_map, domain_count=50)
+    df = pd.read_csv(csv_path)
+    assert df.columns.tolist() == REPORT_COLUMNS
+    assert len(df) == 1000
+    assert df["domains"].nunique() <= 50
+    assert df["accountGuid"].str.len().eq(36).all()
+
+def test_generate_report_ratios(tmp_path):
+    csv_path = tmp_path / "report.csv"
+    generate_report(csv_path, 20000, type_map, invalid_ratio=0.3, skip_ratio=0.2, unit_reduction_ratio=0.25)
+    df = pd.read_csv(csv_path)
+    assert abs(df["PartnerID"].isin(PARTNER_IDS_TO_SKIP).mean() - 0.2) < 0.02
+    assert abs(df["PartNumber"].isin(list(UNIT_REDUCTION)).mean() - 0.25 * (1 - 0.3 * 2 / 3)) < 0.02  # Missing and unknown PartNumbers replace a third of the invalid rows each
+    invalid = df["PartNumber"].isna() | (df["itemCount"] <= 0) | ~df["PartNumber"].isin(list(type_map))
+    assert abs(invalid.mean() - 0.3) < 0.02
+
+def test_generate_report_is_reproducible(tmp_path):
+    generate_report(tmp_path / "a.csv", 500, type_map, seed=3)
+    generate_report(tmp_path / "b.csv", 500, type_map, seed=3)
+    assert (tmp_path / "a.csv").read_text() == (tmp_path / "b.csv").read_text()
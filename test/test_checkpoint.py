@@ -0,0 +1,132 @@
+import io
+import json
+import os
+import pytest
+import checkpoint
+from checkpoint import LineBlockReader, generate_chargeable_sql_resumable, remove_checkpoint
+from csv_reader import read_report
+from processor import generate_chargeable_sql
+from utils import SkippedRowSummary
+
+type_map = {
+    "ADS000010U0R": "core.chargeable.adsync",
+    "EA000001GB0O": "core.chargeable.addarchiveingestspace",
+}
+
+def write_report(path, rows):
+    path.write_text("PartnerID,accountGuid,domains,plan,PartNumber,itemCount\n" + "".join(f"{row}\n" for row in rows))
+    return str(path)
+
+@pytest.fixture(params=["c", "pyarrow"])
+def csv_engine(request):
+    if request.param == "pyarrow":
+        pytest.importorskip("pyarrow")
+    return request.param
+
+@pytest.fixture
+def csv_path(tmp_path):
+    rows = [
+        f"{partner_id},abc-{index},d{index % 7}.com,Plan {index % 3},{part_number},{item_count}"
+        for index, (partner_id, part_number, item_count) in enumerate(
+            [(1, "ADS000010U0R", 5), (26392, "ADS000010U0R", 1), (2, "", 3), (3, "EA000001GB0O", 5000), (4, "ADS000010U0R", 0)] * 10
+        )
+    ]
+    return write_report(tmp_path / "report.csv", rows)
+
+def test_line_block_reader_offsets(csv_path, csv_engine):
+    reader = LineBlockReader(csv_path, chunk_size=20, csv_engine=csv_engine)
+    chunks = []
+    for chunk in reader:
+        chunks.append(chunk)
+        offset, rows_read = reader.offset, reader.rows_read
+        if len(chunks) == 1:
+            break
+    rest = list(LineBlockReader(csv_path, 20, offset, rows_read, csv_engine))
+    assert [chunk.index[0] for chunk in chunks + rest] == [0, 20, 40]
+    assert sum(len(chunk) for chunk in chunks + rest) == 50
+
+@pytest.mark.parametrize("domain_memory_limit", [1 << 20, 0])
+@pytest.mark.parametrize("batch_insert_size", [0, 3])
+def test_resume_matches_uninterrupted_run(csv_path, tmp_path, monkeypatch, batch_insert_size, domain_memory_limit, csv_engine):
+    expected = io.StringIO()
+    expected_totals, expected_domains = generate_chargeable_sql(read_report(csv_path), type_map, expected, batch_insert_size=batch_insert_size)
+
+    output_path = str(tmp_path / "chargeable.sql")
+    checkpoint_path = str(tmp_path / "checkpoint.json")
+    render = checkpoint.render_chargeable_rows
+    calls = []
+    fail_at_call = [4]
+
+    def failing_render(chargeable_rows):
+        calls.append(len(chargeable_rows))
+        if len(calls) == fail_at_call[0]:
+            raise RuntimeError("pre-empted")
+        return render(chargeable_rows)
+
+    monkeypatch.setattr(checkpoint, "render_chargeable_rows", failing_render)
+    first_summary = SkippedRowSummary()
+    with pytest.raises(RuntimeError):
+        generate_chargeable_sql_resumable(csv_path, type_map, output_path, checkpoint_path, batch_insert_size=batch_insert_size, chunk_size=7, checkpoint_interval=0, skip_summary=first_summary, domain_memory_limit=domain_memory_limit, csv_engine=csv_engine)
+    with open(checkpoint_path) as f:
+        saved = json.load(f)
+    assert saved["rows_read"] == 21
+    # The domains are in the journal next to the checkpoint, only their conflicts are in the JSON
+    assert saved["domains"]["generation"] == 3
+    assert saved["domains"]["conflicts"] > 0
+
+    # The resumed run starts at the chunk that failed
+    calls.clear()
+    fail_at_call[0] = None
+    summary = SkippedRowSummary()
+    product_totals, domain_partners = generate_chargeable_sql_resumable(csv_path, type_map, output_path, checkpoint_path, batch_insert_size=batch_insert_size, chunk_size=7, checkpoint_interval=0, skip_summary=summary, domain_memory_limit=domain_memory_limit, csv_engine=csv_engine)
+    assert len(calls) == 5
+    assert domain_partners.spilled == (domain_memory_limit == 0)
+    assert domain_partners.conflicts == expected_domains.conflicts
+
+    with open(output_path) as f:
+        assert f.read() == expected.getvalue()
+    assert list(product_totals.items()) == list(expected_totals.items())
+    assert list(domain_partners.items()) == list(expected_domains.items())
+    assert summary.total == 30
+
+def test_checkpoint_of_other_input_is_ignored(csv_path, tmp_path, csv_engine):
+    output_path = str(tmp_path / "chargeable.sql")
+    checkpoint_path = str(tmp_path / "checkpoint.json")
+    generate_chargeable_sql_resumable(csv_path, type_map, output_path, checkpoint_path, chunk_size=7, checkpoint_interval=0, csv_engine=csv_engine)
+    assert os.path.exists(checkpoint_path)
+
+    # A different typemap changes the output, so the checkpoint must not be resumed
+    other_type_map = {"ADS000010U0R": "core.chargeable.adsync"}
+    expected = io.StringIO()
+    generate_chargeable_sql(read_report(csv_path), other_type_map, expected)
+    generate_chargeable_sql_resumable(csv_path, other_type_map, output_path, checkpoint_path, chunk_size=7, checkpoint_interval=0, csv_engine=csv_engine)
+    with open(output_path) as f:
+        assert f.read() == expected.getvalue()
+
+    remove_checkpoint(checkpoint_path)
+    assert not os.path.exists(checkpoint_path)
+    assert not os.path.exists(checkpoint.domain_journal_path(checkpoint_path))
+
+def test_journal_changes_after_the_last_checkpoint_are_dropped(csv_path, tmp_path, monkeypatch, csv_engine):
+    expected_totals, expected_domains = generate_chargeable_sql(read_report(csv_path), type_map, io.StringIO())
+    output_path = str(tmp_path / "chargeable.sql")
+    checkpoint_path = str(tmp_path / "checkpoint.json")
+    save = checkpoint.save_checkpoint
+    saves = []
+
+    def interrupted_save(path, state):
+        # The run stops after the third journal commit, before its checkpoint is saved
+        saves.append(state)
+        if len(saves) == 3:
+            raise RuntimeError("pre-empted")
+        save(path, state)
+
+    monkeypatch.setattr(checkpoint, "save_checkpoint", interrupted_save)
+    with pytest.raises(RuntimeError):
+        generate_chargeable_sql_resumable(csv_path, type_map, output_path, checkpoint_path, chunk_size=7, checkpoint_interval=0, csv_engine=csv_engine)
+    monkeypatch.setattr(checkpoint, "save_checkpoint", save)
+
+    product_totals, domain_partners = generate_chargeable_sql_resumable(csv_path, type_map, output_path, checkpoint_path, chunk_size=7, checkpoint_interval=0, csv_engine=csv_engine)
+    assert list(domain_partners.items()) == list(expected_domains.items())
+    assert domain_partners.conflicts == expected_domains.conflicts
+    assert list(product_totals.items()) == list(expected_totals.items())
@@ -0,0 +1,55 @@
+import pytest
+from collections import defaultdict
+from constants import DEFAULT_CSV_FILE, CHARGEABLE_COLUMNS, DOMAINS_COLUMNS
+from csv_reader import read_report
+from processor import translate_chunks
+from domain_index import DomainIndex
+from rules import RuleTable
+
+pa = pytest.importorskip("pyarrow")
+import pyarrow.parquet as pq
+from columnar_sink import ColumnarWriter, domains_schema, write_chargeable_columnar, write_domains_columnar
+
+type_map = {
+    "ADS000010U0R": "core.chargeable.adsync",
+    "EA000001GB0O": "core.chargeable.addarchiveingestspace",
+    "PLN006NR": "core.chargeable.exchange",
+    "OWA004NR": "core.chargeable.owa",
+}
+
+def expected_rows(chunk_size):
+    product_totals, domain_partners = defaultdict(int), DomainIndex()
+    rows = []
+    for chargeable_rows in translate_chunks(read_report(DEFAULT_CSV_FILE, "c", chunksize=chunk_size), RuleTable(type_map), product_totals, domain_partners):
+        rows.extend(chargeable_rows.itertuples(index=False, name=None))
+    return rows, dict(product_totals), list(domain_partners.items())
+
+def read_rows(path, file_format, columns):
+    table = pq.read_table(path) if file_format == "parquet" else pa.ipc.open_file(path).read_all()
+    return list(zip(*(table.column(column).to_pylist() for column in columns)))
+
+@pytest.mark.parametrize("file_format", ["parquet", "arrow"])
+def test_columnar_files_match_translated_rows(tmp_path, file_format):
+    chargeable_path, domains_path = str(tmp_path / f"chargeable.{file_format}"), str(tmp_path / f"domains.{file_format}")
+    product_totals, domain_map = write_chargeable_columnar(read_report(DEFAULT_CSV_FILE, "c", chunksize=1000), type_map, chargeable_path, file_format, row_group_size=1000)
+    write_domains_columnar(domain_map, domains_path, file_format, row_group_size=1000)
+
+    rows, expected_totals, expected_domains = expected_rows(1000)
+    assert read_rows(chargeable_path, file_format, CHARGEABLE_COLUMNS) == rows
+    assert read_rows(domains_path, file_format, DOMAINS_COLUMNS) == expected_domains
+    assert dict(product_totals) == expected_totals
+
+def test_row_groups(tmp_path):
+    path = str(tmp_path / "domains.parquet")
+    with ColumnarWriter(path, domains_schema(), "parquet", row_group_size=3) as writer:
+        writer.write_rows(((f"d{index}.com", f"plan-{index}") for index in range(10)), batch_size=2)
+    metadata = pq.ParquetFile(path).metadata
+    assert [metadata.row_group(index).num_rows for index in range(metadata.num_row_groups)] == [3, 3, 3, 1]
+    assert writer.rows_written == 10
+
+def test_compression(tmp_path):
+    path = str(tmp_path / "domains.arrow")
+    write_domains_columnar({"a.com": "plan-a"}, path, "arrow", compression="zstd")
+    assert read_rows(path, "arrow", DOMAINS_COLUMNS) == [("a.com", "plan-a")]
+    with pytest.raises(ValueError):
+        ColumnarWriter(str(tmp_path / "other.arrow"), domains_schema(), "arrow", compression="gzip")
@@ -0,0 +1,57 @@
+import gzip
+import io
+import pytest
+from checkpoint import LineBlockReader
+from compressed_io import input_codec, open_input, open_output, output_path
+from csv_reader import read_report
+from processor import generate_chargeable_sql
+
+type_map = {"ADS000010U0R": "core.chargeable.adsync"}
+
+REPORT = "PartnerID,accountGuid,domains,plan,PartNumber,itemCount\n" + "".join(
+    f"{index},abc-{index},d{index}.com,Plan,ADS000010U0R,{index + 1}\n" for index in range(1, 30)
+)
+
+def test_codec_from_extension():
+    assert input_codec("report.csv.gz") == "gzip"
+    assert input_codec("report.csv.zst") == "zstd"
+    assert input_codec("report.csv") is None
+    assert output_path("output/rows.sql", "gzip") == "output/rows.sql.gz"
+    assert output_path("output/rows.sql", "none") == "output/rows.sql"
+
+def test_gzip_input_and_output(tmp_path):
+    csv_path = tmp_path / "report.csv.gz"
+    with gzip.open(csv_path, "wt") as f:
+        f.write(REPORT)
+    expected = io.StringIO()
+    generate_chargeable_sql(read_report(io.BytesIO(REPORT.encode())), type_map, expected)
+
+    sql_path = str(tmp_path / "rows.sql.gz")
+    with open_output(sql_path, "gzip", level=1) as output_file:
+        generate_chargeable_sql(read_report(str(csv_path)), type_map, output_file)
+    with gzip.open(sql_path, "rt") as f:
+        assert f.read() == expected.getvalue()
+
+def test_line_block_reader_continues_in_compressed_input(tmp_path):
+    csv_path = str(tmp_path / "report.csv.gz")
+    with gzip.open(csv_path, "wt") as f:
+        f.write(REPORT)
+    reader = LineBlockReader(csv_path, chunk_size=10)
+    first_chunk = next(iter(reader))
+    rest = list(LineBlockReader(csv_path, 10, reader.offset, reader.rows_read))
+    assert first_chunk["PartnerID"].tolist() + [partner_id for chunk in rest for partner_id in chunk["PartnerID"]] == list(range(1, 30))
+    with open_input(csv_path) as f:
+        assert f.read() == REPORT.encode()
+
+def test_zstd_input_and_output(tmp_path):
+    zstandard = pytest.importorskip("zstandard")
+    csv_path = tmp_path / "report.csv.zst"
+    csv_path.write_bytes(zstandard.ZstdCompressor().compress(REPORT.encode()))
+    with open_input(str(csv_path)) as f:
+        assert f.read() == REPORT.encode()
+
+    sql_path = str(tmp_path / "rows.sql.zst")
+    with open_output(sql_path, "zstd", level=19) as output_file:
+        output_file.write("SELECT 1;\n")
+    with zstandard.open(sql_path, "rt") as f:
+        assert f.read() == "SELECT 1;\n"
@@ -0,0 +1,93 @@
+import io
+import logging
+import pandas as pd
+import pytest
+import csv_reader
+from csv_reader import read_report
+from processor import generate_chargeable_sql
+
+type_map = {"ADS000010U0R": "core.chargeable.adsync"}
+
+HEADER = "PartnerID,partnerGuid,accountid,accountGuid,username,domains,itemname,plan,itemType,PartNumber,itemCount\n"
+
+def write_report(tmp_path, rows):
+    path = tmp_path / "report.csv"
+    path.write_text(HEADER + "".join(f"{row}\n" for row in rows))
+    return str(path)
+
+def test_required_columns_only_with_types(tmp_path):
+    path = write_report(tmp_path, [
+        "1,pg,10,acc-1,u,a.com,i,plan1,0,ADS000010U0R,5",
+        "2,pg,11,acc-2,u,b.com,i,plan2,0,,7",
+    ])
+    df = read_report(path)
+    assert list(df.columns) == ["PartnerID", "accountGuid", "domains", "plan", "PartNumber", "itemCount"]
+    assert str(df["PartnerID"].dtype) == "Int64"
+    assert str(df["itemCount"].dtype) == "Int64"
+    assert df["PartNumber"].dtype == "category"
+    assert df["plan"].dtype == "category"
+    assert df["PartNumber"].isna().tolist() == [False, True]
+
+def test_stray_strings_only_affect_their_row(tmp_path, caplog):
+    path = write_report(tmp_path, [
+        "1,pg,10,acc-1,u,a.com,i,plan1,0,ADS000010U0R,5",
+        "2,pg,11,acc-2,u,b.com,i,plan2,0,ADS000010U0R,abc",
+        "x,pg,12,acc-3,u,c.com,i,plan3,0,ADS000010U0R,1.5",
+        "4,pg,13,acc-4,u,d.com,i,plan4,0,ADS000010U0R,",
+        "5,pg,14,acc-5,u,e.com,i,plan5,0,ADS000010U0R, 6 ",
+    ])
+    df = read_report(path)
+    assert df["itemCount"].tolist() == [5, pd.NA, pd.NA, pd.NA, 6]
+    assert df["PartnerID"].tolist() == [1, 2, pd.NA, 4, 5]
+
+    output = io.StringIO()
+    with caplog.at_level(logging.WARNING):
+        generate_chargeable_sql(df, type_map, output, partner_id_skip_list=[])
+
+    assert output.getvalue() == (
+        "INSERT INTO chargeable (partnerID, product, productPurchasedPlanID, plan, usage) VALUES \n"
+        "\t(1, 'core.chargeable.adsync', 'acc1', 'plan1', 5),\n"
+        "\t(5, 'core.chargeable.adsync', 'acc5', 'plan5', 6);\n"
+    )
+    assert "ItemCount is not an integer: skipping row 3" in caplog.messages
+    assert "ItemCount is not an integer: skipping row 4" in caplog.messages
+    assert "ItemCount is not an integer: skipping row 5" in caplog.messages
+
+def test_chunks_keep_row_positions(tmp_path):
+    path = write_report(tmp_path, [f"{n},pg,10,acc-{n},u,a.com,i,plan,0,ADS000010U0R,{n}" for n in range(1, 6)])
+    chunks = list(read_report(path, chunksize=2))
+    assert [chunk.index.tolist() for chunk in chunks] == [[0, 1], [2, 3], [4]]
+    assert all(str(chunk["itemCount"].dtype) == "Int64" for chunk in chunks)
+
+def test_missing_column_is_left_to_the_caller(tmp_path):
+    path = tmp_path / "report.csv"
+    path.write_text("PartnerID,PartNumber\n1,ADS000010U0R\n")
+    assert list(read_report(str(path)).columns) == ["PartnerID", "PartNumber"]
+
+def test_pyarrow_falls_back_to_c(tmp_path, monkeypatch, caplog):
+    monkeypatch.setattr(csv_reader, "pyarrow_available", lambda: False)
+    path = write_report(tmp_path, ["1,pg,10,acc-1,u,a.com,i,plan1,0,ADS000010U0R,5"])
+    with caplog.at_level(logging.WARNING):
+        df = read_report(path, engine="pyarrow")
+    assert df["itemCount"].tolist() == [5]
+    assert "pyarrow is not installed" in caplog.text
+
+@pytest.mark.parametrize("engine", ["auto", "pyarrow"])
+def test_ragged_rows_are_read_like_the_c_engine(tmp_path, caplog, engine):
+    pytest.importorskip("pyarrow")
+    path = write_report(tmp_path, ["1,pg,10,acc-1,u,a.com,i,plan1,0,ADS000010U0R,5", "2,pg,10,acc-2,u,b.com,i,plan2,0,ADS000010U0R"])
+    with caplog.at_level(logging.WARNING):
+        df = read_report(path, engine=engine)
+    pd.testing.assert_frame_equal(df, read_report(path, engine="c"))
+    assert df["itemCount"].tolist() == [5, pd.NA]
+    assert ("using the c engine" in caplog.text) == (engine == "pyarrow")
+
+@pytest.mark.parametrize("engine", ["auto", "c", "pyarrow"])
+def test_headerless_blocks_with_names(engine):
+    if engine != "c":
+        pytest.importorskip("pyarrow")
+    data = b"1,x,acc-1,a.com,Plan A,ADS000010U0R,5\n2,x,acc-2,b.com,Plan B,ADS000010U0R,7\n"
+    names = ["PartnerID", "extra", "accountGuid", "domains", "plan", "PartNumber", "itemCount"]
+    df = read_report(io.BytesIO(data), engine, header=None, names=names)
+    assert list(df.columns) == [name for name in names if name != "extra"]
+    assert df["itemCount"].tolist() == [5, 7]
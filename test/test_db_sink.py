@@ -0,0 +1,78 @@
+import sqlite3
+import pandas as pd
+import pytest
+from db_sink import DatabaseDriver, SqliteDriver, DatabaseWriter, get_driver, load_chargeable_rows, load_domains
+
+type_map = {
+    "ADS000010U0R": "core.chargeable.adsync",
+    "EA000001GB0O": "core.chargeable.addarchiveingestspace",
+}
+
+def df_row(partner_id=1, part_number="ADS000010U0R", account_guid="abc-123", plan="TestPlan", domains="test.example.com", item_count=5):
+    return {
+        "PartnerID": partner_id,
+        "PartNumber": part_number,
+        "accountGuid": account_guid,
+        "plan": plan,
+        "domains": domains,
+        "itemCount": item_count,
+    }
+
+class RecordingDriver(DatabaseDriver):
+    def __init__(self):
+        self.batches = []
+
+    def connect(self):
+        pass
+
+    def insert_rows(self, table, columns, rows):
+        self.batches.append((table, list(rows)))
+
+    def close(self):
+        pass
+
+def test_load_into_sqlite(tmp_path):
+    df = pd.DataFrame([
+        df_row(plan="it's quoted"),
+        df_row(part_number=None),
+        df_row(part_number="EA000001GB0O", item_count=5000, account_guid="xyz-789", domains="other.example.com"),
+    ])
+    with SqliteDriver(str(tmp_path / "usage.db")) as driver:
+        product_totals, domain_map = load_chargeable_rows(df, type_map, driver)
+        load_domains(domain_map, driver)
+
+    connection = sqlite3.connect(tmp_path / "usage.db")
+    assert connection.execute("SELECT partnerID, product, productPurchasedPlanID, plan, usage FROM chargeable").fetchall() == [
+        (1, "core.chargeable.adsync", "abc123", "it's quoted", 5),
+        (1, "core.chargeable.addarchiveingestspace", "xyz789", "TestPlan", 5),
+    ]
+    assert connection.execute("SELECT domain, partnerPurchasedPlanID FROM domains").fetchall() == [
+        ("test.example.com", "abc123"),
+        ("other.example.com", "xyz789"),
+    ]
+    assert product_totals == {"ADS000010U0R": 5, "EA000001GB0O": 5}
+
+def test_one_transaction_per_batch():
+    driver = RecordingDriver()
+    with DatabaseWriter(driver, "domains", ["domain", "partnerPurchasedPlanID"], batch_insert_size=2) as writer:
+        writer.write_rows([("a.com", "1"), ("b.com", "2"), ("c.com", "3")])
+    assert driver.batches == [
+        ("domains", [("a.com", "1"), ("b.com", "2")]),
+        ("domains", [("c.com", "3")]),
+    ]
+    assert writer.rows_written == 3
+
+def test_incomplete_driver_fails_when_created():
+    class NoCloseDriver(DatabaseDriver):
+        def connect(self):
+            pass
+
+        def insert_rows(self, table, columns, rows):
+            pass
+
+    with pytest.raises(TypeError, match="close"):
+        NoCloseDriver()
+
+def test_get_driver():
+    assert isinstance(get_driver("sqlite:///output/usage.db"), SqliteDriver)
+    assert get_driver("sqlite:///output/usage.db").path == "output/usage.db"
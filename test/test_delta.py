@@ -0,0 +1,88 @@
+import io
+import os
+import pandas as pd
+from delta import generate_delta_sql, commit_snapshot
+from processor import generate_chargeable_sql, generate_domains_sql
+from constants import NO_CHANGES_CHARGEABLE_SQL, NO_CHANGES_DOMAINS_SQL
+
+type_map = {
+    "ADS000010U0R": "core.chargeable.adsync",
+    "EA000001GB0O": "core.chargeable.addarchiveingestspace",
+}
+
+def report(rows):
+    return pd.DataFrame(rows, columns=["PartnerID", "accountGuid", "domains", "plan", "PartNumber", "itemCount"])
+
+def run_delta(df, snapshot_path):
+    chargeable_output = io.StringIO()
+    domains_output = io.StringIO()
+    generate_delta_sql(df, type_map, snapshot_path, chargeable_output, domains_output, partner_id_skip_list=[])
+    commit_snapshot(snapshot_path)
+    return chargeable_output.getvalue(), domains_output.getvalue()
+
+first = report([
+    [1, "acc-1", "a.com", "Plan A", "ADS000010U0R", 5],
+    [2, "acc-2", "b.com", "Plan B", "ADS000010U0R", 7],
+    [3, "acc-3", "c.com", "Plan's C", "EA000001GB0O", 3000],
+    [4, "acc-4", "d.com", "Plan D", "ADS000010U0R", 1],
+    [4, "acc-4", "d.com", "Plan D", "ADS000010U0R", 2],
+])
+
+def test_first_run_inserts_everything(tmp_path):
+    snapshot_path = str(tmp_path / "snapshot.db")
+    chargeable_sql, domains_sql = run_delta(first, snapshot_path)
+
+    expected_chargeable = io.StringIO()
+    _, domain_map = generate_chargeable_sql(first, type_map, expected_chargeable, partner_id_skip_list=[])
+    expected_domains = io.StringIO()
+    generate_domains_sql(domain_map, expected_domains)
+    assert chargeable_sql == expected_chargeable.getvalue()
+    assert domains_sql == expected_domains.getvalue()
+    assert os.path.exists(snapshot_path)
+
+def test_unchanged_report(tmp_path):
+    snapshot_path = str(tmp_path / "snapshot.db")
+    run_delta(first, snapshot_path)
+    assert run_delta(first, snapshot_path) == (NO_CHANGES_CHARGEABLE_SQL, NO_CHANGES_DOMAINS_SQL)
+
+def test_changes_only(tmp_path):
+    snapshot_path = str(tmp_path / "snapshot.db")
+    run_delta(first, snapshot_path)
+    second = report([
+        [1, "acc-1", "a.com", "Plan A", "ADS000010U0R", 6],  # Usage changed
+        [3, "acc-3", "c.com", "Plan's C", "EA000001GB0O", 3000],  # Unchanged; account 2 is gone
+        [4, "acc-4", "d.com", "Plan D", "ADS000010U0R", 1],  # One of the two rows of this key is gone
+        [5, "acc-5", "b.com", "Plan E", "ADS000010U0R", 9],  # New row, and b.com moves to acc5
+    ])
+    chargeable_sql, domains_sql = run_delta(second, snapshot_path)
+    assert chargeable_sql == (
+        "DELETE FROM chargeable WHERE partnerID = 2 AND product = 'core.chargeable.adsync' AND productPurchasedPlanID = 'acc2' AND plan = 'Plan B';\n"
+        "DELETE FROM chargeable WHERE partnerID = 4 AND product = 'core.chargeable.adsync' AND productPurchasedPlanID = 'acc4' AND plan = 'Plan D';\n"
+        "UPDATE chargeable SET usage = 6 WHERE partnerID = 1 AND product = 'core.chargeable.adsync' AND productPurchasedPlanID = 'acc1' AND plan = 'Plan A';\n"
+        "INSERT INTO chargeable (partnerID, product, productPurchasedPlanID, plan, usage) VALUES \n"
+        "\t(4, 'core.chargeable.adsync', 'acc4', 'Plan D', 1),\n"
+        "\t(5, 'core.chargeable.adsync', 'acc5', 'Plan E', 9);\n"
+    )
+    assert domains_sql == "UPDATE domains SET partnerPurchasedPlanID = 'acc5' WHERE domain = 'b.com';\n"
+
+def test_rows_of_a_key_in_another_order_are_unchanged(tmp_path):
+    snapshot_path = str(tmp_path / "snapshot.db")
+    run_delta(first, snapshot_path)
+    reordered = report([first.iloc[index].tolist() for index in [4, 1, 2, 3, 0]])
+    assert run_delta(reordered, snapshot_path) == (NO_CHANGES_CHARGEABLE_SQL, NO_CHANGES_DOMAINS_SQL)
+
+    changed = report([first.iloc[index].tolist() for index in [4, 1, 2, 0]] + [[4, "acc-4", "d.com", "Plan D", "ADS000010U0R", 3]])
+    chargeable_sql, _ = run_delta(changed, snapshot_path)
+    assert chargeable_sql == (
+        "DELETE FROM chargeable WHERE partnerID = 4 AND product = 'core.chargeable.adsync' AND productPurchasedPlanID = 'acc4' AND plan = 'Plan D';\n"
+        "INSERT INTO chargeable (partnerID, product, productPurchasedPlanID, plan, usage) VALUES \n"
+        "\t(4, 'core.chargeable.adsync', 'acc4', 'Plan D', 2),\n"
+        "\t(4, 'core.chargeable.adsync', 'acc4', 'Plan D', 3);\n"
+    )
+
+def test_snapshot_kept_until_committed(tmp_path):
+    snapshot_path = str(tmp_path / "snapshot.db")
+    run_delta(first, snapshot_path)
+    generate_delta_sql(first.iloc[:1], type_map, snapshot_path, io.StringIO(), io.StringIO(), partner_id_skip_list=[])
+    # Without commit_snapshot, the next run still compares with the first report
+    assert run_delta(first, snapshot_path) == (NO_CHANGES_CHARGEABLE_SQL, NO_CHANGES_DOMAINS_SQL)
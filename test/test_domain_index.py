@@ -0,0 +1,106 @@
+import io
+import os
+import logging
+from domain_index import DomainIndex
+from processor import generate_domains_sql
+
+pairs = [
+    ("a.com", "plan-1"),
+    ("b.com", "plan-2"),
+    ("a.com", "plan-1"),
+    ("c.com", "plan-1"),
+    ("b.com", "plan-3"),
+    ("d.com", "plan-2"),
+]
+
+def expected_items():
+    expected = {}
+    expected.update(pairs)
+    return list(expected.items())
+
+def test_update_matches_dict_update():
+    index = DomainIndex()
+    index.update(pairs[:3])
+    index.update(iter(pairs[3:]))
+    assert list(index.items()) == expected_items()
+    assert list(index) == ["a.com", "b.com", "c.com", "d.com"]
+    assert index["b.com"] == "plan-3"
+    assert "d.com" in index and "e.com" not in index
+    assert len(index) == 4
+    assert not index.spilled
+
+def test_pooled_domains_match_dict_update_as_the_table_grows():
+    many_pairs = [(f"d{index % 3000}.{'exämple' if index % 2 else 'example'}.com", f"plan-{index % 7}") for index in range(10000)]
+    index = DomainIndex()
+    for start in range(0, len(many_pairs), 1000):
+        index.update(many_pairs[start:start + 1000])
+    expected = {}
+    conflicts = 0
+    for domain, plan_id in many_pairs:
+        conflicts += domain in expected and expected[domain] != plan_id
+        expected[domain] = plan_id
+    assert list(index.items()) == list(expected.items())
+    assert index.conflicts == conflicts
+    assert all(index[domain] == plan_id for domain, plan_id in expected.items())
+    assert "d3000.example.com" not in index
+    assert not index.spilled
+
+def test_update_accepts_mapping():
+    index = DomainIndex()
+    index.update({"a.com": "plan-1", "b.com": "plan-2"})
+    assert list(index.items()) == [("a.com", "plan-1"), ("b.com", "plan-2")]
+
+def test_conflicts_are_counted_and_logged(caplog):
+    index = DomainIndex()
+    index.update(pairs)
+    assert index.conflicts == 1
+    assert index.conflicting_domains == ["b.com"]
+    with caplog.at_level(logging.WARNING):
+        index.log_conflicts()
+    assert "1 domain assignments" in caplog.text
+    assert "b.com" in caplog.text
+
+def test_spilled_index_matches_in_memory(tmp_path):
+    index = DomainIndex(memory_limit=0, spill_folder=str(tmp_path))
+    index.update(pairs[:3])
+    assert index.spilled
+    index.update(pairs[3:])
+    assert list(index.items()) == expected_items()
+    assert index["b.com"] == "plan-3"
+    assert "e.com" not in index
+    assert len(index) == 4
+    assert index.conflicts == 1
+    assert index.conflicting_domains == ["b.com"]
+
+def test_close_removes_spill_file(tmp_path):
+    index = DomainIndex(memory_limit=0, spill_folder=str(tmp_path))
+    index.update(pairs)
+    assert len(os.listdir(tmp_path)) == 1
+    index.close()
+    assert os.listdir(tmp_path) == []
+
+def test_domains_sql_is_the_same_after_spilling(tmp_path):
+    in_memory = DomainIndex()
+    in_memory.update(pairs)
+    spilled = DomainIndex(memory_limit=0, spill_folder=str(tmp_path))
+    spilled.update(pairs)
+
+    expected = io.StringIO()
+    generate_domains_sql(in_memory, expected, batch_insert_size=2)
+    output = io.StringIO()
+    generate_domains_sql(spilled, output, batch_insert_size=2)
+    assert output.getvalue() == expected.getvalue()
+    spilled.close()
+
+def test_changes_replay_into_the_saved_index():
+    for memory_limit in [1 << 20, 0]:
+        index = DomainIndex(memory_limit, track_changes=True)
+        replayed = DomainIndex()
+        for start, end in [(0, 2), (2, 5), (5, 6)]:
+            index.update(pairs[start:end])
+            replayed.update(list(index.changes()))
+            index.mark_saved()
+        assert list(replayed.items()) == expected_items()
+        assert list(index.changes()) == []
+        assert index.spilled == (memory_limit == 0)
+        index.close()
@@ -1,7 +1,9 @@
 import io
+import pytest
 import pandas as pd
 from processor import generate_chargeable_sql
 from constants import PARTNER_IDS_TO_SKIP, UNIT_REDUCTION, NO_VALID_ROWS_CHARGEABLE_SQL
+from utils import SkippedRowSummary
 
 type_map = {
     "ADS000010U0R": "core.chargeable.adsync",
@@ -180,3 +182,68 @@ def test_sql_injection_with_single_quote():
         "INSERT INTO chargeable (partnerID, product, productPurchasedPlanID, plan, usage) VALUES \n"
         f"\t({valid_partner_id}, '{type_map[valid_part_number]}', '{cleaned_account_guid}', '''); DROP TABLE users; --', 5);\n"
     ) # SQL injection is not executed, but the input is included in the SQL statement
+
+def test_row_numbers_follow_index(caplog):
+    df = pd.DataFrame([df_row(part_number=None), df_row(item_count=0)], index=[10, 11])
+    sql, _, _ = run_generate_chargeable_sql_with_logs(caplog, df)
+    assert sql == NO_VALID_ROWS_CHARGEABLE_SQL
+    assert "PartNumber is missing: skipping row 12" in caplog.text
+    assert "ItemCount is zero or negative: skipping row 13" in caplog.text
+
+def test_mixed_type_columns(caplog):
+    df = pd.DataFrame([
+        df_row(item_count="not a number"),
+        df_row(partner_id="not an integer"),
+        df_row(item_count=7)
+    ])
+    sql, product_totals, _ = run_generate_chargeable_sql_with_logs(caplog, df)
+    assert "ItemCount is not an integer: skipping row 2" in caplog.text
+    assert "PartnerID is not an integer: skipping row 3" in caplog.text
+    assert sql == (
+        "INSERT INTO chargeable (partnerID, product, productPurchasedPlanID, plan, usage) VALUES \n"
+        f"\t({valid_partner_id}, '{type_map[valid_part_number]}', '{cleaned_account_guid}', 'TestPlan', 7);\n"
+    )
+    assert product_totals == {valid_part_number: 7}
+
+def test_chunked_input_matches_single_frame(caplog):
+    df = pd.DataFrame([
+        df_row(item_count=5),
+        df_row(part_number=None),
+        df_row(part_number=unit_reduction_part_number, item_count=5000, domains="other.example.com"),
+        df_row(item_count=10)
+    ])
+    sql, product_totals, domain_partners = run_generate_chargeable_sql(df, batch_insert_size=2)
+
+    caplog.set_level("WARNING")
+    output = io.StringIO()
+    chunks = [df.iloc[0:1], df.iloc[1:3], df.iloc[3:]]
+    chunked_totals, chunked_domains = generate_chargeable_sql(chunks, type_map, output, batch_insert_size=2)
+    assert output.getvalue() == sql
+    assert chunked_totals == product_totals
+    assert list(chunked_domains.items()) == list(domain_partners.items())
+    assert "PartNumber is missing: skipping row 3" in caplog.text
+
+def test_skipped_rows_summary_only(caplog):
+    df = pd.DataFrame([df_row(part_number=None), df_row(item_count=0), df_row(part_number=None)])
+    caplog.set_level("WARNING")
+    skip_summary = SkippedRowSummary(log_each_row=False)
+    generate_chargeable_sql(df, type_map, io.StringIO(), skip_summary=skip_summary)
+    assert "skipping row" not in caplog.text
+    assert skip_summary.counts == {"PartNumber is missing": 2, "ItemCount is zero or negative": 1}
+    assert skip_summary.samples["PartNumber is missing"] == [2, 4]
+
+def test_pyarrow_backed_strings_match_object_strings():
+    pytest.importorskip("pyarrow")
+    df = pd.DataFrame([
+        df_row(item_count=5),
+        df_row(part_number=None),
+        df_row(part_number=unit_reduction_part_number, item_count=5000, plan="Plan's", domains="other.example.com"),
+    ])
+    expected = run_generate_chargeable_sql(df.astype(object), batch_insert_size=2)
+    arrow_df = df.astype({column: "string[pyarrow]" for column in ["PartNumber", "accountGuid", "plan", "domains"]})
+    output = io.StringIO()
+    # The middle chunk has no valid rows
+    product_totals, domain_partners = generate_chargeable_sql([arrow_df.iloc[0:1], arrow_df.iloc[1:2], arrow_df.iloc[2:]], type_map, output, batch_insert_size=2)
+    assert output.getvalue() == expected[0]
+    assert product_totals == expected[1]
+    assert list(domain_partners.items()) == list(expected[2].items())
@@ -0,0 +1,78 @@
+import io
+import json
+import pandas as pd
+from metrics import RunMetrics, NullMetrics
+from processor import generate_chargeable_sql
+
+def test_stages_accumulate():
+    metrics = RunMetrics()
+    for _ in range(3):
+        with metrics.stage("validate"):
+            pass
+    metrics.count("rows_read", 5)
+    metrics.count("rows_read", 2)
+    result = metrics.to_dict()
+    assert result["stages"]["validate"]["calls"] == 3
+    assert result["counters"] == {"rows_read": 7}
+    assert result["peak_rss_bytes"] > 0
+
+def test_timed_counts_each_item():
+    metrics = RunMetrics()
+    assert list(metrics.timed(iter([1, 2, 3]), "read_csv")) == [1, 2, 3]
+    # One call per item, plus the call that finds the iterator exhausted
+    assert metrics.stages["read_csv"]["calls"] == 4
+
+def test_merge_stages():
+    metrics = RunMetrics()
+    with metrics.stage("render"):
+        pass
+    metrics.merge_stages({"render": {"seconds": 1.0, "calls": 2}, "write_fragment": {"seconds": 0.5, "calls": 1}})
+    assert metrics.stages["render"]["calls"] == 3
+    assert metrics.stages["render"]["seconds"] >= 1.0
+    assert metrics.stages["write_fragment"] == {"seconds": 0.5, "calls": 1}
+
+def test_null_metrics_records_nothing():
+    metrics = NullMetrics()
+    with metrics.stage("validate"):
+        metrics.count("rows_read")
+    assert list(metrics.timed([1], "read_csv")) == [1]
+    assert metrics.stages == {} and metrics.counters == {}
+
+def test_generate_chargeable_sql_stages():
+    df = pd.DataFrame({
+        "PartnerID": [1, 2, 3],
+        "partnerGuid": ["guid1", "guid2", "guid3"],
+        "accountid": ["acc1", "acc2", "acc3"],
+        "accountGuid": ["acc-guid-1", "acc-guid-2", "acc-guid-3"],
+        "username": ["user1", "user2", "user3"],
+        "domains": ["domain1.com", "domain2.com", "domain3.com"],
+        "itemname": ["item1", "item2", "item3"],
+        "plan": ["plan1", "plan2", "plan3"],
+        "itemType": [1, 1, 1],
+        "PartNumber": ["PN1", "PN2", None],
+        "itemCount": [10, 20, 30],
+    })
+    metrics = RunMetrics()
+    generate_chargeable_sql([df.iloc[:2], df.iloc[2:]], {"PN1": "Product1", "PN2": "Product2"}, io.StringIO(), metrics=metrics)
+    assert {"read_csv", "validate", "translate", "log_rows", "render", "write"} <= set(metrics.stages)
+    assert metrics.stages["validate"]["calls"] == 2
+    assert metrics.counters == {"rows_read": 3, "rows_valid": 2}
+
+def test_write_json_and_prometheus(tmp_path):
+    metrics = RunMetrics()
+    with metrics.stage("read_csv"):
+        pass
+    metrics.count("rows_read", 10)
+    metrics.skipped_rows = {'PartNumber "X" not found': 4}
+
+    json_path = tmp_path / "metrics.json"
+    metrics.write_json(json_path)
+    assert json.loads(json_path.read_text())["counters"] == {"rows_read": 10}
+
+    prometheus_path = tmp_path / "metrics.prom"
+    metrics.write_prometheus(prometheus_path)
+    text = prometheus_path.read_text()
+    assert 'usage_translator_stage_calls{stage="read_csv"} 1' in text
+    assert 'usage_translator_rows{counter="rows_read"} 10' in text
+    assert 'usage_translator_rows_skipped{reason="PartNumber \\"X\\" not found"} 4' in text
+    assert "# TYPE usage_translator_peak_rss_bytes gauge" in text
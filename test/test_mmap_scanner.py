@@ -0,0 +1,78 @@
+import argparse
+import io
+import logging
+import pytest
+from constants import DEFAULT_CSV_FILE, DEFAULT_SMALL_REPORT_BYTES
+from csv_reader import read_report
+from mmap_scanner import MappedReport
+from processor import generate_chargeable_sql
+from stdlib_engine import read_report_stdlib, generate_chargeable_sql_stdlib
+from usage_translator import use_stdlib_engine
+from utils import SkippedRowSummary
+
+type_map = {
+    "ADS000010U0R": "core.chargeable.adsync",
+    "EA000001GB0O": "core.chargeable.addarchiveingestspace",
+    "PLN006NR": "core.chargeable.exchange",
+}
+
+REPORT = (
+    "﻿PartnerID,extra,accountGuid,domains,plan,PartNumber,itemCount\n"
+    "1,x,acc-1,a.com,Plan A,ADS000010U0R,5\n"
+    "26392,x,acc-2,b.com,Plan B,ADS000010U0R,7\n"
+    "\n"
+    "4,x,,d.com,Plan D,ADS000010U0R, 2 \n"
+    "5,x,NA,e.com,Plan E,PLN006NR,+3\n"
+    "7,x,acc-7,g.com,Plan G,NA,1\n"
+    "13,x,acc-13,l.com,Plan M,PLN006NR\n"
+    "14,x,acc-14,m.com,Plan N,PLN006NR,1,extra\n"
+)
+QUOTED_ROWS = (
+    "3,\"x, y\",acc-3,c.com,\"Plan's, C\",EA000001GB0O,3000\n"
+    "6,\"two\nlines\",acc-6,f.com,\"Plan \"\"F\"\"\",PLN006NR,4\n"
+)
+
+def normalized(rows):
+    return [tuple("<NA>" if value != value else value for value in row) for row in rows]
+
+def scanned_rows(csv_path, block_bytes):
+    with MappedReport(csv_path, block_bytes) as report:
+        return report.columns, [row for rows in report.blocks() for row in rows]
+
+@pytest.mark.parametrize("content", [REPORT, REPORT + QUOTED_ROWS, QUOTED_ROWS.join([REPORT, REPORT]), REPORT.replace("\n", "\r\n")])
+@pytest.mark.parametrize("block_bytes", [1, 40, 1 << 20])
+def test_rows_match_the_csv_module(tmp_path, content, block_bytes):
+    csv_path = tmp_path / "report.csv"
+    csv_path.write_bytes(content.encode())
+    expected = read_report_stdlib(str(csv_path))
+    columns, rows = scanned_rows(str(csv_path), block_bytes)
+    assert columns == expected.columns
+    assert normalized(rows) == normalized([row for rows in expected.blocks() for row in rows])
+
+def test_empty_reports(tmp_path):
+    for name, content in [("empty.csv", ""), ("header.csv", "PartnerID,plan\n"), ("blank.csv", "PartnerID,plan\n\n\r\n")]:
+        csv_path = tmp_path / name
+        csv_path.write_text(content)
+        with MappedReport(str(csv_path)) as report:
+            assert report.empty
+            assert list(report.blocks()) == []
+
+@pytest.mark.parametrize("batch_insert_size", [0, 100])
+def test_output_matches_pandas(caplog, batch_insert_size):
+    outputs = []
+    for open_report, generate in [(read_report, generate_chargeable_sql), (lambda path: MappedReport(path, 64 * 1024), generate_chargeable_sql_stdlib)]:
+        output = io.StringIO()
+        summary = SkippedRowSummary()
+        caplog.clear()
+        with caplog.at_level(logging.WARNING):
+            product_totals, domain_map = generate(open_report(DEFAULT_CSV_FILE), type_map, output, batch_insert_size=batch_insert_size, skip_summary=summary)
+        logs = [record.getMessage() for record in caplog.records]
+        outputs.append((output.getvalue(), dict(product_totals), list(domain_map.items()), summary.samples, logs))
+    assert outputs[1] == outputs[0]
+
+def test_compressed_report_uses_the_stdlib_engine(tmp_path):
+    csv_path = tmp_path / "report.csv.gz"
+    csv_path.write_bytes(b"")
+    args = argparse.Namespace(csv=str(csv_path), csv_engine="mmap", sink="sql", workers=1, stream=False, resume=False, delta=False, small_report_bytes=DEFAULT_SMALL_REPORT_BYTES)
+    assert use_stdlib_engine(args)
+    assert args.csv_engine == "stdlib"
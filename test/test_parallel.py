@@ -0,0 +1,91 @@
+import io
+from concurrent.futures import ProcessPoolExecutor
+import pandas as pd
+import pytest
+import parallel
+from constants import DEFAULT_CSV_FILE, SHARDS_IN_FLIGHT_PER_WORKER
+from parallel import split_csv_shards, generate_chargeable_sql_parallel
+from processor import generate_chargeable_sql
+
+type_map = {
+    "ADS000010U0R": "core.chargeable.adsync",
+    "EA000001GB0O": "core.chargeable.addarchiveingestspace",
+    "PLN006NR": "core.chargeable.exchange",
+    "OWA004NR": "core.chargeable.owa",
+}
+
+@pytest.fixture(params=["c", "pyarrow"])
+def csv_engine(request):
+    if request.param == "pyarrow":
+        pytest.importorskip("pyarrow")
+    return request.param
+
+def write_report(path, rows):
+    path.write_text("PartnerID,accountGuid,domains,plan,PartNumber,itemCount\n" + "".join(f"{row}\n" for row in rows))
+    return str(path)
+
+def test_split_csv_shards_on_line_boundaries():
+    shards = split_csv_shards(DEFAULT_CSV_FILE, 7)
+    with open(DEFAULT_CSV_FILE, "rb") as f:
+        data = f.read()
+    assert len(shards) == 7
+    assert shards[0][0] == data.index(b"\n") + 1
+    assert shards[-1][1] == len(data)
+    for (_, end), (start, _) in zip(shards, shards[1:]):
+        assert end == start
+        assert data[start - 1:start] == b"\n"
+
+def test_split_csv_shards_small_file(tmp_path):
+    csv_path = write_report(tmp_path / "report.csv", ["1,abc-123,a.com,P,ADS000010U0R,5"])
+    assert len(split_csv_shards(csv_path, 4)) == 1
+
+def test_parallel_matches_single_process(tmp_path, caplog, csv_engine):
+    rows = [
+        f"{partner_id},abc-{index},d{index % 5}.com,Plan {index % 3},{part_number},{item_count}"
+        for index, (partner_id, part_number, item_count) in enumerate(
+            [(1, "ADS000010U0R", 5), (26392, "PLN006NR", 1), (2, "", 3), (3, "EA000001GB0O", 5000), (4, "OWA004NR", 0), (5, "NOT_IN_TYPEMAP", 2)] * 20
+        )
+    ]
+    csv_path = write_report(tmp_path / "report.csv", rows)
+
+    caplog.set_level("WARNING")
+    expected_output = io.StringIO()
+    expected_totals, expected_domains = generate_chargeable_sql(pd.read_csv(csv_path), type_map, expected_output, batch_insert_size=7)
+    expected_log = caplog.text
+    caplog.clear()
+
+    output = io.StringIO()
+    product_totals, domain_partners = generate_chargeable_sql_parallel(csv_path, type_map, output, workers=3, batch_insert_size=7, shard_bytes=200, csv_engine=csv_engine)
+    assert output.getvalue() == expected_output.getvalue()
+    assert product_totals == expected_totals
+    assert list(domain_partners.items()) == list(expected_domains.items())
+    assert caplog.text == expected_log
+    assert "skipping row 121" in caplog.text
+
+def test_only_a_few_shards_are_in_flight(tmp_path, monkeypatch, csv_engine):
+    rows = [f"{index},abc-{index},d{index}.com,Plan 1,ADS000010U0R,5" for index in range(400)]
+    csv_path = write_report(tmp_path / "report.csv", rows)
+    submitted, merged, in_flight = [0], [0], []
+
+    class RecordingExecutor(ProcessPoolExecutor):
+        def submit(self, *args, **kwargs):
+            submitted[0] += 1
+            in_flight.append(submitted[0] - merged[0])
+            return super().submit(*args, **kwargs)
+
+    def counting_log_rows(*args, **kwargs):
+        merged[0] += 1
+        return log_rows(*args, **kwargs)
+
+    log_rows = parallel.log_rows
+    monkeypatch.setattr(parallel, "ProcessPoolExecutor", RecordingExecutor)
+    monkeypatch.setattr(parallel, "log_rows", counting_log_rows)
+    output = io.StringIO()
+    generate_chargeable_sql_parallel(csv_path, type_map, output, workers=2, shard_bytes=100, csv_engine=csv_engine)
+
+    expected = io.StringIO()
+    generate_chargeable_sql(pd.read_csv(csv_path), type_map, expected)
+    assert output.getvalue() == expected.getvalue()
+    assert submitted[0] == merged[0] > 20
+    # The shard being merged, plus the ones submitted ahead of it
+    assert max(in_flight) == 2 * SHARDS_IN_FLIGHT_PER_WORKER + 1
@@ -0,0 +1,92 @@
+import io
+import json
+import logging
+import os
+import numpy as np
+import pandas as pd
+from rules import RuleTable, compile_rules, load_rules, load_skip_list
+from processor import generate_chargeable_sql
+
+type_map = {
+    "ADS000010U0R": "core.chargeable.adsync",
+    "EA000001GB0O": "core.chargeable.addarchiveingestspace",
+}
+
+df = pd.DataFrame([
+    [1, "acc-1", "a.com", "Plan A", "ADS000010U0R", 5],
+    [26392, "acc-2", "b.com", "Plan B", "ADS000010U0R", 7],
+    [3, "acc-3", "c.com", "Plan C", "EA000001GB0O", 3000],
+    [4, "acc-4", "d.com", "Plan D", "ADS000010U0R", 2],
+], columns=["PartnerID", "accountGuid", "domains", "plan", "PartNumber", "itemCount"])
+
+def test_records_cover_the_typemap():
+    rules = RuleTable(type_map, {"EA000001GB0O": 1000, "OTHER": 10}, [26392])
+    assert rules.products == type_map
+    assert rules.divisors == {"ADS000010U0R": 1, "EA000001GB0O": 1000}
+    assert len(rules) == 2
+
+def test_is_skipped():
+    rules = RuleTable(type_map, partner_id_skip_list=range(1000, 200000, 3))
+    partner_ids = np.array([999, 1000, 1001, 1003, 199998, 200000, -5], dtype=np.int64)
+    assert rules.is_skipped(partner_ids).tolist() == [False, True, False, True, False, False, False]
+    assert RuleTable(type_map, partner_id_skip_list=[]).is_skipped(partner_ids).tolist() == [False] * 7
+
+def test_rule_table_matches_typemap_dict():
+    expected = io.StringIO()
+    expected_totals, _ = generate_chargeable_sql(df, type_map, expected, partner_id_skip_list=[26392])
+    output = io.StringIO()
+    product_totals, _ = generate_chargeable_sql(df, RuleTable(type_map, partner_id_skip_list=[26392]), output)
+    assert output.getvalue() == expected.getvalue()
+    assert product_totals == expected_totals == {"ADS000010U0R": 7, "EA000001GB0O": 3}
+
+def test_skip_list_of_the_rule_table_is_used():
+    output = io.StringIO()
+    generate_chargeable_sql(df, RuleTable(type_map, partner_id_skip_list=[1, 4]), output, partner_id_skip_list=[26392])
+    sql = output.getvalue()
+    assert "(26392," in sql
+    assert "(1," not in sql and "(4," not in sql
+
+def test_compile_rules():
+    rules = RuleTable(type_map)
+    assert compile_rules(rules) is rules
+    assert compile_rules(type_map, [7]).skip_partner_ids == {7}
+
+def test_load_skip_list(tmp_path):
+    text_path = tmp_path / "skip.txt"
+    text_path.write_text("# Test partners\n26392\n\n12 # another\n")
+    assert load_skip_list(str(text_path)) == [26392, 12]
+    json_path = tmp_path / "skip.json"
+    json_path.write_text("[1, 2]")
+    assert load_skip_list(str(json_path)) == [1, 2]
+
+def test_load_rules_uses_cache_until_a_source_changes(tmp_path, caplog):
+    typemap_path = tmp_path / "typemap.json"
+    typemap_path.write_text(json.dumps(type_map))
+    unit_reduction_path = tmp_path / "unit_reduction.json"
+    unit_reduction_path.write_text(json.dumps({"EA000001GB0O": 500}))
+    skip_list_path = tmp_path / "skip.txt"
+    skip_list_path.write_text("5\n")
+    cache_path = str(tmp_path / "rules.pickle")
+
+    rules = load_rules(str(typemap_path), str(unit_reduction_path), str(skip_list_path), cache_path)
+    assert rules.divisors["EA000001GB0O"] == 500
+    assert sorted(rules.skip_partner_ids) == [5]
+    assert os.path.exists(cache_path)
+
+    with caplog.at_level(logging.INFO):
+        cached = load_rules(str(typemap_path), str(unit_reduction_path), str(skip_list_path), cache_path)
+    assert "Loaded compiled rules" in caplog.text
+    assert cached.fingerprint() == rules.fingerprint()
+
+    skip_list_path.write_text("5\n6\n")
+    reloaded = load_rules(str(typemap_path), str(unit_reduction_path), str(skip_list_path), cache_path)
+    assert sorted(reloaded.skip_partner_ids) == [5, 6]
+    assert sorted(load_rules(str(typemap_path), str(unit_reduction_path), str(skip_list_path), cache_path).skip_partner_ids) == [5, 6]
+
+def test_load_rules_rebuilds_an_unreadable_cache(tmp_path):
+    typemap_path = tmp_path / "typemap.json"
+    typemap_path.write_text(json.dumps(type_map))
+    cache_path = tmp_path / "rules.pickle"
+    cache_path.write_bytes(b"not a pickle")
+    rules = load_rules(str(typemap_path), cache_path=str(cache_path))
+    assert rules.products == type_map
@@ -0,0 +1,215 @@
+import argparse
+import asyncio
+import io
+import logging
+import threading
+import pytest
+import service
+import usage_translator
+from constants import DEFAULT_CSV_FILE, DEFAULT_JSON_FILE, SERVICE_STREAM_CHUNK_SIZE
+from csv_reader import read_report
+from processor import generate_chargeable_sql, generate_domains_sql
+from rules import RuleTable
+from service import TranslatorService, ResponseStream, translate_report
+
+type_map = {
+    "ADS000010U0R": "core.chargeable.adsync",
+    "EA000001GB0O": "core.chargeable.addarchiveingestspace",
+}
+
+REPORT = (
+    "PartnerID,accountGuid,domains,plan,PartNumber,itemCount\n"
+    "1,acc-1,a.com,Plan A,ADS000010U0R,5\n"
+    "26392,acc-2,b.com,Plan B,ADS000010U0R,7\n"
+    "3,acc-3,c.com,Plan's C,EA000001GB0O,3000\n"
+    "4,,d.com,Plan D,ADS000010U0R,1\n"
+).encode()
+
+def expected_sql(report, rules, batch_insert_size=0):
+    output = io.StringIO()
+    _, domain_map = generate_chargeable_sql(read_report(io.BytesIO(report)), rules, output, batch_insert_size=batch_insert_size)
+    generate_domains_sql(domain_map, output, batch_insert_size=batch_insert_size)
+    return output.getvalue().encode()
+
+def decode_chunked(payload):
+    body = b""
+    while True:
+        size_line, _, payload = payload.partition(b"\r\n")
+        size = int(size_line, 16)
+        if size == 0:
+            return body
+        body += payload[:size]
+        payload = payload[size + 2:]
+
+async def request(connect, method, path, body=b"", headers=None):
+    reader, writer = await connect()
+    headers = {"Content-Length": str(len(body)), **(headers or {})}
+    head = "".join(f"{name}: {value}\r\n" for name, value in headers.items())
+    writer.write(f"{method} {path} HTTP/1.1\r\nHost: localhost\r\n{head}\r\n".encode() + body)
+    await writer.drain()
+    response = await reader.read()
+    writer.close()
+    head, _, payload = response.partition(b"\r\n\r\n")
+    status = int(head.split()[1])
+    if b"Transfer-Encoding: chunked" in head:
+        payload = decode_chunked(payload)
+    return status, payload
+
+def run_with_service(scenario, **options):
+    async def main():
+        service = TranslatorService(RuleTable(type_map), **options)
+        server = await service.start("127.0.0.1", 0)
+        port = server.sockets[0].getsockname()[1]
+        try:
+            async with server:
+                return await scenario(lambda: asyncio.open_connection("127.0.0.1", port))
+        finally:
+            service.close()
+    return asyncio.run(main())
+
+def test_translate_streams_both_tables():
+    async def scenario(connect):
+        return await request(connect, "POST", "/translate", REPORT)
+    status, body = run_with_service(scenario)
+    assert status == 200
+    assert body == expected_sql(REPORT, RuleTable(type_map))
+    assert b"INSERT INTO domains" in body
+
+def test_batch_insert_size_parameter():
+    async def scenario(connect):
+        return await request(connect, "POST", "/translate?batch_insert_size=1", REPORT)
+    status, body = run_with_service(scenario)
+    assert status == 200
+    assert body == expected_sql(REPORT, RuleTable(type_map), batch_insert_size=1)
+
+def test_concurrent_requests_match_the_command_line():
+    with open(DEFAULT_CSV_FILE, "rb") as f:
+        report = f.read()
+    rules = RuleTable(type_map)
+
+    async def scenario(connect):
+        return await asyncio.gather(*(request(connect, "POST", "/translate", report) for _ in range(6)))
+    responses = run_with_service(scenario, workers=2, queue_size=2)
+    expected = expected_sql(report, rules)
+    assert [status for status, _ in responses] == [200] * 6
+    assert all(body == expected for _, body in responses)
+
+def test_errors():
+    async def scenario(connect):
+        return [
+            await request(connect, "GET", "/health"),
+            await request(connect, "GET", "/translate"),
+            await request(connect, "POST", "/unknown", REPORT),
+            await request(connect, "POST", "/translate", b"a,b\n1,2\n"),
+            await request(connect, "POST", "/translate", b""),
+            await request(connect, "POST", "/translate?batch_insert_size=x", REPORT),
+            await request(connect, "POST", "/translate", REPORT * 10),
+        ]
+    responses = run_with_service(scenario, max_upload_bytes=len(REPORT) * 2)
+    assert responses[0] == (200, b"ok\n")
+    assert [status for status, _ in responses[1:]] == [405, 404, 400, 400, 400, 413]
+    assert b"missing required columns" in responses[3][1]
+
+def test_requests_over_the_limit_are_rejected():
+    async def scenario(connect):
+        # The first request holds the only worker slot while its upload is incomplete
+        reader, writer = await connect()
+        writer.write(f"POST /translate HTTP/1.1\r\nContent-Length: {len(REPORT)}\r\n\r\n".encode() + REPORT[:10])
+        await writer.drain()
+        await asyncio.sleep(0.1)
+        rejected = await request(connect, "POST", "/translate", REPORT)
+        writer.write(REPORT[10:])
+        await writer.drain()
+        response = await reader.read()
+        writer.close()
+        return rejected, response
+    (status, _), response = run_with_service(scenario, workers=1, max_pending=0)
+    assert status == 503
+    assert response.startswith(b"HTTP/1.1 200 OK")
+
+def test_service_recovers_from_a_client_that_disconnects():
+    with open(DEFAULT_CSV_FILE, "rb") as f:
+        report = f.read()
+
+    async def scenario(connect):
+        reader, writer = await connect()
+        writer.write(f"POST /translate HTTP/1.1\r\nContent-Length: {len(report)}\r\n\r\n".encode() + report)
+        await writer.drain()
+        await reader.read(100)
+        writer.close()
+        return await request(connect, "POST", "/translate", REPORT)
+    status, body = run_with_service(scenario, workers=1, queue_size=1)
+    assert status == 200
+    assert body == expected_sql(REPORT, RuleTable(type_map))
+
+def test_unix_socket(tmp_path):
+    socket_path = str(tmp_path / "translator.sock")
+
+    async def main():
+        service = TranslatorService(RuleTable(type_map))
+        server = await service.start(socket_path=socket_path)
+        try:
+            async with server:
+                return await request(lambda: asyncio.open_unix_connection(socket_path), "POST", "/translate", REPORT)
+        finally:
+            service.close()
+    status, body = asyncio.run(main())
+    assert status == 200
+    assert body == expected_sql(REPORT, RuleTable(type_map))
+
+def test_response_stream_blocks_when_the_queue_is_full():
+    async def main():
+        queue = asyncio.Queue(maxsize=1)
+        stream = ResponseStream(asyncio.get_running_loop(), queue)
+        done = threading.Event()
+
+        def produce():
+            for _ in range(3):
+                stream.write("x" * SERVICE_STREAM_CHUNK_SIZE)
+            stream.close()
+            done.set()
+
+        thread = threading.Thread(target=produce, daemon=True)
+        thread.start()
+        await asyncio.sleep(0.2)
+        assert queue.qsize() == 1 and not done.is_set()
+
+        chunks = []
+        while (chunk := await queue.get()) is not None:
+            chunks.append(chunk)
+        await asyncio.to_thread(thread.join)
+        return chunks
+    chunks = asyncio.run(main())
+    assert [len(chunk) for chunk in chunks] == [SERVICE_STREAM_CHUNK_SIZE] * 3
+
+def test_skipped_rows_are_logged_on_request(caplog):
+    for log_each_row in [False, True]:
+        caplog.clear()
+        with caplog.at_level(logging.WARNING):
+            _, skip_summary = translate_report(io.BytesIO(REPORT), RuleTable(type_map), io.StringIO(), log_each_row=log_each_row)
+        assert skip_summary.total > 0
+        assert ("skipping row 3" in caplog.text) == log_each_row
+
+def test_reports_over_the_spool_size_are_translated_from_a_file(monkeypatch):
+    monkeypatch.setattr(service, "SERVICE_SPOOL_BYTES", 64)
+    with open(DEFAULT_CSV_FILE, "rb") as f:
+        report = f.read()
+    async def scenario(connect):
+        return await request(connect, "POST", "/translate", report)
+    status, body = run_with_service(scenario)
+    assert status == 200
+    assert body == expected_sql(report, RuleTable(type_map))
+
+@pytest.mark.parametrize("address, host", [("8080", "127.0.0.1"), (":8080", "127.0.0.1"), ("0.0.0.0:8080", "0.0.0.0")])
+def test_serve_listens_on_localhost_unless_a_host_is_given(monkeypatch, address, host):
+    addresses = []
+    async def fake_serve(rules, host, port, socket_path, **options):
+        addresses.append((host, port))
+    monkeypatch.setattr(service, "serve", fake_serve)
+    args = argparse.Namespace(
+        serve=address, serve_socket=None, service_workers=1, chunk_size=100, skipped_rows="summary",
+        metrics_file=None, prometheus_file=None, aggregate=False,
+        json=DEFAULT_JSON_FILE, unit_reductions=None, skip_list=None, rules_cache=None,
+    )
+    usage_translator.run_service(args)
+    assert addresses == [(host, 8080)]
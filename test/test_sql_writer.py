@@ -0,0 +1,110 @@
+import logging
+from constants import NO_VALID_ROWS_CHARGEABLE_SQL, NO_VALID_ROWS_DOMAINS_SQL
+from sql_writer import SqlInsertWriter, chargeable_sql_writer, domains_sql_writer
+
+class PipeOutput:
+    """
+    Write-only, non-seekable output that records every write call.
+    """
+    def __init__(self):
+        self.writes = []
+
+    def write(self, s):
+        self.writes.append(s)
+
+    def getvalue(self):
+        return "".join(self.writes)
+
+def test_one_write_per_batch():
+    output = PipeOutput()
+    with SqlInsertWriter(output, "t", "INSERT INTO t VALUES \n", "-- none", batch_insert_size=2) as writer:
+        writer.write_rows(["\t(1)", "\t(2)", "\t(3)", "\t(4)", "\t(5)"])
+    assert output.writes == [
+        "INSERT INTO t VALUES \n\t(1),\n\t(2);\n",
+        "INSERT INTO t VALUES \n\t(3),\n\t(4);\n",
+        "INSERT INTO t VALUES \n\t(5);\n",
+    ]
+    assert writer.rows_written == 5
+
+def test_buffer_size_splits_unbatched_statement():
+    output = PipeOutput()
+    with SqlInsertWriter(output, "t", "INSERT INTO t VALUES \n", "-- none", buffer_size=30) as writer:
+        writer.write_rows(["\t(1)", "\t(2)", "\t(3)", "\t(4)"])
+    assert len(output.writes) > 1
+    assert output.getvalue() == "INSERT INTO t VALUES \n\t(1),\n\t(2),\n\t(3),\n\t(4);\n"
+
+def test_no_rows_on_non_seekable_output():
+    output = PipeOutput()
+    assert chargeable_sql_writer(output).close() == 0
+    assert output.getvalue() == NO_VALID_ROWS_CHARGEABLE_SQL
+
+    output = PipeOutput()
+    domains_sql_writer(output).close()
+    assert output.getvalue() == NO_VALID_ROWS_DOMAINS_SQL
+
+def test_exact_batch_boundary_has_no_trailing_statement():
+    output = PipeOutput()
+    with domains_sql_writer(output, batch_insert_size=2) as writer:
+        writer.write_rows(["\t('a.com', 'abc')", "\t('b.com', 'def')"])
+    assert output.getvalue() == (
+        "INSERT INTO domains (domain, partnerPurchasedPlanID) VALUES \n"
+        "\t('a.com', 'abc'),\n"
+        "\t('b.com', 'def');\n"
+    )
+
+def test_max_statement_bytes_ends_statements_before_the_limit():
+    output = PipeOutput()
+    header = "INSERT INTO t VALUES \n"  # 22 bytes
+    with SqlInsertWriter(output, "t", header, "-- none", max_statement_bytes=40) as writer:
+        writer.write_rows(["\t('a')", "\t('b')", "\t('é')", "\t('d')"])
+    # "é" is one character but two bytes, so the third row no longer fits after two 6 byte rows
+    assert output.writes == [
+        "INSERT INTO t VALUES \n\t('a'),\n\t('b');\n",
+        "INSERT INTO t VALUES \n\t('é'),\n\t('d');\n",
+    ]
+    assert all(len(statement.rstrip("\n").encode()) <= 40 for statement in output.writes)
+    assert writer.statement_stats()["largest_statement_bytes"] == 38
+
+def test_batch_insert_size_and_max_statement_bytes_both_apply():
+    output = PipeOutput()
+    with SqlInsertWriter(output, "t", "INSERT INTO t VALUES \n", "-- none", batch_insert_size=2, max_statement_bytes=40) as writer:
+        writer.write_rows(["\t(1)", "\t(2)", "\t(3)", "\t(123456789)", "\t(4)"])
+    assert output.getvalue() == (
+        "INSERT INTO t VALUES \n\t(1),\n\t(2);\n"
+        "INSERT INTO t VALUES \n\t(3);\n"
+        "INSERT INTO t VALUES \n\t(123456789);\n"
+        "INSERT INTO t VALUES \n\t(4);\n"
+    )
+    assert writer.statement_stats() == {
+        "statements": 4, "min_rows": 1, "median_rows": 1, "max_rows": 2,
+        "largest_statement_bytes": 35, "widest_row_bytes": 12, "oversized_statements": 0,
+        "safe_batch_insert_size": 1,
+    }
+
+def test_oversized_row_gets_its_own_statement(caplog):
+    output = PipeOutput()
+    with caplog.at_level(logging.WARNING):
+        with SqlInsertWriter(output, "t", "INSERT INTO t VALUES \n", "-- none", max_statement_bytes=30) as writer:
+            writer.write_rows(["\t(1)", "\t('far too long')", "\t(2)"])
+    assert output.getvalue() == (
+        "INSERT INTO t VALUES \n\t(1);\n"
+        "INSERT INTO t VALUES \n\t('far too long');\n"
+        "INSERT INTO t VALUES \n\t(2);\n"
+    )
+    assert writer.oversized_statements == 1
+    assert "Row 2 of the t table makes a 40 byte statement on its own, over the 30 byte limit" in caplog.text
+
+def test_restore_continues_the_statement_budget():
+    first = PipeOutput()
+    writer = SqlInsertWriter(first, "t", "INSERT INTO t VALUES \n", "-- none", max_statement_bytes=40)
+    writer.write_rows(["\t(1)", "\t(2)"])
+    writer.flush()
+    second = PipeOutput()
+    resumed = SqlInsertWriter(second, "t", "INSERT INTO t VALUES \n", "-- none", max_statement_bytes=40)
+    resumed.restore(writer.state())
+    resumed.write_rows(["\t(3)", "\t(4)"])
+    resumed.close()
+    assert first.getvalue() + second.getvalue() == (
+        "INSERT INTO t VALUES \n\t(1),\n\t(2),\n\t(3);\n"
+        "INSERT INTO t VALUES \n\t(4);\n"
+    )
@@ -0,0 +1,124 @@
+import argparse
+import gzip
+import io
+import logging
+import subprocess
+import sys
+import pytest
+from constants import DEFAULT_CSV_FILE, DEFAULT_SMALL_REPORT_BYTES, DEFAULT_CHUNK_SIZE
+from csv_reader import read_report
+from processor import generate_chargeable_sql
+from sql_writer import generate_domains_sql
+from stdlib_engine import read_report_stdlib, generate_chargeable_sql_stdlib
+from usage_translator import use_stdlib_engine
+from utils import SkippedRowSummary
+
+type_map = {
+    "ADS000010U0R": "core.chargeable.adsync",
+    "EA000001GB0O": "core.chargeable.addarchiveingestspace",
+    "PLN006NR": "core.chargeable.exchange",
+}
+
+REPORT = (
+    "﻿PartnerID,extra,accountGuid,domains,plan,PartNumber,itemCount\n"
+    "1,x,acc-1,a.com,Plan A,ADS000010U0R,5\n"
+    "26392,x,acc-2,b.com,Plan B,ADS000010U0R,7\n"
+    "3,x,acc-3,c.com,\"Plan's, C\",EA000001GB0O,3000\n"
+    "\n"
+    "4,x,,d.com,Plan D,ADS000010U0R, 2 \n"
+    "5,x,NA,e.com,Plan E,PLN006NR,+3\n"
+    "6,x,acc-6,f.com,Plan F,PLN006NR,1.5\n"
+    "7,x,acc-7,g.com,Plan G,NA,1\n"
+    "8,x,acc-8,h.com,Plan H,UNKNOWN,1\n"
+    "abc,x,acc-9,i.com,Plan I,PLN006NR,1\n"
+    "10,x,acc-10,j.com,Plan J,PLN006NR,0\n"
+    "11,x,!!!,k.com,Plan K,PLN006NR,1\n"
+    "12,x,acc-12,a.com,Plan L,EA000001GB0O,999\n"
+    "13,x,acc-13,l.com,Plan M,PLN006NR\n"
+    "14,x,0123456789abcdef0123456789abcdef0,m.com,Plan N,PLN006NR,1\n"
+    "99999999999999999999,x,acc-15,n.com,Plan O,PLN006NR,1\n"
+)
+
+def translate_both(csv_path, batch_insert_size=0, max_statement_bytes=0):
+    outputs = []
+    for read, generate in [(read_report, generate_chargeable_sql), (read_report_stdlib, generate_chargeable_sql_stdlib)]:
+        output = io.StringIO()
+        summary = SkippedRowSummary()
+        product_totals, domain_map = generate(read(csv_path), type_map, output, batch_insert_size=batch_insert_size, max_statement_bytes=max_statement_bytes, skip_summary=summary)
+        generate_domains_sql(domain_map, output, batch_insert_size=batch_insert_size, max_statement_bytes=max_statement_bytes)
+        outputs.append((output.getvalue(), list(product_totals.items()), summary.counts, summary.samples))
+    return outputs
+
+def test_engines_match_on_edge_cases(tmp_path):
+    csv_path = tmp_path / "report.csv"
+    csv_path.write_text(REPORT, encoding="utf-8")
+    pandas_result, stdlib_result = translate_both(str(csv_path))
+    assert stdlib_result == pandas_result
+    assert "(4, 'core.chargeable.adsync', 'nan', 'Plan D', 2)" in stdlib_result[0]
+    assert "'Plan''s, C'" in stdlib_result[0]
+
+@pytest.mark.parametrize("batch_insert_size, max_statement_bytes", [(0, 0), (100, 0), (0, 5000), (30, 5000)])
+def test_engines_match_on_sample_report(batch_insert_size, max_statement_bytes):
+    pandas_result, stdlib_result = translate_both(DEFAULT_CSV_FILE, batch_insert_size, max_statement_bytes)
+    assert stdlib_result == pandas_result
+    if max_statement_bytes:
+        statements = stdlib_result[0].split(";\n")[:-1]
+        assert max(len(f"{statement};".encode()) for statement in statements) <= max_statement_bytes
+
+@pytest.mark.parametrize("block_rows", [DEFAULT_CHUNK_SIZE, 3])
+def test_engines_log_the_same_rows(tmp_path, caplog, block_rows):
+    csv_path = tmp_path / "report.csv.gz"
+    with gzip.open(csv_path, "wt", encoding="utf-8") as f:
+        f.write(REPORT)
+    logs = []
+    for read, generate in [(read_report, generate_chargeable_sql), (lambda path: read_report_stdlib(path, block_rows), generate_chargeable_sql_stdlib)]:
+        caplog.clear()
+        with caplog.at_level(logging.DEBUG):
+            generate(read(str(csv_path)), type_map, io.StringIO())
+        logs.append([(record.levelno, record.getMessage()) for record in caplog.records])
+    assert logs[1] == logs[0]
+
+def test_compressed_report(tmp_path):
+    csv_path = tmp_path / "report.csv.gz"
+    with gzip.open(csv_path, "wt", encoding="utf-8") as f:
+        f.write(REPORT)
+    pandas_result, stdlib_result = translate_both(str(csv_path))
+    assert stdlib_result == pandas_result
+
+def test_read_report_stdlib_columns(tmp_path):
+    csv_path = tmp_path / "report.csv"
+    csv_path.write_text("PartnerID,plan\n")
+    report = read_report_stdlib(str(csv_path))
+    assert report.columns == ["PartnerID", "plan"]
+    assert report.empty
+
+def arguments(csv_path, **overrides):
+    args = dict(csv=csv_path, csv_engine="auto", sink="sql", workers=1, stream=False, resume=False, delta=False, small_report_bytes=DEFAULT_SMALL_REPORT_BYTES)
+    args.update(overrides)
+    return argparse.Namespace(**args)
+
+def test_use_stdlib_engine(tmp_path):
+    csv_path = tmp_path / "report.csv"
+    csv_path.write_text(REPORT)
+    assert use_stdlib_engine(arguments(str(csv_path)))
+    assert not use_stdlib_engine(arguments(str(csv_path), small_report_bytes=10))
+    assert not use_stdlib_engine(arguments(str(csv_path), csv_engine="c"))
+    assert not use_stdlib_engine(arguments(str(csv_path), stream=True))
+    assert not use_stdlib_engine(arguments(str(tmp_path / "missing.csv")))
+    assert use_stdlib_engine(arguments(str(csv_path), csv_engine="stdlib", small_report_bytes=10))
+
+    args = arguments(str(csv_path), csv_engine="stdlib", sink="db")
+    assert not use_stdlib_engine(args)
+    assert args.csv_engine == "auto"
+
+def test_command_line_starts_without_pandas():
+    code = "import sys, usage_translator; print('pandas' in sys.modules, 'numpy' in sys.modules)"
+    result = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True)
+    assert result.stdout.split() == ["False", "False"]
+
+def test_read_report_stdlib_blocks(tmp_path):
+    csv_path = tmp_path / "report.csv"
+    csv_path.write_text(REPORT, encoding="utf-8")
+    report = read_report_stdlib(str(csv_path), block_rows=4)
+    assert [len(rows) for rows in report.blocks()] == [4, 4, 4, 3]
+    assert not report.empty
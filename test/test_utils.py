@@ -1,4 +1,4 @@
-from utils import clean_guid, escape_sql_string
+from utils import clean_guid, escape_sql_string, cache_stats, SkippedRowSummary
 
 def test_clean_guid():
     assert clean_guid("799ef0ab-4438-4157-8afc-f6fc4dfe9253") == "799ef0ab443841578afcf6fc4dfe9253"
@@ -16,3 +16,32 @@ def test_escape_sql_string():
     assert escape_sql_string("") == ""
     assert escape_sql_string("'") == "''"
     assert escape_sql_string("password' OR '1'='1") == "password'' OR ''1''=''1"
+
+def test_clean_guid_fast_path_matches_slow_path():
+    for guid in ["799ef0ab-4438-4157-8afc-f6fc4dfe9253", "799EF0AB-4438-4157-8AFC-F6FC4DFE9253", "---", "a-b_c", "{799ef0ab-4438}", "é-1"]:
+        assert clean_guid(guid) == ''.join(ch for ch in guid if ch.isalnum())
+
+def test_cache_stats():
+    guid = "0f1e2d3c-4b5a-6978-8796-a5b4c3d2e1f0"
+    before = cache_stats()["clean_guid"]
+    assert clean_guid(guid) == clean_guid(guid) == "0f1e2d3c4b5a69788796a5b4c3d2e1f0"
+    after = cache_stats()["clean_guid"]
+    assert after["misses"] == before["misses"] + 1
+    assert after["hits"] == before["hits"] + 1
+
+def test_clean_guid_cache_is_typed():
+    assert clean_guid(1) == "1"
+    assert clean_guid(True) == "True"
+
+def test_skipped_row_summary(caplog):
+    caplog.set_level("INFO")
+    summary = SkippedRowSummary(sample_size=2)
+    for row_number in [2, 3, 7]:
+        summary.add("PartNumber is missing", row_number)
+    summary.add("ItemCount is zero or negative", 5)
+    assert summary.total == 4
+    assert summary.counts == {"PartNumber is missing": 3, "ItemCount is zero or negative": 1}
+    summary.log()
+    assert "Skipped 4 rows:" in caplog.text
+    assert "PartNumber is missing: 3 rows (rows 2, 3, ...)" in caplog.text
+    assert "ItemCount is zero or negative: 1 rows (rows 5)" in caplog.text
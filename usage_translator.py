@@ -1,26 +1,258 @@
-import pandas as pd
-import json
 import argparse
 import logging
-from constants import OUTPUT_FOLDER, CHARGEABLE_SQL_FILE, DOMAINS_SQL_FILE, DEFAULT_CSV_FILE, DEFAULT_JSON_FILE, DEFAULT_LOG_FILE, REQUIRED_COLUMNS
-from utils import setup_logging
-from processor import generate_chargeable_sql, generate_domains_sql
+import os
+import cProfile
+from itertools import chain
+from constants import OUTPUT_FOLDER, CHARGEABLE_SQL_FILE, DOMAINS_SQL_FILE, DEFAULT_CSV_FILE, DEFAULT_JSON_FILE, DEFAULT_LOG_FILE, DEFAULT_CHUNK_SIZE, DEFAULT_WRITE_BUFFER_SIZE, DEFAULT_MAX_STATEMENT_BYTES, DEFAULT_DB_URL, DEFAULT_PROFILE_FILE, DEFAULT_CHECKPOINT_FILE, DEFAULT_CHECKPOINT_INTERVAL, DEFAULT_SNAPSHOT_FILE, DEFAULT_DOMAIN_MEMORY_LIMIT, DEFAULT_AGGREGATE_MEMORY_LIMIT, DEFAULT_SERVICE_HOST, DEFAULT_SERVICE_WORKERS, DEFAULT_SMALL_REPORT_BYTES, DEFAULT_BATCH_OUTPUT_FOLDER, DEFAULT_ROW_GROUP_SIZE, CHARGEABLE_COLUMNAR_FILE, DOMAINS_COLUMNAR_FILE, COLUMNAR_FORMATS, CHARGEABLE_DELTA_SQL_FILE, DOMAINS_DELTA_SQL_FILE, REQUIRED_COLUMNS, CSV_ENGINES
+from utils import setup_logging, log_cache_stats, SkippedRowSummary
+from metrics import RunMetrics
+from sql_writer import generate_domains_sql
+from rules import load_rules
+from compressed_io import OUTPUT_CODECS, input_codec, output_path, open_output
+from stdlib_engine import read_report_stdlib, generate_chargeable_sql_stdlib
+from mmap_scanner import MappedReport
+from aggregate import UsageAggregate
+
+# The modules that translate with pandas are imported by run when it needs them, since
+# importing pandas takes longer than translating a small report with the stdlib engine.
+
+
+def log_product_totals(product_totals):
+    """
+    Log the usage total of each part number.
+    """
+    logging.info("Product totals:")
+    for part_number, total in product_totals.items():
+        logging.info(f"  - Part Number: {part_number}, Total: {total}")
 
 
 def main():
     parser = argparse.ArgumentParser(description="Usage Translator CLI")
     parser.add_argument("--csv", default=DEFAULT_CSV_FILE, help="Path to the CSV report file")
     parser.add_argument("--json", default=DEFAULT_JSON_FILE, help="Path to the typemap JSON file")
-    parser.add_argument("--batch-insert-size", default=0, help="Batch insert size for SQL queries")
+    parser.add_argument("--unit-reductions", help="Path to a JSON file mapping part numbers to unit reduction factors (default: the built-in factors)")
+    parser.add_argument("--skip-list", help="Path to a file of PartnerIDs to skip, one per line or a JSON list (default: the built-in skip list)")
+    parser.add_argument("--rules-cache", help="If set, the compiled typemap, unit reductions and skip list are cached in this file until one of them changes")
+    parser.add_argument("--batch-insert-size", type=batch_size, default=0, help="Batch insert size for SQL queries, or auto to fill each statement up to --max-statement-bytes")
+    parser.add_argument("--max-statement-bytes", type=int, default=0, help=f"If set, each INSERT statement ends before it would exceed this many bytes (default with --batch-insert-size auto: {DEFAULT_MAX_STATEMENT_BYTES})")
     parser.add_argument("--log", action="store_true", help=f"If set, logs will also be written to {DEFAULT_LOG_FILE}")
+    parser.add_argument("--async-log", action="store_true", help="If set, log records are written by a background thread instead of on the hot path")
+    parser.add_argument("--skipped-rows", choices=["full", "summary"], default="full", help="Log every skipped row (full), or only counts per reason with sample row numbers (summary)")
+    parser.add_argument("--stream", action="store_true", help="If set, the CSV is read and translated in chunks instead of all at once")
+    parser.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE, help="Number of CSV rows per chunk in --stream mode")
+    parser.add_argument("--write-buffer-size", type=int, default=DEFAULT_WRITE_BUFFER_SIZE, help="Number of characters of SQL to buffer before writing a partial statement")
+    parser.add_argument("--sink", choices=["sql", "db", *COLUMNAR_FORMATS], default="sql", help="Write SQL files to the output folder, load rows straight into --db-url, or write Parquet or Arrow IPC files to the output folder")
+    parser.add_argument("--row-group-size", type=int, default=DEFAULT_ROW_GROUP_SIZE, help="Number of rows per row group of the --sink parquet and arrow files")
+    parser.add_argument("--db-url", default=DEFAULT_DB_URL, help="Database to load in --sink db mode (sqlite:///path or postgresql://...)")
+    parser.add_argument("--workers", type=int, default=1, help="Number of worker processes that translate shards of the CSV in parallel")
+    parser.add_argument("--resume", action="store_true", help="If set, progress is checkpointed to --checkpoint-file and an interrupted run continues from its last checkpoint")
+    parser.add_argument("--checkpoint-file", default=DEFAULT_CHECKPOINT_FILE, help="Path of the checkpoint file in --resume mode")
+    parser.add_argument("--checkpoint-interval", type=float, default=DEFAULT_CHECKPOINT_INTERVAL, help="Minimum number of seconds between checkpoints in --resume mode")
+    parser.add_argument("--delta", action="store_true", help=f"If set, only the changes since the previous --delta run are written, to {CHARGEABLE_DELTA_SQL_FILE} and {DOMAINS_DELTA_SQL_FILE}")
+    parser.add_argument("--snapshot-file", default=DEFAULT_SNAPSHOT_FILE, help="Path of the snapshot of the previous run in --delta mode")
+    parser.add_argument("--output-compression", choices=OUTPUT_CODECS, default="none", help="Compress the SQL files as they are written (zstd needs the zstandard package)")
+    parser.add_argument("--compression-level", type=int, help="Compression level of --output-compression (default: the codec's default)")
+    parser.add_argument("--domain-memory-limit", type=int, default=DEFAULT_DOMAIN_MEMORY_LIMIT // (1024 * 1024), help="Megabytes of domain index to hold in memory before it is moved to a temporary SQLite file")
+    parser.add_argument("--aggregate", action="store_true", help="If set, chargeable rows with the same partnerID, product, productPurchasedPlanID and plan are written as one row with their summed usage")
+    parser.add_argument("--aggregate-memory-limit", type=int, default=DEFAULT_AGGREGATE_MEMORY_LIMIT // (1024 * 1024), help="Megabytes of --aggregate groups to hold in memory before they are moved to a temporary SQLite file")
+    parser.add_argument("--csv-engine", choices=CSV_ENGINES, default="auto", help="CSV parser; auto uses the stdlib engine for reports up to --small-report-bytes, otherwise pyarrow when it is installed and the report isn't streamed")
+    parser.add_argument("--small-report-bytes", type=int, default=DEFAULT_SMALL_REPORT_BYTES, help="Largest report that --csv-engine auto translates with the stdlib engine, without importing pandas")
+    parser.add_argument("--batch", metavar="PATTERN", help="If set, translate every report in this folder (or matching this glob pattern) on one pool of --workers processes, instead of --csv")
+    parser.add_argument("--batch-output-folder", default=DEFAULT_BATCH_OUTPUT_FOLDER, help="Folder of the SQL files and summary written in --batch mode")
+    parser.add_argument("--batch-merge", action="store_true", help="If set, the reports of --batch are merged into one chargeable and one domains SQL file instead of a pair per report")
+    parser.add_argument("--serve", metavar="HOST:PORT", help="If set, run as an HTTP service on HOST:PORT (or PORT, on 127.0.0.1) that translates uploaded reports (POST /translate)")
+    parser.add_argument("--serve-socket", metavar="PATH", help="If set, run the service on a Unix socket at PATH instead")
+    parser.add_argument("--service-workers", type=int, default=DEFAULT_SERVICE_WORKERS, help="Number of reports the service translates at the same time")
+    parser.add_argument("--metrics-file", help="If set, per-stage timings, row counters and peak memory are written to this JSON file")
+    parser.add_argument("--prometheus-file", help="If set, the same metrics are written to this file in the Prometheus text format")
+    parser.add_argument("--profile", action="store_true", help="If set, the run is profiled with cProfile")
+    parser.add_argument("--profile-output", default=DEFAULT_PROFILE_FILE, help="Path of the cProfile stats file written in --profile mode")
 
     args = parser.parse_args()
-    setup_logging(args.log)
+    setup_logging(args.log, use_queue=args.async_log)
+    if args.batch_insert_size == "auto":
+        # With no row limit, the byte limit alone makes each statement as large as is safe
+        args.batch_insert_size = 0
+        args.max_statement_bytes = args.max_statement_bytes or DEFAULT_MAX_STATEMENT_BYTES
+        logging.info(f"Batch insert size auto: each statement is filled up to {args.max_statement_bytes} bytes")
+
+    if args.serve or args.serve_socket:
+        run_service(args)
+    elif args.profile:
+        profiler = cProfile.Profile()
+        profiler.runcall(run_batch if args.batch else run, args)
+        profiler.dump_stats(args.profile_output)
+        logging.info(f"Profile written to {args.profile_output} (view with: python -m pstats {args.profile_output})")
+    elif args.batch:
+        run_batch(args)
+    else:
+        run(args)
+
+
+def batch_size(value):
+    """
+    Parse --batch-insert-size: a number of rows, or auto.
+    """
+    return value if value == "auto" else int(value)
+
+
+def use_stdlib_engine(args):
+    """
+    Decide whether the report is translated by the stdlib engine, which doesn't import pandas.
+
+    It is used for --csv-engine stdlib, and for --csv-engine auto when the report is at most
+    --small-report-bytes, in the default mode only (SQL files, no --stream, --workers, --resume or --delta).
+    """
+    default_mode = args.sink == "sql" and args.workers <= 1 and not (args.stream or args.resume or args.delta)
+    if args.csv_engine in ("stdlib", "mmap"):
+        if not default_mode:
+            logging.warning(f"--csv-engine {args.csv_engine} only supports the default mode, using pandas")
+            args.csv_engine = "auto"
+        elif args.csv_engine == "mmap" and input_codec(args.csv):
+            logging.warning("--csv-engine mmap needs an uncompressed CSV, using the stdlib engine, which also reads it in blocks")
+            args.csv_engine = "stdlib"
+        return default_mode
+    if args.csv_engine != "auto" or not default_mode:
+        return False
+    try:
+        return os.path.getsize(args.csv) <= args.small_report_bytes
+    except OSError:
+        return False  # A missing CSV is reported when it is read
+
+
+def run_service(args):
+    """
+    Load the rules once and serve translations until interrupted.
+    """
+    import asyncio
+    from service import serve
+
+    if args.metrics_file or args.prometheus_file or args.aggregate:
+        logging.error("--metrics-file, --prometheus-file and --aggregate are not supported with --serve or --serve-socket")
+        return
+    try:
+        rules = load_rules(args.json, args.unit_reductions, args.skip_list, args.rules_cache)
+    except FileNotFoundError as e:
+        logging.error(f"Rules file not found: {e.filename}")
+        return
+    host, _, port = (args.serve or "").rpartition(":")
+    try:
+        asyncio.run(serve(rules, host or DEFAULT_SERVICE_HOST, int(port or 0), args.serve_socket, workers=args.service_workers, chunk_size=args.chunk_size, log_skipped_rows=args.skipped_rows == "full"))
+    except KeyboardInterrupt:
+        logging.info("Translator service stopped")
+
+
+def run_batch(args):
+    """
+    Translate the reports matching --batch with the rules loaded once, and write a combined summary.
+    """
+    from batch import find_reports, report_name, translate_reports, write_summary
+
+    if args.sink != "sql" or args.resume or args.delta or args.aggregate:
+        logging.error(f"--batch is not supported with --sink {args.sink}, --resume, --delta or --aggregate")
+        return
+    csv_paths = find_reports(args.batch)
+    if not csv_paths:
+        logging.error(f"No reports found: {args.batch}")
+        return
+    names = [report_name(csv_path) for csv_path in csv_paths]
+    duplicates = sorted({name for name in names if names.count(name) > 1})
+    if duplicates and not args.batch_merge:
+        logging.error(f"Reports with the same name would overwrite each other's SQL files: {', '.join(duplicates)}")
+        return
 
-    # Load CSV file into a DataFrame
     try:
-        df = pd.read_csv(args.csv)
-        logging.info(f"Loaded CSV: {args.csv}")
+        rules = load_rules(args.json, args.unit_reductions, args.skip_list, args.rules_cache)
+        logging.info(f"Loaded rules: {len(rules)} part numbers, {len(rules.skip_partner_ids)} skipped PartnerIDs")
+    except FileNotFoundError as e:
+        logging.error(f"Rules file not found: {e.filename}")
+        return
+
+    metrics = RunMetrics()
+    logging.info(f"Translating {len(csv_paths)} reports with {args.workers} workers")
+    summary = translate_reports(
+        csv_paths, rules, args.batch_output_folder, args.workers, merge=args.batch_merge,
+        batch_insert_size=args.batch_insert_size, buffer_size=args.write_buffer_size, max_statement_bytes=args.max_statement_bytes,
+        csv_engine=args.csv_engine, small_report_bytes=args.small_report_bytes, chunk_size=args.chunk_size,
+        output_compression=args.output_compression, compression_level=args.compression_level,
+        domain_memory_limit=args.domain_memory_limit * 1024 * 1024,
+        skipped_rows=args.skipped_rows, metrics=metrics,
+    )
+    log_product_totals(summary["product_totals"])
+    summary_path = write_summary(summary, args.batch_output_folder)
+    logging.info(f"Batch summary written to {summary_path}")
+    if summary["failed_reports"]:
+        logging.error(f"{summary['failed_reports']} of {len(csv_paths)} reports failed")
+
+    metrics.log()
+    if args.metrics_file:
+        metrics.write_json(args.metrics_file)
+    if args.prometheus_file:
+        metrics.write_prometheus(args.prometheus_file)
+
+
+def run(args):
+    """
+    Translate the usage report described by the parsed command line arguments.
+    """
+    metrics = RunMetrics()
+    domain_memory_limit = args.domain_memory_limit * 1024 * 1024
+    skip_summary = SkippedRowSummary(log_each_row=args.skipped_rows == "full")
+
+    if args.sink != "sql" and args.workers > 1:
+        logging.error(f"--workers is not supported with --sink {args.sink}")
+        return
+    if args.resume and (args.sink != "sql" or args.workers > 1):
+        logging.error(f"--resume is not supported with --sink {args.sink} or --workers")
+        return
+    if args.delta and (args.sink != "sql" or args.workers > 1 or args.resume):
+        logging.error(f"--delta is not supported with --sink {args.sink}, --workers or --resume")
+        return
+    if args.max_statement_bytes and args.sink != "sql":
+        logging.error(f"--max-statement-bytes and --batch-insert-size auto are not supported with --sink {args.sink}")
+        return
+    if args.aggregate and (args.sink != "sql" or args.workers > 1 or args.resume or args.delta):
+        logging.error(f"--aggregate is not supported with --sink {args.sink}, --workers, --resume or --delta")
+        return
+    if args.resume and args.output_compression != "none":
+        logging.error("--resume is not supported with --output-compression")
+        return
+    if args.workers > 1 and input_codec(args.csv):
+        logging.warning("--workers needs an uncompressed CSV to split into shards, translating in one process")
+        args.workers = 1
+
+    def open_sql_output(file_name):
+        return open_output(output_path(f"{OUTPUT_FOLDER}/{file_name}", args.output_compression), args.output_compression, args.compression_level)
+
+    stdlib_engine = use_stdlib_engine(args)
+    if not stdlib_engine:
+        from csv_reader import read_report
+
+    # Load CSV file into a DataFrame, or only its first chunk in streaming mode
+    try:
+        with metrics.stage("read_csv"):
+            if stdlib_engine and args.csv_engine == "mmap":
+                df = MappedReport(args.csv)
+                logging.info(f"Scanning CSV: {args.csv} (mmap engine)")
+            elif stdlib_engine:
+                df = read_report_stdlib(args.csv, args.chunk_size)
+                logging.info(f"Reading CSV: {args.csv} (stdlib engine, {args.chunk_size} rows per block)")
+            elif args.workers > 1:
+                # Workers read their own shards; only the first row is needed for the checks below
+                df = read_report(args.csv, args.csv_engine, nrows=1)
+                logging.info(f"Translating CSV with {args.workers} workers: {args.csv}")
+            elif args.resume:
+                # The CSV is read in blocks from the last checkpoint; only the first row is needed for the checks below
+                df = read_report(args.csv, args.csv_engine, nrows=1)
+                logging.info(f"Translating CSV with checkpoints: {args.csv} ({args.chunk_size} rows per chunk)")
+            elif args.stream:
+                import pandas as pd
+                chunks = read_report(args.csv, args.csv_engine, chunksize=args.chunk_size)
+                df = next(chunks, pd.DataFrame())
+                logging.info(f"Streaming CSV: {args.csv} ({args.chunk_size} rows per chunk)")
+            else:
+                df = read_report(args.csv, args.csv_engine)
+                logging.info(f"Loaded CSV: {args.csv}")
     except FileNotFoundError:
         logging.error(f"CSV file not found: {args.csv}")
         return
@@ -36,24 +268,86 @@ def main():
         logging.error(f"CSV file is missing required columns: {', '.join(missing_columns)}")
         return
 
-    # Load JSON file for typemap
+    # Load the typemap, unit reductions and skip list
     try:
-        with open(args.json) as f:
-            type_map = json.load(f)
-            logging.info(f"Loaded JSON: {args.json}")
-    except FileNotFoundError:
-        logging.error(f"JSON file not found: {args.json}")
+        with metrics.stage("load_typemap"):
+            rules = load_rules(args.json, args.unit_reductions, args.skip_list, args.rules_cache)
+            logging.info(f"Loaded rules: {len(rules)} part numbers, {len(rules.skip_partner_ids)} skipped PartnerIDs")
+    except FileNotFoundError as e:
+        logging.error(f"Rules file not found: {e.filename}")
         return
     
-    with open(f"{OUTPUT_FOLDER}/{CHARGEABLE_SQL_FILE}", "w") as chargeable_sql_output:
-        product_totals, domain_map = generate_chargeable_sql(df, type_map, chargeable_sql_output, batch_insert_size=args.batch_insert_size)
+    if args.stream and args.workers <= 1 and not args.resume:
+        df = chain([df], chunks)
 
-    logging.info("Product totals:")
-    for part_number, total in product_totals.items():
-        logging.info(f"  - Part Number: {part_number}, Total: {total}")
-         
-    with open(f"{OUTPUT_FOLDER}/{DOMAINS_SQL_FILE}", "w") as domains_sql_output:
-        generate_domains_sql(domain_map, domains_sql_output, batch_insert_size=args.batch_insert_size)
+    if args.sink == "db":
+        from db_sink import get_driver, load_chargeable_rows, load_domains
+        with get_driver(args.db_url) as driver:
+            product_totals, domain_map = load_chargeable_rows(df, rules, driver, batch_insert_size=args.batch_insert_size, skip_summary=skip_summary, metrics=metrics, domain_memory_limit=domain_memory_limit)
+            log_product_totals(product_totals)
+            with metrics.stage("load_domains"):
+                load_domains(domain_map, driver, batch_insert_size=args.batch_insert_size)
+    elif args.sink in COLUMNAR_FORMATS:
+        from columnar_sink import write_chargeable_columnar, write_domains_columnar
+        extension = COLUMNAR_FORMATS[args.sink]
+        try:
+            product_totals, domain_map = write_chargeable_columnar(df, rules, f"{OUTPUT_FOLDER}/{CHARGEABLE_COLUMNAR_FILE}{extension}", args.sink, row_group_size=args.row_group_size, compression=args.output_compression, skip_summary=skip_summary, metrics=metrics, domain_memory_limit=domain_memory_limit)
+            log_product_totals(product_totals)
+            with metrics.stage("write_domains"):
+                write_domains_columnar(domain_map, f"{OUTPUT_FOLDER}/{DOMAINS_COLUMNAR_FILE}{extension}", args.sink, row_group_size=args.row_group_size, compression=args.output_compression)
+        except (ImportError, ValueError) as e:
+            logging.error(str(e))
+            return
+    elif args.delta:
+        from delta import generate_delta_sql, commit_snapshot
+        with open_sql_output(CHARGEABLE_DELTA_SQL_FILE) as chargeable_sql_output, open_sql_output(DOMAINS_DELTA_SQL_FILE) as domains_sql_output:
+            product_totals, domain_map = generate_delta_sql(df, rules, args.snapshot_file, chargeable_sql_output, domains_sql_output, batch_insert_size=args.batch_insert_size, buffer_size=args.write_buffer_size, max_statement_bytes=args.max_statement_bytes, skip_summary=skip_summary, metrics=metrics, domain_memory_limit=domain_memory_limit)
+        commit_snapshot(args.snapshot_file)
+        log_product_totals(product_totals)
+    else:
+        if args.resume:
+            from checkpoint import generate_chargeable_sql_resumable, remove_checkpoint
+            product_totals, domain_map = generate_chargeable_sql_resumable(args.csv, rules, f"{OUTPUT_FOLDER}/{CHARGEABLE_SQL_FILE}", args.checkpoint_file, batch_insert_size=args.batch_insert_size, chunk_size=args.chunk_size, buffer_size=args.write_buffer_size, max_statement_bytes=args.max_statement_bytes, checkpoint_interval=args.checkpoint_interval, skip_summary=skip_summary, metrics=metrics, csv_engine=args.csv_engine, domain_memory_limit=domain_memory_limit)
+        else:
+            aggregate = UsageAggregate(args.aggregate_memory_limit * 1024 * 1024) if args.aggregate else None
+            with open_sql_output(CHARGEABLE_SQL_FILE) as chargeable_sql_output:
+                if stdlib_engine:
+                    product_totals, domain_map = generate_chargeable_sql_stdlib(df, rules, chargeable_sql_output, batch_insert_size=args.batch_insert_size, buffer_size=args.write_buffer_size, max_statement_bytes=args.max_statement_bytes, skip_summary=skip_summary, metrics=metrics, domain_memory_limit=domain_memory_limit, aggregate=aggregate)
+                    if isinstance(df, MappedReport):
+                        df.close()
+                elif args.workers > 1:
+                    from parallel import generate_chargeable_sql_parallel
+                    product_totals, domain_map = generate_chargeable_sql_parallel(args.csv, rules, chargeable_sql_output, args.workers, batch_insert_size=args.batch_insert_size, buffer_size=args.write_buffer_size, max_statement_bytes=args.max_statement_bytes, skip_summary=skip_summary, metrics=metrics, csv_engine=args.csv_engine, domain_memory_limit=domain_memory_limit)
+                else:
+                    from processor import generate_chargeable_sql
+                    product_totals, domain_map = generate_chargeable_sql(df, rules, chargeable_sql_output, batch_insert_size=args.batch_insert_size, buffer_size=args.write_buffer_size, max_statement_bytes=args.max_statement_bytes, skip_summary=skip_summary, metrics=metrics, domain_memory_limit=domain_memory_limit, aggregate=aggregate)
+            if aggregate is not None:
+                aggregate.log_reduction()
+                metrics.count("rows_aggregated", len(aggregate))
+                aggregate.close()
+
+        log_product_totals(product_totals)
+
+        with metrics.stage("generate_domains_sql"), open_sql_output(DOMAINS_SQL_FILE) as domains_sql_output:
+            generate_domains_sql(domain_map, domains_sql_output, batch_insert_size=args.batch_insert_size, buffer_size=args.write_buffer_size, max_statement_bytes=args.max_statement_bytes)
+
+        if args.resume:
+            remove_checkpoint(args.checkpoint_file)
+
+    domain_map.log_conflicts()
+    metrics.count("domain_conflicts", domain_map.conflicts)
+    domain_map.close()
+
+    skip_summary.log()
+    logging.info("Cache stats:")
+    log_cache_stats()
+
+    metrics.skipped_rows = dict(skip_summary.counts)
+    metrics.log()
+    if args.metrics_file:
+        metrics.write_json(args.metrics_file)
+    if args.prometheus_file:
+        metrics.write_prometheus(args.prometheus_file)
 
 if __name__ == "__main__":
     main()
@@ -1,34 +1,127 @@
+import atexit
 import logging
-from constants import DEFAULT_LOG_FILE
+import logging.handlers
+import queue
+from functools import lru_cache
+from constants import DEFAULT_LOG_FILE, TRANSFORM_CACHE_SIZE, SKIPPED_ROWS_SAMPLE_SIZE
 
-def setup_logging(to_file=False, log_file=DEFAULT_LOG_FILE):
+def setup_logging(to_file=False, log_file=DEFAULT_LOG_FILE, use_queue=False):
     """
     Set up logging configuration.
+
+    Args:
+        to_file (bool): If set, logs are also written to log_file.
+        log_file (str): The log file path.
+        use_queue (bool): If set, records are handed to a QueueListener thread that does the
+            file and console I/O, so logging calls return without waiting on either.
     """
     log_format = "%(asctime)s [%(levelname)s] %(message)s"
     date_format = "%Y-%m-%d %H:%M:%S"
+    handlers = [logging.StreamHandler()]
+    if to_file:
+        handlers.insert(0, logging.FileHandler(log_file))
+
+    if use_queue:
+        formatter = logging.Formatter(log_format, datefmt=date_format)
+        for handler in handlers:
+            handler.setFormatter(formatter)
+        log_queue = queue.SimpleQueue()
+        listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+        listener.start()
+        atexit.register(listener.stop)
+        queue_handler = logging.handlers.QueueHandler(log_queue)
+        queue_handler.setFormatter(logging.Formatter("%(message)s"))  # The listener's handlers add the timestamp and level
+        handlers = [queue_handler]
+
+    logging.basicConfig(level=logging.INFO, format=log_format, datefmt=date_format, handlers=handlers)
     if to_file:
-        logging.basicConfig(
-            level=logging.INFO,
-            format=log_format,
-            datefmt=date_format,
-            handlers=[
-                logging.FileHandler(log_file),
-                logging.StreamHandler()
-            ]
-        )
         logging.info(f"Logging to file: {log_file}")
-    else:
-        logging.basicConfig(level=logging.INFO, format=log_format, datefmt=date_format)
 
+class SkippedRowSummary:
+    """
+    Count skipped rows per reason and keep a sample of their CSV row numbers.
+
+    Args:
+        log_each_row (bool): If set, every skipped row is also logged as it is skipped.
+        sample_size (int): The number of row numbers to keep per reason.
+    """
+
+    def __init__(self, log_each_row=True, sample_size=SKIPPED_ROWS_SAMPLE_SIZE):
+        self.log_each_row = log_each_row
+        self.sample_size = sample_size
+        self.counts = {}
+        self.samples = {}
+
+    def add(self, reason, csv_row_number):
+        """
+        Record one skipped row.
+        """
+        if reason in self.counts:
+            self.counts[reason] += 1
+            if len(self.samples[reason]) < self.sample_size:
+                self.samples[reason].append(csv_row_number)
+        else:
+            self.counts[reason] = 1
+            self.samples[reason] = [csv_row_number]
+
+    @property
+    def total(self):
+        return sum(self.counts.values())
+
+    def log(self):
+        """
+        Log one line per skip reason, most frequent first.
+        """
+        if not self.counts:
+            return
+        logging.info(f"Skipped {self.total} rows:")
+        for reason, count in sorted(self.counts.items(), key=lambda item: -item[1]):
+            sample = ", ".join(str(row_number) for row_number in self.samples[reason])
+            more = ", ..." if count > len(self.samples[reason]) else ""
+            logging.warning(f"  - {reason}: {count} rows (rows {sample}{more})")
+
+@lru_cache(maxsize=TRANSFORM_CACHE_SIZE, typed=True)
 def clean_guid(guid):
     """
     Remove non-alphanumeric characters from a GUID string.
+
+    Results are cached, since the same accountGuid repeats across many rows of a report.
     """
-    return ''.join(ch for ch in str(guid) if ch.isalnum()) if guid else ''
+    if not guid:
+        return ''
+    guid = str(guid)
+    # Fast path for canonical GUIDs, where hyphens are the only non-alphanumeric characters
+    stripped = guid.replace("-", "")
+    if stripped.isalnum():
+        return stripped
+    return ''.join(ch for ch in guid if ch.isalnum())
 
+@lru_cache(maxsize=TRANSFORM_CACHE_SIZE, typed=True)
 def escape_sql_string(s):
     """
     Escape single quotes in a string to protect against SQL insertion.
+
+    Results are cached, since the same plan and domain names repeat across many rows of a report.
+    """
+    return s.replace("'", "''")
+
+def cache_stats():
+    """
+    Get the hit/miss counters of the cached string transforms.
+
+    Returns:
+        stats (dict): Mapping of function name to its hits, misses and current cache size.
+    """
+    return {
+        transform.__name__: {"hits": info.hits, "misses": info.misses, "size": info.currsize}
+        for transform, info in ((clean_guid, clean_guid.cache_info()), (escape_sql_string, escape_sql_string.cache_info()))
+    }
+
+def log_cache_stats():
+    """
+    Log the hit rate of each cached string transform.
     """
-    return s.replace("'", "''")
\ No newline at end of file
+    for name, stats in cache_stats().items():
+        lookups = stats["hits"] + stats["misses"]
+        hit_rate = stats["hits"] / lookups if lookups else 0.0
+        logging.info(f"  - {name}: {stats['hits']} hits, {stats['misses']} misses ({hit_rate:.1%} hit rate), {stats['size']} cached")
\ No newline at end of file
@@ -0,0 +1,53 @@
+import logging
+
+# Skip reasons, in the order the validation rules are applied
+VALID = -1
+MISSING_PART_NUMBER = 0
+ITEM_COUNT_NOT_INTEGER = 1
+ITEM_COUNT_NOT_POSITIVE = 2
+PARTNER_ID_NOT_INTEGER = 3
+PARTNER_ID_SKIPPED = 4
+PART_NUMBER_NOT_IN_TYPEMAP = 5
+INVALID_PLAN_ID = 6
+
+MAX_PLAN_ID_LENGTH = 32
+
+
+def skip_message(reason, partner_id, part_number, partner_purchased_plan_id):
+    """
+    Build the warning text for a row that failed validation.
+    """
+    if reason == MISSING_PART_NUMBER:
+        return "PartNumber is missing"
+    elif reason == ITEM_COUNT_NOT_INTEGER:
+        return "ItemCount is not an integer"
+    elif reason == ITEM_COUNT_NOT_POSITIVE:
+        return "ItemCount is zero or negative"
+    elif reason == PARTNER_ID_NOT_INTEGER:
+        return "PartnerID is not an integer"
+    elif reason == PARTNER_ID_SKIPPED:
+        return f"PartnerID {partner_id} is in the skip list"
+    elif reason == PART_NUMBER_NOT_IN_TYPEMAP:
+        return f"PartNumber {part_number} not found in typemap"
+    return f"Invalid partnerPurchasedPlanID ('{partner_purchased_plan_id}')"
+
+
+def log_rows(row_log, row_offset=0, skip_summary=None):
+    """
+    Log the per-row messages returned by translate_chunk.
+
+    Args:
+        row_log (list): (csv_row_number, level, message) entries in CSV order.
+        row_offset (int): Number of rows to add to each row number, for chunks translated out of place.
+        skip_summary (SkippedRowSummary): If given, skipped rows are counted in it, and only
+            logged one by one if its log_each_row is set.
+    """
+    log_each_row = skip_summary is None or skip_summary.log_each_row
+    for csv_row_number, level, message in row_log:
+        if level == logging.WARNING:
+            if skip_summary is not None:
+                skip_summary.add(message, csv_row_number + row_offset)
+            if log_each_row:
+                logging.warning("%s: skipping row %d", message, csv_row_number + row_offset)
+        else:
+            logging.debug("Processed row %d: %s", csv_row_number + row_offset, message)